@@ -0,0 +1,284 @@
+"""
+Sales analytics from incrementally maintained rollups.
+
+Three small tables hold units and revenue (quantity x price_per_item) so
+reports never scan Order/OrderItem:
+
+    SalesDaily          day x product (with the product's category)
+    SalesMonthly        month x product, for top-N over long ranges
+    SalesCategoryDaily  day x category, plus how many orders touched it
+
+Checkout calls record_order() inside its own transaction; it upserts the
+affected rows with relative increments (INSERT ... ON CONFLICT DO UPDATE
+SET units = units + excluded.units), in sorted key order like
+reserve_stock(), so concurrent checkouts neither lose counts nor deadlock.
+A product keeps the category it was sold under.
+
+Days are shop-local: order_date is stored in UTC and shifted by
+SALES_DAY_OFFSET_MINUTES (default 330, India) before bucketing.
+
+'flask backfill-sales' (and migration 0003) rebuild whole months from the
+order history. Each month is deleted and recomputed in one transaction,
+which on SQLite holds the write lock, so checkouts during a backfill are
+counted exactly once. On Postgres run it when checkout is quiet.
+"""
+import os
+from collections import defaultdict
+from datetime import date,datetime,timedelta
+
+from sqlalchemy import and_,func,select,union_all
+
+from models import db,Product,Order,OrderItem,SalesDaily,SalesMonthly,SalesCategoryDaily
+
+DAY_OFFSET = timedelta(minutes=int(os.getenv('SALES_DAY_OFFSET_MINUTES', 330)))
+
+
+def sales_day(order_date):
+    return (order_date + DAY_OFFSET).date()
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def next_month(day):
+    return (day.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+
+def today():
+    return sales_day(datetime.utcnow())
+
+
+def _dialect_name(bind):
+    dialect = getattr(bind, 'dialect', None)
+    return (dialect or bind.get_bind().dialect).name
+
+
+def _upsert(bind, model, keys, rows, counters):
+    """Add rows' counters onto existing rows with the same keys, inserting missing ones."""
+    if not rows:
+        return
+    table = model.__table__
+    rows = sorted(rows, key=lambda row: tuple(row[key] for key in keys))
+    dialect = _dialect_name(bind)
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        statement = insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=list(keys),
+            set_={column: table.c[column] + statement.excluded[column] for column in counters})
+        bind.execute(statement, rows)
+        return
+    for row in rows:
+        match = and_(*(table.c[key] == row[key] for key in keys))
+        updated = bind.execute(table.update().where(match).values(
+            {column: table.c[column] + row[column] for column in counters})).rowcount
+        if not updated:
+            bind.execute(table.insert().values(row))
+
+
+def _rollup_rows(lines):
+    """lines: (day, order_id, product_id, category, quantity, price) -> rows per rollup table."""
+    daily = defaultdict(lambda: [0, 0.0])
+    monthly = defaultdict(lambda: [0, 0.0])
+    by_category = defaultdict(lambda: [0, 0.0, set()])
+    for day, order_id, product_id, category, quantity, price in lines:
+        revenue = quantity * price
+        for bucket in (daily[(day, product_id, category)], monthly[(month_start(day), product_id, category)],
+                       by_category[(day, category)]):
+            bucket[0] += quantity
+            bucket[1] += revenue
+        if order_id is not None:
+            by_category[(day, category)][2].add(order_id)
+    return (
+        [{'sales_day': d, 'product_id': p, 'category': c, 'units': u, 'revenue': round(r, 2)}
+         for (d, p, c), (u, r) in daily.items()],
+        [{'month': m, 'product_id': p, 'category': c, 'units': u, 'revenue': round(r, 2)}
+         for (m, p, c), (u, r) in monthly.items()],
+        [{'sales_day': d, 'category': c, 'units': u, 'revenue': round(r, 2), 'orders': len(o)}
+         for (d, c), (u, r, o) in by_category.items()],
+    )
+
+
+def _apply(bind, lines):
+    daily, monthly, by_category = _rollup_rows(lines)
+    _upsert(bind, SalesDaily, ('sales_day', 'product_id'), daily, ('units', 'revenue'))
+    _upsert(bind, SalesMonthly, ('month', 'product_id'), monthly, ('units', 'revenue'))
+    _upsert(bind, SalesCategoryDaily, ('sales_day', 'category'), by_category, ('units', 'revenue', 'orders'))
+
+
+def record_order(order, lines):
+    """
+    Add one order to the rollups in the caller's transaction.
+
+    lines: (product_id, category, quantity, price_per_item) for each item.
+    """
+    day = sales_day(order.order_date or datetime.utcnow())
+    _apply(db.session, [(day, order.order_id, product_id, category, quantity, price)
+                        for product_id, category, quantity, price in lines])
+
+
+def record_lines(bind, lines):
+    """
+    Add many orders at once: lines are (order_date, order_id, product_id,
+    category, quantity, price). A line with order_id None adds its units and
+    revenue without counting an order, for items appended to an order that
+    was already counted in that category.
+    """
+    _apply(bind, [(sales_day(order_date), order_id, product_id, category, quantity, price)
+                  for order_date, order_id, product_id, category, quantity, price in lines])
+
+
+def rebuild_month(connection, month):
+    """Recompute one month of rollups from Order/OrderItem; returns the order items read."""
+    month, end = month_start(month), next_month(month)
+    # Delete first: on SQLite that takes the write lock before the orders are read.
+    connection.execute(SalesDaily.__table__.delete().where(
+        SalesDaily.sales_day >= month, SalesDaily.sales_day < end))
+    connection.execute(SalesCategoryDaily.__table__.delete().where(
+        SalesCategoryDaily.sales_day >= month, SalesCategoryDaily.sales_day < end))
+    connection.execute(SalesMonthly.__table__.delete().where(SalesMonthly.month == month))
+
+    utc_start = datetime.combine(month, datetime.min.time()) - DAY_OFFSET
+    utc_end = datetime.combine(end, datetime.min.time()) - DAY_OFFSET
+    rows = connection.execute(
+        select(Order.order_date, Order.order_id, OrderItem.product_id,
+               func.coalesce(Product.category, 'Uncategorised'), OrderItem.quantity, OrderItem.price_per_item)
+        .join(OrderItem, OrderItem.order_id == Order.order_id)
+        .outerjoin(Product, Product.product_id == OrderItem.product_id)
+        .where(Order.order_date >= utc_start, Order.order_date < utc_end)
+    ).all()
+    _apply(connection, [(sales_day(order_date), order_id, product_id, category, quantity, price)
+                        for order_date, order_id, product_id, category, quantity, price in rows])
+    return len(rows)
+
+
+def history_months(connection, start=None, end=None):
+    """Every month from start (default: first order) to end (default: this month)."""
+    if start is None:
+        first = connection.execute(select(func.min(Order.order_date))).scalar()
+        if first is None:
+            return []
+        start = sales_day(first)
+    month, last = month_start(start), month_start(end or today())
+    months = []
+    while month <= last:
+        months.append(month)
+        month = next_month(month)
+    return months
+
+
+def backfill(engine, start=None, end=None, progress=None):
+    """Rebuild every month in range, one transaction per month; returns order items read."""
+    with engine.connect() as connection:
+        months = history_months(connection, start, end)
+    total = 0
+    for month in months:
+        with engine.begin() as connection:
+            read = rebuild_month(connection, month)
+        total += read
+        if progress:
+            progress(month, read)
+    return total
+
+
+# -- queries -----------------------------------------------------------------
+
+def sales_series(start, end, granularity='day', category=None, product_id=None):
+    """
+    [{'period', 'units', 'revenue'}] for start..end inclusive, one entry per
+    day/month with sales. Months at either edge only count the days in range.
+    """
+    if product_id is not None and granularity == 'month':
+        sources = [source.where(source.selected_columns.product_id == product_id)
+                   for source in _product_sources(start, end)]
+        if category:
+            sources = [source.where(source.selected_columns.category == category) for source in sources]
+        combined = (sources[0] if len(sources) == 1 else union_all(*sources)).subquery()
+        rows = db.session.execute(select(combined.c.period, combined.c.units, combined.c.revenue)).all()
+    else:
+        if product_id is not None:
+            model, period = SalesDaily, SalesDaily.sales_day
+        else:
+            model, period = SalesCategoryDaily, SalesCategoryDaily.sales_day
+        query = select(period, func.sum(model.units), func.sum(model.revenue)).where(period >= start, period <= end)
+        if product_id is not None:
+            query = query.where(model.product_id == product_id)
+        if category:
+            query = query.where(model.category == category)
+        rows = db.session.execute(query.group_by(period).order_by(period)).all()
+
+    if granularity == 'month':
+        months = defaultdict(lambda: [0, 0.0])
+        for day, units, revenue in rows:
+            months[month_start(day)][0] += units
+            months[month_start(day)][1] += revenue
+        rows = [(month, units, revenue) for month, (units, revenue) in sorted(months.items())]
+    return [{'period': p.isoformat(), 'units': int(u or 0), 'revenue': round(r or 0, 2)} for p, u, r in rows]
+
+
+def _product_sources(start, end):
+    """
+    Selects of (product_id, category, units, revenue, period) that together
+    cover start..end exactly once: monthly rows for whole months, daily rows
+    at the edges. period is the row's month or day.
+    """
+    first_full = start if start.day == 1 else next_month(start)
+    last_full = month_start(end + timedelta(days=1))  # exclusive: months that end on or before `end`
+    columns = lambda model: (model.product_id, model.category, model.units, model.revenue,
+                             (model.month if model is SalesMonthly else model.sales_day).label('period'))
+    if first_full >= last_full:
+        return [select(*columns(SalesDaily)).where(SalesDaily.sales_day >= start, SalesDaily.sales_day <= end)]
+    sources = [select(*columns(SalesMonthly)).where(SalesMonthly.month >= first_full, SalesMonthly.month < last_full)]
+    if start < first_full:
+        sources.append(select(*columns(SalesDaily)).where(SalesDaily.sales_day >= start,
+                                                          SalesDaily.sales_day < first_full))
+    if last_full <= end:
+        sources.append(select(*columns(SalesDaily)).where(SalesDaily.sales_day >= last_full,
+                                                          SalesDaily.sales_day <= end))
+    return sources
+
+
+def top_sales(start, end, by='product', metric='revenue', limit=10, category=None):
+    """Top products or categories by revenue or units for start..end inclusive."""
+    order_column = 'revenue' if metric == 'revenue' else 'units'
+    if by == 'category':
+        query = (select(SalesCategoryDaily.category.label('category'),
+                        func.sum(SalesCategoryDaily.units).label('units'),
+                        func.sum(SalesCategoryDaily.revenue).label('revenue'),
+                        func.sum(SalesCategoryDaily.orders).label('orders'))
+                 .where(SalesCategoryDaily.sales_day >= start, SalesCategoryDaily.sales_day <= end)
+                 .group_by(SalesCategoryDaily.category))
+        rows = db.session.execute(query.order_by(func.sum(getattr(SalesCategoryDaily, order_column)).desc())
+                                  .limit(limit)).mappings().all()
+        return [{'category': r['category'], 'units': int(r['units']), 'revenue': round(r['revenue'], 2),
+                 'orders': int(r['orders'])} for r in rows]
+
+    sources = _product_sources(start, end)
+    if category:
+        sources = [source.where(source.selected_columns.category == category) for source in sources]
+    combined = (sources[0] if len(sources) == 1 else union_all(*sources)).subquery()
+    totals = (select(combined.c.product_id, func.max(combined.c.category).label('category'),
+                     func.sum(combined.c.units).label('units'), func.sum(combined.c.revenue).label('revenue'))
+              .group_by(combined.c.product_id)
+              .order_by(func.sum(combined.c[order_column]).desc())
+              .limit(limit)).subquery()
+    rows = db.session.execute(
+        select(totals, Product.product_name)
+        .outerjoin(Product, Product.product_id == totals.c.product_id)
+        .order_by(totals.c[order_column].desc())
+    ).mappings().all()
+    return [{'product_id': r['product_id'], 'product_name': r['product_name'], 'category': r['category'],
+             'units': int(r['units']), 'revenue': round(r['revenue'], 2)} for r in rows]
+
+
+def parse_range(start, end, default_days=30):
+    """(start, end) dates from YYYY-MM-DD strings; defaults to the last default_days days."""
+    end = date.fromisoformat(end) if end else today()
+    start = date.fromisoformat(start) if start else end - timedelta(days=default_days - 1)
+    if start > end:
+        raise ValueError('start is after end')
+    return start, end
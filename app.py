@@ -1,54 +1,206 @@
-from flask import Flask,render_template,request,redirect,url_for,flash,session,jsonify
-from models import db,User,Admin,Product,Cart,Payment,Order,OrderItem,DeliveryLocation
-from werkzeug.security import generate_password_hash,check_password_hash
-from flask_login import LoginManager,UserMixin,login_user,login_required,logout_user,current_user
+from flask import Flask,render_template,request,redirect,url_for,flash,session,jsonify,current_app,stream_with_context
+from flask.cli import with_appcontext
+from markupsafe import Markup
+from models import db,User,Admin,Product,Cart,Payment,Order,OrderItem,DeliveryLocation,DeliveryZone,Subscription
+from stats import get_store_stats,bump_store_stats,refresh_store_stats
+from catalog import catalog_cache,API_FIELDS,api_dict,live_stock
+import images
+from assets import assets,build_assets
+from outbox import enqueue_email,run_worker
+from database import configure_database,dispose_engines_after_fork
+from passwords import password_hasher,HasherBusy
+import identity
+import metrics
+from identity import load_user,load_admin,current_admin
+from migrations import init_db,upgrade,pending_migrations
+import search
+from inventory import OutOfStock,reserve_stock,insert_order_items
+import exports
+import analytics
+import dispatch
+from zones import zone_cache
+import zones
+from geocoding import geocoder,GeocoderUnavailable
+import locations
+import subscriptions
+from carts import cart_lines,cart_total,parse_cart_changes,apply_cart_changes,add_one
+from carts import session_cart_count,adjust_cart_count,set_cart_count,forget_cart_count
+from sqlalchemy import and_,or_
+from sqlalchemy.orm import selectinload,joinedload
+from datetime import datetime,timedelta
+from flask_login import login_user,logout_user,current_user
 import os 
 from flask_mail import Mail,Message
 import os 
 from dotenv import load_dotenv 
 import logging
+import logconfig
+import click
+import hashlib
+import time
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Read .env before anything below looks at the environment
+load_dotenv()
+
+# Configure logging (LOG_LEVEL / LOG_FORMAT, see logconfig.py)
+logconfig.configure_logging()
 logger = logging.getLogger(__name__)
 
-app=Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI']='sqlite:///users.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS']=False
-app.config['SECRET_KEY']='your_secret_key'
+mail=Mail()
 
-# Email configuration with timeout settings
-app.config['MAIL_SERVER']='smtp.gmail.com'
-app.config['MAIL_PORT']=587
-app.config['MAIL_USE_TLS']=True
-app.config['MAIL_USE_SSL']=False
-app.config['MAIL_USERNAME']=os.getenv("EMAIL")  
-app.config['MAIL_PASSWORD']=os.getenv("PASSWORD")  
-app.config['MAIL_DEFAULT_SENDER']=os.getenv("EMAIL")
-app.config['MAIL_DEBUG']=False  # Disable debug in production
-app.config['MAIL_SUPPRESS_SEND']=os.getenv('FLASK_ENV') == 'production'  # Suppress email in production
+# Views and CLI commands are declared at module level and attached to each
+# app by create_app(), so endpoint names stay 'login', 'cart', ... and
+# url_for() in the templates is unchanged.
+_routes=[]
+_commands=[]
 
-load_dotenv() 
+def route(rule, **options):
+    def decorator(view):
+        _routes.append((rule, options, view))
+        return view
+    return decorator
 
-mail=Mail(app)
+def cli_command(name):
+    def decorator(f):
+        command = click.command(name)(with_appcontext(f))
+        _commands.append(command)
+        return command
+    return decorator
 
+def create_app(config=None):
+    """
+    Build and configure the application.
 
+    Nothing here touches the database: tables and migrations are applied by
+    'flask init-db' (or on startup when INIT_DB_ON_START=1, which under
+    'gunicorn --preload' runs once in the parent before the workers fork).
+    """
+    app=Flask(__name__)
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS']=False
+    app.config['SECRET_KEY']='your_secret_key'
+    app.config['ORDERS_PER_PAGE']=int(os.getenv('ORDERS_PER_PAGE', 50))
+    app.config['CATALOG_API_PAGE_SIZE']=int(os.getenv('CATALOG_API_PAGE_SIZE', 50))
+    app.config['CATALOG_API_MAX_AGE']=int(os.getenv('CATALOG_API_MAX_AGE', 60))
+    app.config['DEPOT_LATITUDE']=float(os.getenv('DEPOT_LATITUDE', 18.5204))
+    app.config['DEPOT_LONGITUDE']=float(os.getenv('DEPOT_LONGITUDE', 73.8567))
+    app.config['DELIVERY_MAX_STOPS']=int(os.getenv('DELIVERY_MAX_STOPS', 25))
+    app.config['DELIVERY_MAX_UNITS']=int(os.getenv('DELIVERY_MAX_UNITS', 0))
+    app.config['DELIVERY_LOOKBACK_DAYS']=int(os.getenv('DELIVERY_LOOKBACK_DAYS', 7))
+    app.config['INIT_DB_ON_START']=os.getenv('INIT_DB_ON_START','false').lower() in ('1','true','yes')
+
+    # Email configuration with timeout settings
+    app.config['MAIL_SERVER']=os.getenv('MAIL_SERVER','smtp.gmail.com')
+    app.config['MAIL_PORT']=int(os.getenv('MAIL_PORT',587))
+    app.config['MAIL_USE_TLS']=os.getenv('MAIL_USE_TLS','true').lower()=='true'
+    app.config['MAIL_USE_SSL']=False
+    app.config['MAIL_USERNAME']=os.getenv("EMAIL")  
+    app.config['MAIL_PASSWORD']=os.getenv("PASSWORD")  
+    app.config['MAIL_DEFAULT_SENDER']=os.getenv("EMAIL")
+    app.config['MAIL_DEBUG']=False  # Disable debug in production
+    app.config['MAIL_SUPPRESS_SEND']=os.getenv('FLASK_ENV') == 'production'  # Suppress email in production
+
+    if config:
+        app.config.update(config)
+
+    logconfig.init_app(app)
+    configure_database(app)
+    password_hasher.init_app(app)
+    identity.init_app(app)
+    db.init_app(app)
+    dispose_engines_after_fork(app, db)
+    metrics.init_app(app)
+    catalog_cache.init_app(app)
+    zone_cache.init_app(app)
+    geocoder.init_app(app)
+    assets.init_app(app)
+    mail.init_app(app)
+
+    app.add_template_global(image_variants)
+    for rule, options, view in _routes:
+        app.add_url_rule(rule, view_func=view, **options)
+    for command in _commands:
+        app.cli.add_command(command)
+
+    if app.config['INIT_DB_ON_START']:
+        with app.app_context():
+            try:
+                init_db()
+                logger.info("Database tables created successfully!")
+            except Exception as e:
+                logger.error(f"Error creating database tables: {e}")
+    return app
+
+def __getattr__(name):
+    # 'gunicorn app:app', 'flask --app app' and 'from app import app' get a
+    # default app, built on first use rather than at import.
+    if name == 'app':
+        globals()['app'] = create_app()
+        return globals()['app']
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def image_dir():
+    return os.path.join(current_app.static_folder, 'images')
+
+def image_variants(filename):
+    return images.image_variants(image_dir(), filename)
+
+def encode_order_cursor(order):
+    """Cursor for keyset pagination: the (order_date, order_id) of the last row shown."""
+    return f"{order.order_date.isoformat()}_{order.order_id}"
+
+def decode_order_cursor(cursor):
+    try:
+        order_date, order_id = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(order_date), int(order_id)
+    except (AttributeError, ValueError):
+        return None
 
-db.init_app(app)
+def order_page(query, cursor=None, per_page=None):
+    """
+    Return one page of orders (newest first) plus the cursor of the next page.
 
-# Create tables before first request
-with app.app_context():
+    Users, order items and their products are loaded with selectin eager loads,
+    so a page costs a fixed number of queries however many rows it shows, and
+    seeking on (order_date, order_id) keeps deep pages as cheap as the first.
+    """
+    per_page = per_page or current_app.config['ORDERS_PER_PAGE']
+    query = query.options(
+        selectinload(Order.user),
+        selectinload(Order.order_items).selectinload(OrderItem.product),
+    ).order_by(Order.order_date.desc(), Order.order_id.desc())
+
+    position = decode_order_cursor(cursor) if cursor else None
+    if position:
+        order_date, order_id = position
+        query = query.filter(or_(
+            Order.order_date < order_date,
+            and_(Order.order_date == order_date, Order.order_id < order_id),
+        ))
+
+    rows = query.limit(per_page + 1).all()
+    next_cursor = encode_order_cursor(rows[per_page - 1]) if len(rows) > per_page else None
+    return rows[:per_page], next_cursor
+
+BUSY_MESSAGE = "We're handling a lot of sign-ins right now. Please try again in a moment."
+
+def upgrade_password_hash(account, field, password):
+    """Re-hash with the current method/cost after a successful login, if the stored hash is older."""
+    if not password_hasher.needs_rehash(getattr(account, field)):
+        return
     try:
-        db.create_all()
-        print("Database tables created successfully!")
+        setattr(account, field, password_hasher.hash(password))
+        db.session.commit()
+    except HasherBusy:
+        pass
     except Exception as e:
-        print(f"Error creating database tables: {e}")
+        db.session.rollback()
+        logger.error(f"Failed to upgrade password hash: {e}")
 
-@app.route('/')
+@route('/')
 def landing():
     return render_template('landing.html')
 
-@app.route('/register',methods=['GET','POST'])
+@route('/register',methods=['GET','POST'])
 def register():
     register_message=""
     if request.method=='POST':
@@ -72,7 +224,7 @@ def register():
             return render_template('register.html', register_message=register_message)
 
         try:
-            hashed_password=generate_password_hash(password=password,method="pbkdf2:sha256",salt_length=16)
+            hashed_password=password_hasher.hash(password)
 
             new_user=User(
                 username=username,
@@ -83,11 +235,16 @@ def register():
             )
             
             db.session.add(new_user)
+            bump_store_stats(total_customers=1)
             db.session.commit()
             register_message="Registration successful! Please log in."
             flash(register_message,'success')
             return redirect(url_for('login'))
             
+        except HasherBusy:
+            register_message = BUSY_MESSAGE
+            flash(register_message, 'warning')
+            return render_template('register.html', register_message=register_message), 503
         except Exception as e:
             db.session.rollback()
             register_message = "Registration failed. Please try again with different details."
@@ -96,7 +253,7 @@ def register():
     
     return render_template('register.html',register_message=register_message)
 
-@app.route('/login',methods=['GET','POST'])
+@route('/login',methods=['GET','POST'])
 def login():
     login_message=""
     if request.method=='POST':
@@ -117,9 +274,19 @@ def login():
                 flash(login_message,'danger')
                 return render_template('login.html',login_message=login_message)
 
-        if user and check_password_hash(user.password,password):
+        try:
+            password_ok = bool(user) and password_hasher.verify(user.password,password)
+        except HasherBusy:
+            login_message=BUSY_MESSAGE
+            flash(login_message,'warning')
+            return render_template('login.html',login_message=login_message), 503
+
+        if password_ok:
+            upgrade_password_hash(user,'password',password)
+            login_user(load_user(user.user_id))
             session['user_id'] = user.user_id
             session['username'] = user.username
+            forget_cart_count()
             login_message="Login successful!"
             flash(login_message,'success')
             return redirect(url_for('home',user_id=user.user_id))
@@ -129,38 +296,41 @@ def login():
     return render_template('login.html',login_message=login_message)
 
 
-@app.route('/home/<int:user_id>')
+@route('/home/<int:user_id>')
 def home(user_id):
-    user = db.session.get(User, user_id)
+    user = load_user(user_id)
     if user:
         return render_template('home.html', user=user)
     else:
         flash('User not found.', 'danger')
         return redirect(url_for('login'))
 
-@app.route('/logout')
+@route('/logout')
 def logout():
+    logout_user()
     session.clear()
     flash('You have been logged out.', 'info')
     return redirect(url_for('landing'))
 
-@app.route('/products')
+@route('/products')
 def products():
-    user_id = session.get('user_id')
-    user = None
-    if user_id:
-        user = db.session.get(User, user_id)
+    user = current_user if current_user.is_authenticated else None
     
     try:
-        products = Product.query.all()
+        products = catalog_cache.products()
+        product_grid = catalog_cache.product_grid(
+            lambda items: Markup(render_template('_product_grid.html', products=items)))
     except Exception as e:
-        print(f"Database error: {e}")
+        logger.error(f"Database error loading products: {e}")
         products = []
+        product_grid = Markup(render_template('_product_grid.html', products=products))
         flash('Unable to load products. Please try again later.', 'warning')
     
-    return render_template('products.html', user=user, products=products)
+    cart_count = session_cart_count(user.user_id) if user else 0
+    return render_template('products.html', user=user, products=products, product_grid=product_grid,
+                           cart_count=cart_count)
 
-@app.route('/admin_register',methods=['GET','POST'])
+@route('/admin_register',methods=['GET','POST'])
 def admin_register():
     admin_register_message=""
     if request.method=='POST':
@@ -176,7 +346,7 @@ def admin_register():
             return render_template('admin_register.html',admin_register_message=admin_register_message)
         
         try:
-            hashed_password=generate_password_hash(password=admin_password,method="pbkdf2:sha256",salt_length=16)
+            hashed_password=password_hasher.hash(admin_password)
 
             new_admin=Admin(
                 admin_name=admin_name,
@@ -189,6 +359,10 @@ def admin_register():
             admin_register_message="Admin Registration successful! Please log in."
             flash(admin_register_message,'success')
             return redirect(url_for('admin_login'))
+        except HasherBusy:
+            admin_register_message=BUSY_MESSAGE
+            flash(admin_register_message,'warning')
+            return render_template('admin_register.html',admin_register_message=admin_register_message), 503
         except Exception as e:
             db.session.rollback()
             admin_register_message="Admin Registration failed. Please try again with different details."
@@ -197,14 +371,21 @@ def admin_register():
     return render_template('admin_register.html',admin_register_message=admin_register_message)
         
 
-@app.route('/admin_login',methods=['GET','POST'])
+@route('/admin_login',methods=['GET','POST'])
 def admin_login():
     admin_login_message=""
     if request.method=='POST':
         admin_email=request.form.get('admin_email')
         admin_password=request.form.get('admin_password')
         admin=Admin.query.filter_by(admin_email=admin_email).first()
-        if admin_email and check_password_hash(admin.admin_password,admin_password):
+        try:
+            password_ok=bool(admin) and password_hasher.verify(admin.admin_password,admin_password)
+        except HasherBusy:
+            admin_login_message=BUSY_MESSAGE
+            flash(admin_login_message,'warning')
+            return render_template('admin_login.html',admin_login_message=admin_login_message), 503
+        if password_ok:
+            upgrade_password_hash(admin,'admin_password',admin_password)
             session['admin_id']=admin.admin_id
             session['admin_name']=admin.admin_name
             admin_login_message="Admin Login successful!"
@@ -215,19 +396,19 @@ def admin_login():
             flash(admin_login_message,'danger')
     return render_template('admin_login.html',admin_login_message=admin_login_message)
         
-@app.route('/admin_dashboard/<int:admin_id>')
+@route('/admin_dashboard/<int:admin_id>')
 def admin_dashboard(admin_id):
-    admin=db.session.get(Admin, admin_id)
+    admin=load_admin(admin_id)
     if admin:
         try:
             products = Product.query.all()
-            total_products = len(products)
-            customers=User.query.all()
-            total_customers = len(customers)
+            stats = get_store_stats()
+            total_products = stats.total_products
+            total_customers = stats.total_customers
+            total_orders = stats.total_orders
+            total_revenue = stats.total_revenue
 
-            orders = Order.query.order_by(Order.order_date.desc()).all()
-            total_orders = Order.query.count()
-            total_revenue = sum(order.total_amount for order in orders)
+            orders, next_cursor = order_page(Order.query, request.args.get('before'))
 
             return render_template('admin_dashboard.html',
                                  admin=admin, 
@@ -236,7 +417,8 @@ def admin_dashboard(admin_id):
                                  total_customers=total_customers,
                                  total_orders=total_orders,
                                  total_revenue=total_revenue,
-                                 orders=orders)
+                                 orders=orders,
+                                 next_cursor=next_cursor)
         except Exception as e:
             flash(f'Database error: {str(e)}. Please refresh the page.', 'danger')
             return render_template('admin_dashboard.html',
@@ -246,20 +428,27 @@ def admin_dashboard(admin_id):
                                  total_customers=0,
                                  total_orders=0,
                                  total_revenue=0,
-                                 orders=[])
+                                 orders=[],
+                                 next_cursor=None)
     else:
         flash('Admin not found. Please log in.','danger')
         return redirect(url_for('admin_login'))
     
-@app.route('/admin_logout')
+@route('/admin/catalog_cache')
+def catalog_cache_stats():
+    if not session.get('admin_id'):
+        return jsonify({'error': 'not_logged_in'}), 401
+    return jsonify(catalog_cache.stats())
+
+@route('/admin_logout')
 def admin_logout():
     session.clear()
     flash('Admin has been logged out.','info')
     return redirect(url_for('landing'))
 
-@app.route('/add_product',methods=['GET','POST'])
+@route('/add_product',methods=['GET','POST'])
 def add_product():
-    admin=db.session.get(Admin, session.get('admin_id'))
+    admin=current_admin()
     if not admin:
         flash('Admin not found. Please log in.','danger')
         return redirect(url_for('admin_login'))
@@ -278,8 +467,9 @@ def add_product():
         
         if product_image and product_image.filename:
             image_filename=product_image.filename
-            image_path=os.path.join('static/images',image_filename)
+            image_path=os.path.join(image_dir(),image_filename)
             product_image.save(image_path)
+            images.generate_later(image_dir(),image_filename,on_done=catalog_cache.bump)
             image_db_path = image_filename
         else:
             image_db_path = None
@@ -294,7 +484,11 @@ def add_product():
                 product_image=image_db_path
             )
             db.session.add(new_product)
+            db.session.flush()
+            search.index_product(new_product)
+            bump_store_stats(total_products=1)
             db.session.commit()
+            catalog_cache.bump()
             flash('Product added successfully!','success')
             return redirect(url_for('admin_dashboard',admin_id=admin.admin_id))
         except Exception as e:
@@ -303,9 +497,9 @@ def add_product():
 
     return redirect(url_for('admin_dashboard',admin_id=admin.admin_id))
 
-@app.route('/delete_product/<int:product_id>', methods=['POST', 'GET'])
+@route('/delete_product/<int:product_id>', methods=['POST', 'GET'])
 def delete_product(product_id):
-    admin=db.session.get(Admin, session.get('admin_id'))
+    admin=current_admin()
     if not admin:
         flash('Admin not found. Please log in.','danger')
         return redirect(url_for('admin_login'))
@@ -315,7 +509,10 @@ def delete_product(product_id):
         return redirect(url_for('admin_dashboard', admin_id=admin.admin_id))
     try:
         db.session.delete(product)
+        search.unindex_product(product_id)
+        bump_store_stats(total_products=-1)
         db.session.commit()
+        catalog_cache.bump()
         flash('Product deleted successfully!','success')
     except Exception as e:
         db.session.rollback()
@@ -323,9 +520,9 @@ def delete_product(product_id):
         return redirect(url_for('admin_dashboard', admin_id=admin.admin_id))
     return redirect(url_for('admin_dashboard', admin_id=admin.admin_id))     
 
-@app.route('/update_product/<int:product_id>',methods=['GET','POST'])
+@route('/update_product/<int:product_id>',methods=['GET','POST'])
 def update_product(product_id):
-    admin=db.session.get(Admin, session.get('admin_id'))
+    admin=current_admin()
     if not admin:
         flash('Admin not found. Please log in.','danger')
         return redirect(url_for('admin_login'))
@@ -346,9 +543,13 @@ def update_product(product_id):
             return redirect(url_for('admin_dashboard',admin_id=admin.admin_id))
         if product_image and product_image.filename:
             image_filename=product_image.filename
-            image_path=os.path.join('static/images',image_filename)
+            image_path=os.path.join(image_dir(),image_filename)
             product_image.save(image_path)
+            images.generate_later(image_dir(),image_filename,on_done=catalog_cache.bump)
+            replaced_image=product.product_image if product.product_image!=image_filename else None
             product.product_image=image_filename
+        else:
+            replaced_image=None
         
         product.product_name=product_name
         product.description=description
@@ -357,7 +558,11 @@ def update_product(product_id):
         product.stock=int(stock)
 
         try:
+            search.index_product(product)
             db.session.commit() 
+            catalog_cache.bump()
+            if replaced_image and not Product.query.filter_by(product_image=replaced_image).first():
+                images.remove_derivatives(image_dir(),replaced_image)
             flash("Product Update Successfully!", "success")
             return redirect(url_for('admin_dashboard',admin_id=admin.admin_id))
         except Exception as e:
@@ -367,7 +572,7 @@ def update_product(product_id):
         
     return render_template('admin_dashboard.html',product=product,admin=admin)
     
-@app.route('/add_to_cart/<int:product_id>', methods=['POST'])
+@route('/add_to_cart/<int:product_id>', methods=['POST'])
 def add_to_cart(product_id):
     user_id = session.get('user_id')
     
@@ -375,8 +580,8 @@ def add_to_cart(product_id):
         flash('Please log in to add items to cart.', 'warning')
         return redirect(url_for('login'))
     
-    user = db.session.get(User, user_id)
-    if not user:
+    user = current_user
+    if not user.is_authenticated:
         flash('User not found. Please log in again.', 'danger')
         return redirect(url_for('login'))
     
@@ -385,20 +590,13 @@ def add_to_cart(product_id):
         flash('Product not found.', 'danger')
         return redirect(url_for('products'))
     
-    existing_cart_item = Cart.query.filter_by(user_id=user_id, product_id=product_id).first()
-    
     try:
-        if existing_cart_item:
-            existing_cart_item.quantity += 1
-        else:
-            new_cart_item = Cart(
-                user_id=user_id,
-                product_id=product_id,
-                quantity=1
-            )
-            db.session.add(new_cart_item)
-        
+        _, added = add_one(user_id, product_id, request.form.get('request_token'))
         db.session.commit()
+        if added:
+            adjust_cart_count(1)
+        else:
+            forget_cart_count()  # the first attempt's session update may have been lost with its response
         flash(f'{product.product_name} added to cart successfully!', 'success')
     except Exception as e:
         db.session.rollback()
@@ -407,7 +605,99 @@ def add_to_cart(product_id):
     return redirect(url_for('cart'))
 
 
-@app.route('/cart',methods=['GET','POST'])
+CATALOG_API_MAX_PAGE_SIZE = 200
+
+@route('/api/products')
+def api_products():
+    """
+    Catalog page as JSON: ?after=<cursor>&limit=<n>&fields=product_id,price,...
+
+    Served from the catalog snapshot. The strong ETag covers the catalog
+    version, the request shape and (only when stock is requested) the live
+    stock of the page's rows, so unchanged pages revalidate with a 304 and
+    no serialisation.
+    """
+    try:
+        after = int(request.args['after']) if request.args.get('after') else None
+        limit = int(request.args.get('limit', current_app.config['CATALOG_API_PAGE_SIZE']))
+    except ValueError:
+        return jsonify({'error': 'invalid_cursor'}), 400
+    limit = max(1, min(limit, CATALOG_API_MAX_PAGE_SIZE))
+
+    fields = API_FIELDS
+    if request.args.get('fields'):
+        requested = [f.strip() for f in request.args['fields'].split(',') if f.strip()]
+        unknown = [f for f in requested if f not in API_FIELDS]
+        if unknown:
+            return jsonify({'error': 'unknown_fields', 'fields': unknown, 'allowed': list(API_FIELDS)}), 400
+        fields = tuple(f for f in API_FIELDS if f == 'product_id' or f in requested)
+
+    try:
+        version = catalog_cache.version()
+        rows, next_cursor = catalog_cache.page(after, limit)
+        stock = live_stock([row.product_id for row in rows]) if 'stock' in fields else None
+    except Exception as e:
+        logger.error(f"Catalog API failed: {e}")
+        return jsonify({'error': 'catalog_unavailable'}), 503
+
+    validator = f"{version}|{after}|{limit}|{','.join(fields)}"
+    if stock is not None:
+        validator += '|' + ','.join(f"{pid}:{qty}" for pid, qty in sorted(stock.items()))
+    etag = hashlib.sha1(validator.encode()).hexdigest()
+
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = jsonify({'products': [api_dict(row, fields, stock) for row in rows],
+                            'next_cursor': next_cursor, 'limit': limit})
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config['CATALOG_API_MAX_AGE']
+    return response
+
+@route('/api/products/search')
+def api_search_products():
+    """Ranked prefix search over product names/descriptions with category facets."""
+    try:
+        page = int(request.args.get('page', 1))
+        per_page = int(request.args.get('per_page', 20))
+    except ValueError:
+        return jsonify({'error': 'invalid_page'}), 400
+    try:
+        return jsonify(search.search_products(request.args.get('q', ''),
+                                              category=request.args.get('category') or None,
+                                              page=page, per_page=per_page))
+    except Exception as e:
+        logger.error(f"Product search failed: {e}")
+        return jsonify({'error': 'search_unavailable'}), 503
+
+@route('/api/cart/add/<int:product_id>', methods=['POST'])
+def api_add_to_cart(product_id):
+    """Add one unit without a redirect; returns the line quantity and the cart badge count."""
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({'error': 'not_logged_in', 'login_url': url_for('login')}), 401
+
+    try:
+        if db.session.get(Product, product_id) is None:
+            return jsonify({'error': 'product_not_found'}), 404
+        cart_item, added = add_one(user_id, product_id, request.headers.get('X-Request-Token'))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+    if added:
+        adjust_cart_count(1)
+    else:
+        forget_cart_count()
+    return jsonify({
+        'product_id': product_id,
+        'quantity': cart_item.quantity,
+        'cart_count': session_cart_count(user_id),
+    })
+
+@route('/cart',methods=['GET','POST'])
 def cart():
     user_id=session.get('user_id')
     
@@ -415,14 +705,15 @@ def cart():
         flash('Please log in to view your cart.','warning')
         return redirect(url_for('login'))
     
-    user=db.session.get(User, user_id)
-    if not user:
+    user=current_user
+    if not user.is_authenticated:
         flash('User not found. Please log in again.','danger')
         return redirect(url_for('login'))
     
     try:
-        cart_items=Cart.query.filter_by(user_id=user.user_id).all()
-        total_amount=sum(item.product.price * item.quantity for item in cart_items)
+        cart_items=cart_lines(user.user_id)
+        total_amount=cart_total(user.user_id)
+        set_cart_count(sum(item.quantity for item in cart_items))
         return render_template('cart.html',user=user,cart_items=cart_items,total_amount=total_amount)
     except Exception as e:
         flash(f'Database error: {str(e)}. Please refresh the page.','danger')
@@ -430,7 +721,7 @@ def cart():
 
     return render_template('cart.html',user=user,cart_items=cart_items,total_amount=total_amount)
 
-@app.route('/remove_from_cart/<int:product_id>', methods=['POST'])
+@route('/remove_from_cart/<int:product_id>', methods=['POST'])
 def remove_from_cart(product_id):
     user_id = session.get('user_id')
     if not user_id:
@@ -441,8 +732,10 @@ def remove_from_cart(product_id):
     
     if cart_item:
         try:
+            removed_quantity = cart_item.quantity
             db.session.delete(cart_item)
             db.session.commit()
+            adjust_cart_count(-removed_quantity)
             flash('Item removed from cart successfully!', 'success')
         except Exception as e:
             db.session.rollback()
@@ -453,7 +746,7 @@ def remove_from_cart(product_id):
     return redirect(url_for('cart'))
 
 
-@app.route('/update_cart', methods=['POST'])
+@route('/update_cart', methods=['POST'])
 def update_cart():
     user_id = session.get('user_id')
     if not user_id:
@@ -479,40 +772,68 @@ def update_cart():
         if quantity <= 0:
             db.session.delete(cart_item)
             db.session.commit()
-            remaining = Cart.query.filter_by(user_id=user_id).all()
-            grand_total = sum(i.product.price * i.quantity for i in remaining)
-            return jsonify({'item_total': 0, 'grand_total': grand_total})
+            forget_cart_count()
+            return jsonify({'item_total': 0, 'grand_total': cart_total(user_id)})
 
         cart_item.quantity = quantity
         db.session.commit()
+        forget_cart_count()
 
         # compute totals
         item_total = cart_item.product.price * cart_item.quantity
-        grand_total = sum(i.product.price * i.quantity for i in Cart.query.filter_by(user_id=user_id).all())
-        return jsonify({'item_total': item_total, 'grand_total': grand_total})
+        return jsonify({'item_total': item_total, 'grand_total': cart_total(user_id)})
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@route('/update_cart/batch', methods=['POST'])
+def update_cart_batch():
+    """Apply several quantity changes in one transaction: {"items": [{"product_id", "quantity"}, ...]}."""
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({'error': 'not_logged_in'}), 401
+
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({'error': 'invalid_payload'}), 400
+
+    try:
+        changes = parse_cart_changes(data.get('items'))
+    except ValueError:
+        return jsonify({'error': 'invalid_items'}), 400
+
+    try:
+        item_totals, missing = apply_cart_changes(user_id, changes)
+        db.session.commit()
+        forget_cart_count()
+        return jsonify({
+            'items': {str(product_id): total for product_id, total in item_totals.items()},
+            'missing': missing,
+            'grand_total': cart_total(user_id),
+        })
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
-@app.route('/payment')
+@route('/payment')
 def payment():
     user_id = session.get('user_id')
     if not user_id:
         flash('Please log in to proceed with payment.', 'warning')
         return redirect(url_for('login'))
     
-    user = db.session.get(User, user_id)
-    if not user:
+    user = current_user
+    if not user.is_authenticated:
         flash('User not found. Please log in again.', 'danger')
         return redirect(url_for('login'))
     
     try:
-        cart_items = Cart.query.filter_by(user_id=user.user_id).all()
+        cart_items = cart_lines(user.user_id)
         if not cart_items:
             flash('Your cart is empty.', 'warning')
             return redirect(url_for('products'))
         
-        total_amount = sum(item.product.price * item.quantity for item in cart_items)
+        total_amount = cart_total(user.user_id)
         
         session['payment_amount'] = total_amount
         
@@ -524,46 +845,91 @@ def payment():
         flash(f'Error processing payment: {str(e)}', 'danger')
         return redirect(url_for('cart'))
 
-@app.route('/payment_success',methods=['GET','POST'])
+def order_confirmation_body(user, order, payment_method):
+    return f"""Hello {user.username},
+
+Your order has been placed successfully! 🎉
+
+📋 ORDER DETAILS:
+• Order ID: #{order.order_id}
+• Amount: ₹{order.total_amount}
+• Payment Method: {payment_method}
+• Order Date: {order.order_date.strftime('%d/%m/%Y at %I:%M %p')}
+
+🚚 DELIVERY ADDRESS:
+{user.address}
+
+📞 CONTACT: {user.phone}
+
+Your fresh dairy products will be delivered soon!
+
+Thank you for choosing Sudhamrit Dairy Farm! 🥛
+
+Best Regards,
+Sudhamrit Dairy Farm Team
+Email: support@sudhamritdairy.com
+Phone: +91-XXXXXXXXXX
+"""
+
+@route('/payment_success',methods=['GET','POST'])
 def payment_success():
     """
     Process payment and create order - Fixed for production deployment
     """
-    print("🚀 Starting payment processing...")
-    
     user_id = session.get('user_id')
     if not user_id:
         flash('Please log in to proceed with payment.', 'warning')
         return redirect(url_for('login'))
     
-    user = db.session.get(User, user_id)
-    if not user:
+    user = current_user
+    if not user.is_authenticated:
         flash('User not found. Please log in again.', 'danger')
         return redirect(url_for('login'))
     
     payment_method = request.form.get('payment_method')
-    print(f"Processing payment for user {user.username} (ID: {user_id})")
-    print(f"Payment method: {payment_method}")
+    logger.debug("Starting payment processing, method %s", payment_method)
 
     try:
-        cart_items = Cart.query.filter_by(user_id=user.user_id).all()
+        cart_items = cart_lines(user.user_id)
         total_amount = session.get('payment_amount', 0)
         
-        print(f"Found {len(cart_items)} items in cart")
-        print(f"Total amount: ₹{total_amount}")
+        logger.debug("Found %s items in cart, total %s", len(cart_items), total_amount)
 
         if not cart_items:
-            print("Cart is empty")
+            logger.info("Checkout with an empty cart")
             flash('Your cart is empty.', 'warning')
             return redirect(url_for('products'))
         
         if total_amount <= 0:
-            print("Invalid payment amount")
+            logger.warning("Checkout with invalid payment amount %s", total_amount)
             flash('Invalid payment amount.', 'danger')
             return redirect(url_for('cart'))
         
-        # Step 1: Create Payment Record
-        print("Creating payment record...")
+        latitude = request.form.get('latitude') or session.get('latitude')
+        longitude = request.form.get('longitude') or session.get('longitude')
+        if latitude or longitude:
+            try:
+                zones.parse_point(latitude, longitude)
+            except ValueError:
+                logger.info("Checkout rejected: invalid delivery coordinates %r,%r", latitude, longitude)
+                flash('The selected delivery location is not valid. Please choose it again on the map.', 'warning')
+                return redirect(url_for('cart'))
+        # The order ships to the latest saved location, copied onto it below, so that is what must be served.
+        ship_to = locations.latest(user.user_id)
+        if zone_cache.index().enforced:
+            if ship_to is None:
+                logger.info("Checkout rejected: no saved delivery location")
+                flash('Please choose a delivery location before paying.', 'warning')
+                return redirect(url_for('cart'))
+            if not zones.check(ship_to.latitude, ship_to.longitude)[0]:
+                logger.info("Checkout rejected: delivery location %s is outside every zone", ship_to.location_id)
+                flash('Sorry, we do not deliver to the selected location yet.', 'warning')
+                return redirect(url_for('cart'))
+
+        # Step 1: Take stock for every line; raises OutOfStock before anything is written
+        reserve_stock((item.product_id, item.quantity) for item in cart_items)
+
+        # Step 2: Create Payment Record
         new_payment = Payment(
             user_id=user.user_id,
             amount=total_amount,
@@ -572,116 +938,78 @@ def payment_success():
         )
         db.session.add(new_payment)
         db.session.flush()
-        print(f"Payment record created with ID: {new_payment.payment_id}")
+        logger.debug("Payment record created with ID %s", new_payment.payment_id)
 
-        print("Creating order record...")
         new_order = Order(
             payment_id=new_payment.payment_id,
             user_id=user.user_id,
             total_amount=total_amount,
-            status='Completed'
+            status='Completed',
+            delivery_address=ship_to.address if ship_to else None,
+            delivery_latitude=ship_to.latitude if ship_to else None,
+            delivery_longitude=ship_to.longitude if ship_to else None
         )
         db.session.add(new_order)
         db.session.flush()
-        print(f"Order record created with ID: {new_order.order_id}")
-
-        print("Creating order items...")
-        for item in cart_items:
-            order_item = OrderItem(
-                order_id=new_order.order_id,
-                product_id=item.product_id,
-                quantity=item.quantity,
-                price_per_item=item.product.price
-            )
-            db.session.add(order_item)
-            print(f"  - Added {item.product.product_name} x {item.quantity}")
+        logconfig.bind(order_id=new_order.order_id)
+        logger.debug("Order record created")
+
+        insert_order_items(new_order.order_id,
+                           [(item.product_id, item.quantity, item.product.price) for item in cart_items])
+        logger.debug("Added %s order items", len(cart_items))
+        analytics.record_order(new_order, [(item.product_id, item.product.category, item.quantity, item.product.price)
+                                           for item in cart_items])
         
-        print("Clearing cart...")
         Cart.query.filter_by(user_id=user.user_id).delete()
+        bump_store_stats(total_orders=1, total_revenue=total_amount)
+        
+        enqueue_email(
+            recipient=user.email,
+            subject="Order Confirmation - Sudhamrit Dairy Farm",
+            body=order_confirmation_body(user, new_order, payment_method),
+            order_id=new_order.order_id,
+        )
         
         db.session.commit()
-        print("All database changes committed successfully!")
+        logger.info("Order placed: %s items, total %s, payment method %s", len(cart_items), total_amount, payment_method)
         session.pop('payment_amount', None)
-        print("Session data cleared")
-
-        
-        flash("Order placed successfully!", "success")
+        set_cart_count(0)
 
-       
-        email_sent = False
         
-        if os.getenv('FLASK_ENV') == 'production':
-            print("Skipping email in production environment")
-            flash("Order placed successfully! You will receive confirmation via SMS/WhatsApp.", "warning")
-        else:
-            try:
-                print("Attempting to send confirmation email...")
-                
-                msg = Message(
-                    subject="Order Confirmation - Sudhamrit Dairy Farm",
-                    recipients=[user.email],
-                    sender=app.config['MAIL_DEFAULT_SENDER']
-                )
-                msg.body = f"""Hello {user.username},
-
-Your order has been placed successfully! 🎉
-
-📋 ORDER DETAILS:
-• Order ID: #{new_order.order_id}
-• Amount: ₹{total_amount}
-• Payment Method: {payment_method}
-• Order Date: {new_order.order_date.strftime('%d/%m/%Y at %I:%M %p')}
-
-🚚 DELIVERY ADDRESS:
-{user.address}
-
-📞 CONTACT: {user.phone}
-
-Your fresh dairy products will be delivered soon!
-
-Thank you for choosing Sudhamrit Dairy Farm! 🥛
-
-Best Regards,
-Sudhamrit Dairy Farm Team
-Email: support@sudhamritdairy.com
-Phone: +91-XXXXXXXXXX
-"""
-                
-                mail.send(msg)
-                email_sent = True
-                print("Confirmation email sent successfully!")
-                flash("Order confirmation email sent!", "info")
-                
-            except Exception as mail_error:
-                print(f"Email sending failed: {mail_error}")
-                flash("Order placed successfully! Email notification will be sent separately.", "warning")
-
-        print("Redirecting to confirmation page...")
+        flash("Order placed successfully! A confirmation email is on its way.", "success")
 
         # Get order items with product details for the confirmation page
-        order_items = OrderItem.query.filter_by(order_id=new_order.order_id).all()
+        order_items = OrderItem.query.options(joinedload(OrderItem.product)).filter_by(order_id=new_order.order_id).all()
         
         return render_template('confirm_order.html', 
                              user=user, 
                              total=total_amount, 
                              payment_method=payment_method, 
                              order_id=new_order.order_id,
-                             order_items=order_items,
-                             email_sent=email_sent) 
+                             order_items=order_items) 
     
+    except OutOfStock as e:
+        db.session.rollback()
+        logger.info("Checkout rejected: product %s out of stock (%s available)", e.product_id, e.available)
+        name = e.product_name or f"product #{e.product_id}"
+        if e.available:
+            flash(f"Sorry, only {e.available} of {name} left in stock. Please update your cart.", "warning")
+        else:
+            flash(f"Sorry, {name} is out of stock. Please remove it from your cart.", "warning")
+        return redirect(url_for('cart'))
     except Exception as e:
         db.session.rollback()
-        print(f"❌ ERROR processing payment: {str(e)}")
+        logger.exception("Error processing payment")
         flash(f"Error processing payment: {str(e)}", "danger")
         return redirect(url_for('cart'))
 
-@app.route('/test_email')
+@route('/test_email')
 def test_email():
     try:
         msg = Message(
             subject="Test Email - Sudhamrit Dairy Farm",
             recipients=["aditya29jadhav@gmail.com"], 
-            sender=app.config['MAIL_DEFAULT_SENDER']
+            sender=current_app.config['MAIL_DEFAULT_SENDER']
         )
         msg.body = """
         This is a test email from Sudhamrit Dairy Farm.
@@ -696,7 +1024,7 @@ def test_email():
     except Exception as e:
         return f"Email sending failed: {str(e)}"
 
-@app.route('/test_order_flow')
+@route('/test_order_flow')
 def test_order_flow():
     """Test route to check order processing without email"""
     user_id = session.get('user_id')
@@ -726,15 +1054,261 @@ def test_order_flow():
     except Exception as e:
         return f"Error: {str(e)}"
     
-@app.route('/orders',methods=['GET','POST'])
+@route('/orders',methods=['GET','POST'])
 def orders():
     admin_id = session.get('admin_id')
     if not admin_id:
         return redirect(url_for('admin_login'))
-    all_orders=Order.query.all()
-    return render_template('orders.html',orders=all_orders,admin_id=admin_id)
+    page_orders,next_cursor=order_page(Order.query,request.args.get('before'))
+    return render_template('orders.html',orders=page_orders,admin_id=admin_id,next_cursor=next_cursor)
+
+def parse_export_date(value):
+    return datetime.strptime(value, '%Y-%m-%d') if value else None
+
+@route('/admin/orders/export')
+def export_orders():
+    """
+    Stream orders with items, customer and payment for accounting.
+
+    ?format=csv|jsonl&start=YYYY-MM-DD&end=YYYY-MM-DD&status=Delivered
+    (start and end are both inclusive days).
+    """
+    if not current_admin():
+        return redirect(url_for('admin_login'))
+    export_format = request.args.get('format', 'csv')
+    if export_format not in exports.FORMATS:
+        return jsonify({'error': 'invalid_format', 'allowed': list(exports.FORMATS)}), 400
+    try:
+        start = parse_export_date(request.args.get('start'))
+        end = parse_export_date(request.args.get('end'))
+    except ValueError:
+        return jsonify({'error': 'invalid_date', 'expected': 'YYYY-MM-DD'}), 400
+    if end is not None:
+        end += timedelta(days=1)
+    status = request.args.get('status') or None
+
+    write, mimetype = exports.FORMATS[export_format]
+    filename = f"orders-{request.args.get('start') or 'all'}-{request.args.get('end') or 'now'}.{export_format}"
+    logger.info("Order export started: format %s, start %s, end %s, status %s", export_format, start, end, status)
+    return current_app.response_class(
+        stream_with_context(write(exports.iter_orders(start, end, status))),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename="{filename}"', 'Cache-Control': 'no-store'},
+    )
+
+def analytics_filters():
+    start, end = analytics.parse_range(request.args.get('start'), request.args.get('end'))
+    product_id = request.args.get('product_id')
+    return start, end, request.args.get('category') or None, int(product_id) if product_id else None
+
+@route('/api/analytics/sales')
+def api_sales_series():
+    """
+    Units and revenue over time from the sales rollups.
+
+    ?start=YYYY-MM-DD&end=YYYY-MM-DD (inclusive, default last 30 days)
+    &granularity=day|month&category=Milk&product_id=12
+    """
+    if not current_admin():
+        return jsonify({'error': 'admin_login_required'}), 401
+    granularity = request.args.get('granularity', 'day')
+    if granularity not in ('day', 'month'):
+        return jsonify({'error': 'invalid_granularity', 'allowed': ['day', 'month']}), 400
+    try:
+        start, end, category, product_id = analytics_filters()
+    except ValueError:
+        return jsonify({'error': 'invalid_filter', 'expected': 'start/end as YYYY-MM-DD, integer product_id'}), 400
+    series = analytics.sales_series(start, end, granularity, category=category, product_id=product_id)
+    return jsonify({'start': start.isoformat(), 'end': end.isoformat(), 'granularity': granularity,
+                    'units': sum(p['units'] for p in series), 'revenue': round(sum(p['revenue'] for p in series), 2),
+                    'series': series})
+
+@route('/api/analytics/top')
+def api_top_sales():
+    """
+    Best sellers from the sales rollups.
+
+    ?start=YYYY-MM-DD&end=YYYY-MM-DD&by=product|category&metric=revenue|units
+    &limit=10&category=Milk
+    """
+    if not current_admin():
+        return jsonify({'error': 'admin_login_required'}), 401
+    by = request.args.get('by', 'product')
+    metric = request.args.get('metric', 'revenue')
+    if by not in ('product', 'category') or metric not in ('revenue', 'units'):
+        return jsonify({'error': 'invalid_ranking', 'by': ['product', 'category'], 'metric': ['revenue', 'units']}), 400
+    try:
+        start, end, category, _ = analytics_filters()
+        limit = max(1, min(int(request.args.get('limit', 10)), 100))
+    except ValueError:
+        return jsonify({'error': 'invalid_filter', 'expected': 'start/end as YYYY-MM-DD, integer limit'}), 400
+    top = analytics.top_sales(start, end, by=by, metric=metric, limit=limit, category=category)
+    return jsonify({'start': start.isoformat(), 'end': end.isoformat(), 'by': by, 'metric': metric, 'top': top})
+
+def delivery_plan():
+    """Plan for ?date=YYYY-MM-DD (default today) with optional max_stops/max_units overrides."""
+    day = datetime.strptime(request.args['date'], '%Y-%m-%d').date() if request.args.get('date') else analytics.today()
+    max_stops = max(1, int(request.args.get('max_stops', current_app.config['DELIVERY_MAX_STOPS'])))
+    max_units = max(0, int(request.args.get('max_units', current_app.config['DELIVERY_MAX_UNITS'])))
+    depot = (current_app.config['DEPOT_LATITUDE'], current_app.config['DEPOT_LONGITUDE'])
+    plan = dispatch.plan_day(day, depot, max_stops, max_units, current_app.config['DELIVERY_LOOKBACK_DAYS'])
+    logger.info("Delivery plan for %s: %s stops in %s batches, %s km", plan['date'], plan['stops'],
+                len(plan['batches']), plan['distance_km'])
+    return plan
+
+@route('/admin/dispatch')
+def dispatch_view():
+    admin_id = session.get('admin_id')
+    if not admin_id:
+        return redirect(url_for('admin_login'))
+    try:
+        plan = delivery_plan()
+    except ValueError:
+        flash('Invalid date or capacity; expected date=YYYY-MM-DD and whole numbers.', 'danger')
+        return redirect(url_for('dispatch_view'))
+    return render_template('dispatch.html', plan=plan, admin_id=admin_id)
+
+@route('/api/dispatch/plan')
+def api_dispatch_plan():
+    """Delivery batches for the day's undelivered orders, each in driving order."""
+    if not current_admin():
+        return jsonify({'error': 'admin_login_required'}), 401
+    try:
+        return jsonify(delivery_plan())
+    except ValueError:
+        return jsonify({'error': 'invalid_parameter', 'expected': 'date=YYYY-MM-DD, integer max_stops/max_units'}), 400
 
-@app.route('/marked_delivery<int:order_id>',methods=['GET','POST'])
+@route('/api/serviceability')
+def api_serviceability():
+    """?lat=..&lon=.. -> whether we deliver there, and from which zone."""
+    try:
+        lat, lon = zones.parse_point(request.args['lat'], request.args['lon'])
+    except (KeyError, ValueError):
+        return jsonify({'error': 'invalid_coordinates', 'expected': 'lat and lon in degrees'}), 400
+    serviceable, zone = zones.check(lat, lon)
+    return jsonify({'serviceable': serviceable, 'zone': zone.name if zone else None})
+
+def geocode_response(place, source):
+    body = {'found': place is not None, 'source': source}
+    if place is not None:
+        body.update(latitude=place.latitude, longitude=place.longitude, address=place.address)
+    response = jsonify(body)
+    response.cache_control.private = True
+    response.cache_control.max_age = 86400
+    return response
+
+@route('/api/geocode/reverse')
+def api_reverse_geocode():
+    """?lat=..&lon=.. -> the address there, from the geocoding cache when possible."""
+    if not session.get('user_id') and not session.get('admin_id'):
+        return jsonify({'error': 'login_required'}), 401
+    try:
+        lat, lon = float(request.args['lat']), float(request.args['lon'])
+    except (KeyError, ValueError):
+        return jsonify({'error': 'invalid_coordinates', 'expected': 'lat and lon in degrees'}), 400
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return jsonify({'error': 'invalid_coordinates', 'expected': 'lat and lon in degrees'}), 400
+    try:
+        return geocode_response(*geocoder.reverse(lat, lon))
+    except GeocoderUnavailable as e:
+        logger.warning("Reverse geocoding failed: %s", e)
+        return jsonify({'error': 'geocoder_unavailable'}), 503
+
+@route('/api/geocode/search')
+def api_search_geocode():
+    """?q=<address> -> its coordinates, from the geocoding cache when possible."""
+    if not session.get('user_id') and not session.get('admin_id'):
+        return jsonify({'error': 'login_required'}), 401
+    query = request.args.get('q', '').strip()
+    if not query or len(query) > 300:
+        return jsonify({'error': 'invalid_query', 'expected': 'q with 1-300 characters'}), 400
+    try:
+        return geocode_response(*geocoder.search(query))
+    except GeocoderUnavailable as e:
+        logger.warning("Address geocoding failed: %s", e)
+        return jsonify({'error': 'geocoder_unavailable'}), 503
+
+@route('/api/zones', methods=['GET', 'POST'])
+def api_zones():
+    """List active delivery zones, or POST one: {name, latitude, longitude, radius_km} or {name, polygon}."""
+    if not current_admin():
+        return jsonify({'error': 'admin_login_required'}), 401
+    if request.method == 'POST':
+        try:
+            zone = zones.zone_from_payload(request.get_json(silent=True) or {})
+        except (KeyError, TypeError, ValueError) as e:
+            return jsonify({'error': 'invalid_zone', 'message': str(e)}), 400
+        db.session.add(zone)
+        db.session.commit()
+        zone_cache.bump()
+        logger.info("Delivery zone %s (%s) added", zone.zone_id, zone.name)
+        return jsonify(zones.Zone.from_model(zone).as_dict()), 201
+    return jsonify({'zones': [zone.as_dict() for zone in zone_cache.index().zones]})
+
+@route('/api/zones/<int:zone_id>', methods=['DELETE'])
+def api_delete_zone(zone_id):
+    if not current_admin():
+        return jsonify({'error': 'admin_login_required'}), 401
+    zone = db.session.get(DeliveryZone, zone_id)
+    if zone is None or not zone.active:
+        return jsonify({'error': 'not_found'}), 404
+    zone.active = False
+    db.session.commit()
+    zone_cache.bump()
+    logger.info("Delivery zone %s (%s) retired", zone.zone_id, zone.name)
+    return jsonify({'zone_id': zone_id, 'active': False})
+
+@route('/api/zones/classify', methods=['POST'])
+def api_classify_locations():
+    """Classify every saved DeliveryLocation against the current zones in one pass."""
+    if not current_admin():
+        return jsonify({'error': 'admin_login_required'}), 401
+    started = time.perf_counter()
+    result = zones.classify_locations()
+    result['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    return jsonify(result)
+
+@route('/api/subscriptions', methods=['GET', 'POST'])
+def api_subscriptions():
+    """The customer's subscriptions, or POST one: {product_id, quantity, schedule, start_date?, end_date?}."""
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({'error': 'not_logged_in', 'login_url': url_for('login')}), 401
+    if request.method == 'POST':
+        payload = request.get_json(silent=True) or {}
+        try:
+            subscription = subscriptions.subscription_from_payload(user_id, payload)
+        except (KeyError, TypeError, ValueError) as e:
+            return jsonify({'error': 'invalid_subscription', 'message': str(e)}), 400
+        if db.session.get(Product, subscription.product_id) is None:
+            return jsonify({'error': 'product_not_found'}), 404
+        db.session.add(subscription)
+        db.session.commit()
+        logger.info("Subscription %s added: product %s x%s, %s", subscription.subscription_id,
+                    subscription.product_id, subscription.quantity, subscription.schedule)
+        return jsonify(subscriptions.subscription_dict(subscription)), 201
+    rows = (Subscription.query.options(joinedload(Subscription.product)).filter_by(user_id=user_id)
+            .order_by(Subscription.subscription_id).all())
+    return jsonify({'subscriptions': [subscriptions.subscription_dict(row) for row in rows]})
+
+@route('/api/subscriptions/<int:subscription_id>', methods=['PATCH'])
+def api_update_subscription(subscription_id):
+    """Change quantity, schedule, end date or pause dates, or set status to Cancelled/Active."""
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({'error': 'not_logged_in', 'login_url': url_for('login')}), 401
+    subscription = db.session.get(Subscription, subscription_id)
+    if subscription is None or subscription.user_id != user_id:
+        return jsonify({'error': 'not_found'}), 404
+    try:
+        subscriptions.apply_changes(subscription, request.get_json(silent=True) or {})
+    except (KeyError, TypeError, ValueError) as e:
+        db.session.rollback()
+        return jsonify({'error': 'invalid_subscription', 'message': str(e)}), 400
+    db.session.commit()
+    return jsonify(subscriptions.subscription_dict(subscription))
+
+@route('/marked_delivery<int:order_id>',methods=['GET','POST'])
 def marked_delivery(order_id):
     order=Order.query.get(order_id)
     if order:
@@ -747,7 +1321,7 @@ def marked_delivery(order_id):
             flash(f"Error updating order status: {str(e)}",'danger')
         return redirect(url_for('orders'))
     return redirect(url_for('orders'))
-# @app.route('/test_db')
+# @route('/test_db')
 # def test_db():
 #     try:
 #         users = User.query.all()
@@ -764,15 +1338,12 @@ def marked_delivery(order_id):
 #     except Exception as e:
 #         return f"Database Error: {str(e)}"
     
-@app.route('/save_location',methods=['GET','POST'])
+@route('/save_location',methods=['GET','POST'])
 def save_location():
      data = request.get_json()
      address = data.get('address')
      latitude = data.get('latitude')
      longitude = data.get('longitude')
-     session['address'] = address
-     session['latitude'] = latitude
-     session['longitude'] = longitude
 
      if not all([address, latitude, longitude]):
          return jsonify({'error': 'Incomplete location data'}), 400
@@ -780,25 +1351,147 @@ def save_location():
      user_id = session.get('user_id')
      if not user_id:
          return jsonify({'error': 'User not logged in'}), 401   
+
+     try:
+         latitude, longitude = zones.parse_point(latitude, longitude)
+     except ValueError:
+         return jsonify({'error': 'Invalid coordinates'}), 400
+     serviceable, zone = zones.check(latitude, longitude)
+     if not serviceable:
+         return jsonify({'error': 'Sorry, we do not deliver to this location yet.', 'serviceable': False}), 422
      
-     new_location=DeliveryLocation(
-         user_id=user_id,
-         address=address,
-         latitude=latitude,
-         longitude=longitude
-     )
-     db.session.add(new_location)
+     locations.save_location(user_id, address, latitude, longitude)
      db.session.commit()
+     session['address'] = address
+     session['latitude'] = latitude
+     session['longitude'] = longitude
 
-     return jsonify({'message': 'Location saved successfully!'}), 200
+     return jsonify({'message': 'Location saved successfully!', 'zone': zone.name if zone else None}), 200
      return render_template('payment.html',user=user,cart_items=cart_items,total=total_amount,google_maps_api_key=os.getenv("GOOGLE_MAPS_API_KEY"))
 
-        
+
+@cli_command('refresh-stats')
+def refresh_stats_command():
+    """Rebuild the dashboard stats rollup from the source tables."""
+    stats = refresh_store_stats()
+    print(f"Stats refreshed: {stats.total_products} products, {stats.total_customers} customers, "
+          f"{stats.total_orders} orders, ₹{stats.total_revenue} revenue")
+
+@cli_command('init-db')
+def init_db_command():
+    """Create missing tables and apply pending migrations."""
+    applied = init_db()
+    print("Database initialised; applied migrations: " + (", ".join(applied) if applied else "none"))
+
+@cli_command('migrate')
+@click.option('--status', is_flag=True, help='List pending migrations without applying them.')
+def migrate_command(status):
+    """Apply pending schema migrations (indexes etc.) to an existing database."""
+    if status:
+        pending = pending_migrations()
+        print("Pending migrations: " + (", ".join(pending) if pending else "none"))
+        return
+    applied = upgrade()
+    print("Applied migrations: " + (", ".join(applied) if applied else "none, schema is up to date"))
+
+@cli_command('reindex-search')
+def reindex_search_command():
+    """Rebuild the product full-text search index from the product table."""
+    if not search.fts_enabled():
+        print("Full-text index is only used on SQLite; nothing to rebuild")
+        return
+    with db.engine.begin() as connection:
+        search.create_index(connection)
+        indexed = search.rebuild_index(connection)
+    print(f"Indexed {indexed} products for search")
+
+@cli_command('backfill-sales')
+@click.option('--start', help='Rebuild from the month of this day (YYYY-MM-DD); defaults to the first order.')
+@click.option('--end', help='Rebuild up to the month of this day (YYYY-MM-DD); defaults to today.')
+def backfill_sales_command(start, end):
+    """Rebuild the sales rollups from order history, one month at a time."""
+    start = datetime.strptime(start, '%Y-%m-%d').date() if start else None
+    end = datetime.strptime(end, '%Y-%m-%d').date() if end else None
+    read = analytics.backfill(db.engine, start, end,
+                              progress=lambda month, items: print(f"{month:%Y-%m}: {items} order items"))
+    print(f"Sales rollups rebuilt from {read} order items")
+
+@cli_command('add-zone')
+@click.argument('name')
+@click.option('--lat', type=float, required=True, help='Centre latitude.')
+@click.option('--lon', type=float, required=True, help='Centre longitude.')
+@click.option('--radius-km', type=float, required=True)
+def add_zone_command(name, lat, lon, radius_km):
+    """Add a radius delivery zone (polygons can be posted to /api/zones)."""
+    try:
+        zone = zones.zone_from_payload({'name': name, 'latitude': lat, 'longitude': lon, 'radius_km': radius_km})
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    db.session.add(zone)
+    db.session.commit()
+    zone_cache.bump()
+    print(f"Added delivery zone {zone.zone_id}: {name}, {radius_km} km around {lat},{lon}")
+
+@cli_command('prune-geocodes')
+def prune_geocodes_command():
+    """Delete geocoding answers past their TTL from the shared cache table."""
+    print(f"Pruned {geocoder.prune()} expired geocodes")
+
+@cli_command('compact-locations')
+@click.option('--batch-size', default=1000, show_default=True, help='Users per transaction.')
+@click.option('--limit', type=int, help='Locations kept per user (default LOCATIONS_PER_USER).')
+def compact_locations_command(batch_size, limit):
+    """Fold duplicate saved delivery locations and apply the per-user cap."""
+    totals = locations.compact(db.engine, batch_size=batch_size, limit=limit,
+                               progress=lambda t: print(f"{t['users']} users, {t['scanned']} locations scanned"))
+    print(f"Compacted {totals['users']} users: {totals['merged']} duplicates merged, "
+          f"{totals['capped']} over the cap removed, {totals['keyed']} locations keyed")
+
+@cli_command('generate-subscription-orders')
+@click.option('--date', 'day', help='Delivery day (YYYY-MM-DD); defaults to tomorrow, shop time.')
+@click.option('--batch-size', default=2000, show_default=True, help='Customers per transaction.')
+def generate_subscription_orders_command(day, batch_size):
+    """Create the day's orders for due subscriptions; safe to re-run."""
+    day = datetime.strptime(day, '%Y-%m-%d').date() if day else analytics.today() + timedelta(days=1)
+    started = time.perf_counter()
+    totals = subscriptions.generate_orders(day, batch_size=batch_size,
+                                           progress=lambda t: print(f"{t['customers']} customers, {t['orders']} orders"))
+    print(f"Subscription orders for {day}: {totals['orders']} new orders, {totals['topped_up']} topped up, "
+          f"{totals['items']} items, "
+          f"₹{totals['revenue']}; {totals['out_of_stock']} subscriptions out of stock "
+          f"({time.perf_counter() - started:.1f}s)")
+
+@cli_command('build-images')
+@click.option('--force', is_flag=True, help='Rebuild derivatives even if they are up to date.')
+def build_images_command(force):
+    """Generate resized WebP/JPEG derivatives for every image in static/images."""
+    built, skipped = images.build_all(image_dir(), force=force)
+    if built:
+        catalog_cache.bump()  # cached product grids were rendered without the new srcsets
+    print(f"Image derivatives built for {built} images ({skipped} already up to date)")
+
+@cli_command('build-assets')
+def build_assets_command():
+    """Fingerprint and precompress static files into static/build."""
+    manifest = build_assets(current_app.static_folder, current_app.config['ASSET_EXCLUDE'],
+                            current_app.config['ASSET_UPLOAD_DIRS'])
+    print(f"Built {len(manifest)} hashed static assets")
+
+@cli_command('send-emails')
+@click.option('--once', is_flag=True, help='Exit once the outbox is empty instead of polling.')
+@click.option('--batch-size', default=50, show_default=True)
+@click.option('--interval', default=5.0, show_default=True, help='Seconds between polls when idle.')
+def send_emails_command(once, batch_size, interval):
+    """Deliver queued emails from the outbox over a reused SMTP connection."""
+    sent, failed = run_worker(mail, batch_size=batch_size, poll_interval=interval, once=once)
+    print(f"Outbox drained: {sent} sent, {failed} failed")
+
 if __name__=='__main__':
+    app=create_app()
     with app.app_context():
         try:
-            db.create_all()
-            print("Database tables created successfully!")
+            init_db()
+            logger.info("Database tables created successfully!")
         except Exception as e:
-            print(f"Error creating database tables: {e}")
+            logger.error(f"Error creating database tables: {e}")
     app.run(debug=True)
\ No newline at end of file
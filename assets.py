@@ -0,0 +1,207 @@
+"""
+Content-hashed static assets.
+
+'flask build-assets', run as a release step, copies every file under static/
+to static/build/ with a short content hash in its name, e.g.
+css/responsive.css -> css/responsive.1a2b3c4d5e6f.css, and text assets get
+gzip (and brotli, when the module is installed) siblings. Templates keep
+calling url_for('static', filename=...); the override installed here points
+those at /assets/<hashed name>, which is served with a year-long immutable
+Cache-Control and the best precompressed variant the client accepts.
+Workers only read the manifest at startup; ASSET_BUILD_ON_STARTUP=1 builds
+it in-process instead, for development.
+
+The shipped images (home_image.png, our_story.png, the stock product
+photos) are fingerprinted like everything else. static/images/derived is
+left out (ASSET_EXCLUDE): images.py writes those resized variants at run
+time, after any build. Admin uploads also land in static/images
+(ASSET_UPLOAD_DIRS) and may overwrite a shipped file under the same name, so
+the build records each such file's size and mtime in sources.json, and
+url_for falls back to the plain /static URL for a file that has changed
+since. Files uploaded after the build aren't in the manifest and are served
+from /static as before.
+
+Hashed files are content-addressed, so several workers building at once all
+write identical files; writes go through a temp file and os.replace.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+
+from flask import request,send_from_directory,url_for
+
+try:
+    import brotli
+except ImportError:  # optional
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+BUILD_DIR = 'build'
+MANIFEST_NAME = 'manifest.json'
+SOURCES_NAME = 'sources.json'
+HASH_LENGTH = 12
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.svg', '.json', '.txt', '.html', '.map')
+ONE_YEAR = 365 * 24 * 60 * 60
+DEFAULT_EXCLUDE = ('images/derived',)
+UPLOAD_DIRS = ('images',)
+
+
+def _file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:HASH_LENGTH]
+
+
+def hashed_name(filename, digest):
+    stem, ext = os.path.splitext(filename)
+    return f"{stem}.{digest}{ext}"
+
+
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _relative(path, static_folder):
+    return os.path.relpath(path, static_folder).replace(os.sep, '/')
+
+
+def _stamp(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def build_assets(static_folder, exclude=DEFAULT_EXCLUDE, upload_dirs=UPLOAD_DIRS):
+    """
+    Fingerprint and precompress everything under static_folder except the
+    directories in exclude (paths relative to it); returns the manifest.
+    """
+    build_root = os.path.join(static_folder, BUILD_DIR)
+    manifest, sources = {}, {}
+    for root, dirs, files in os.walk(static_folder):
+        dirs[:] = [name for name in dirs if _relative(os.path.join(root, name), static_folder)
+                   not in (BUILD_DIR, *exclude)]
+        for name in files:
+            source = os.path.join(root, name)
+            filename = _relative(source, static_folder)
+            target_name = hashed_name(filename, _file_hash(source))
+            manifest[filename] = target_name
+            if os.path.dirname(filename) in upload_dirs:
+                sources[filename] = _stamp(source)
+
+            target = os.path.join(build_root, target_name)
+            if os.path.exists(target):
+                continue
+            with open(source, 'rb') as f:
+                data = f.read()
+            _write_atomic(target, data)
+            if name.lower().endswith(COMPRESSIBLE_EXTENSIONS):
+                _write_atomic(target + '.gz', gzip.compress(data, compresslevel=9, mtime=0))
+                if brotli is not None:
+                    _write_atomic(target + '.br', brotli.compress(data, quality=11))
+
+    _write_atomic(os.path.join(build_root, SOURCES_NAME),
+                  json.dumps(sources, indent=2, sort_keys=True).encode())
+    _write_atomic(os.path.join(build_root, MANIFEST_NAME),
+                  json.dumps(manifest, indent=2, sort_keys=True).encode())
+    return manifest
+
+
+def _load_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def load_manifest(static_folder):
+    return _load_json(os.path.join(static_folder, BUILD_DIR, MANIFEST_NAME))
+
+
+def load_sources(static_folder):
+    """{filename: [size, mtime_ns]} at build time, for files in the upload directories."""
+    return _load_json(os.path.join(static_folder, BUILD_DIR, SOURCES_NAME))
+
+
+class Assets:
+    def __init__(self, app=None):
+        self.manifest = {}
+        self.sources = {}
+        self.static_folder = None
+        self.build_root = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('ASSET_FINGERPRINTING', True)
+        app.config.setdefault('ASSET_BUILD_ON_STARTUP',
+                              os.getenv('ASSET_BUILD_ON_STARTUP', '').lower() in ('1', 'true', 'yes'))
+        app.config.setdefault('ASSET_EXCLUDE', DEFAULT_EXCLUDE)
+        app.config.setdefault('ASSET_UPLOAD_DIRS', UPLOAD_DIRS)
+        self.static_folder = app.static_folder
+        self.build_root = os.path.join(app.static_folder, BUILD_DIR)
+        app.extensions['assets'] = self
+        app.add_url_rule('/assets/<path:filename>', 'hashed_static', self.serve)
+        if not app.config['ASSET_FINGERPRINTING']:
+            return
+
+        if app.config['ASSET_BUILD_ON_STARTUP']:
+            try:
+                self.manifest = build_assets(app.static_folder, app.config['ASSET_EXCLUDE'],
+                                             app.config['ASSET_UPLOAD_DIRS'])
+            except OSError as e:
+                logger.warning("Static asset build failed, serving unhashed URLs: %s", e)
+                self.manifest = load_manifest(app.static_folder)
+        else:
+            self.manifest = load_manifest(app.static_folder)
+            if not self.manifest:
+                logger.info("No static asset manifest; run 'flask build-assets' to serve hashed URLs")
+        self.sources = load_sources(app.static_folder)
+        app.jinja_env.globals['url_for'] = self.url_for
+
+    def url_for(self, endpoint, **values):
+        if endpoint == 'static':
+            filename = values.get('filename')
+            target = self.manifest.get(filename)
+            if target and filename in self.sources and not self._unchanged(filename):
+                target = None  # an upload replaced it after the build
+            if target:
+                values['filename'] = target
+                endpoint = 'hashed_static'
+        return url_for(endpoint, **values)
+
+    def _unchanged(self, filename):
+        try:
+            return _stamp(os.path.join(self.static_folder, filename)) == self.sources[filename]
+        except OSError:
+            return False
+
+    def serve(self, filename):
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        encoding = None
+        for candidate, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if request.accept_encodings[candidate] and os.path.isfile(os.path.join(self.build_root, filename + suffix)):
+                encoding = candidate
+                filename += suffix
+                break
+
+        response = send_from_directory(self.build_root, filename, mimetype=mimetype, max_age=ONE_YEAR)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+
+
+assets = Assets()
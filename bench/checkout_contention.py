@@ -0,0 +1,98 @@
+"""
+Fire many concurrent checkouts at one hot product and check the invariants:
+no overselling, no deadlocks, and every unit sold is accounted for by
+exactly one order item.
+
+    python bench/checkout_contention.py --checkouts 300 --stock 100
+
+Runs against a throwaway SQLite database (or DATABASE_URL if set) through
+the Flask test client, one thread per checkout. Exits non-zero if any
+invariant is violated.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--checkouts', type=int, default=300)
+    parser.add_argument('--stock', type=int, default=100)
+    parser.add_argument('--quantity', type=int, default=1, help='units of the hot product per checkout')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix='sudhamrit-contention-')
+    os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(tmpdir, 'contention.db')}")
+
+    from sqlalchemy import func
+    from app import create_app
+    from migrations import init_db
+    from models import db,User,Product,Cart,Order,OrderItem
+
+    app = create_app()
+    with app.app_context():
+        init_db()
+        hot = Product(product_name='Fresh Cow Milk', category='Milk', price=60.0, stock=args.stock)
+        db.session.add(hot)
+        users = [User(username=f'buyer{i}', email=f'buyer{i}@example.com', password='x') for i in range(args.checkouts)]
+        db.session.add_all(users)
+        db.session.flush()
+        db.session.add_all(Cart(user_id=u.user_id, product_id=hot.product_id, quantity=args.quantity) for u in users)
+        db.session.commit()
+        user_ids = [u.user_id for u in users]
+        product_id = hot.product_id
+
+    results = {}
+    start_line = threading.Barrier(len(user_ids))
+
+    def checkout(user_id):
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess['user_id'] = user_id
+            sess['payment_amount'] = 60.0 * args.quantity
+        start_line.wait()
+        response = client.post('/payment_success', data={'payment_method': 'UPI'})
+        results[user_id] = response.status_code
+
+    threads = [threading.Thread(target=checkout, args=(uid,)) for uid in user_ids]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(timeout=120)
+    elapsed = time.perf_counter() - started
+    hung = sum(t.is_alive() for t in threads)
+
+    with app.app_context():
+        stock_left = db.session.get(Product, product_id).stock
+        orders = db.session.query(func.count(Order.order_id)).scalar()
+        units_sold = db.session.query(func.coalesce(func.sum(OrderItem.quantity), 0)).scalar()
+
+    expected_orders = min(args.checkouts, args.stock // args.quantity)
+    print(f"{args.checkouts} checkouts in {elapsed:.2f}s: {orders} orders, {units_sold} units sold, "
+          f"{stock_left} left, {hung} hung")
+
+    failures = []
+    if hung:
+        failures.append(f"{hung} checkouts never finished (deadlock?)")
+    if stock_left < 0:
+        failures.append(f"stock went negative: {stock_left}")
+    if units_sold + stock_left != args.stock:
+        failures.append(f"units sold ({units_sold}) + stock left ({stock_left}) != initial stock ({args.stock})")
+    if units_sold != orders * args.quantity:
+        failures.append(f"order items ({units_sold}) do not match orders ({orders})")
+    if orders != expected_orders:
+        failures.append(f"expected {expected_orders} orders, got {orders}")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,130 @@
+"""
+Geocoding cache tiers and request coalescing.
+
+    python bench/geocode_cache.py --points 200 --concurrency 20 --latency-ms 300
+
+Starts a local Nominatim stand-in (answers /reverse and /search after a fixed
+delay and counts its calls), points GEOCODER_URL at it, and drives
+/api/geocode/* through the Flask test client:
+
+  * a burst of concurrent requests for one point: the stand-in should see
+    one call, the rest are coalesced
+  * distinct points cold (provider), again (memory LRU), and again after
+    clearing the LRU as a fresh worker would (database table)
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler,ThreadingHTTPServer
+from urllib.parse import parse_qs,urlparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+class StandIn(BaseHTTPRequestHandler):
+    latency = 0.3
+    calls = 0
+    lock = threading.Lock()
+
+    def do_GET(self):
+        with StandIn.lock:
+            StandIn.calls += 1
+        time.sleep(StandIn.latency)
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if url.path == '/reverse':
+            body = {'lat': params['lat'], 'lon': params['lon'],
+                    'display_name': f"Plot near {params['lat']}, {params['lon']}, Pune"}
+        else:
+            body = [{'lat': '18.5204', 'lon': '73.8567', 'display_name': f"{params['q']}, Pune"}]
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def timed(client, url):
+    started = time.perf_counter()
+    response = client.get(url)
+    assert response.status_code == 200, response.get_data(as_text=True)
+    return (time.perf_counter() - started) * 1000, response.get_json()['source']
+
+
+def summary(samples):
+    latencies = sorted(ms for ms, _ in samples)
+    sources = {}
+    for _, source in samples:
+        sources[source] = sources.get(source, 0) + 1
+    return {'p50_ms': round(statistics.median(latencies), 2), 'max_ms': round(latencies[-1], 2), 'sources': sources}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--points', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--latency-ms', type=float, default=300)
+    args = parser.parse_args()
+
+    StandIn.latency = args.latency_ms / 1000
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    tmpdir = tempfile.mkdtemp(prefix='sudhamrit-geocode-')
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    from app import create_app
+    from migrations import init_db
+    from geocoding import geocoder
+
+    app = create_app({'GEOCODER_URL': f"http://127.0.0.1:{server.server_port}", 'GEOCODER_MIN_INTERVAL': 0})
+    with app.app_context():
+        init_db()
+
+    def client():
+        c = app.test_client()
+        with c.session_transaction() as session:
+            session['user_id'] = 1
+        return c
+
+    results = {}
+    burst, threads = [], []
+    for _ in range(args.concurrency):
+        thread = threading.Thread(target=lambda: burst.append(timed(client(), '/api/geocode/reverse?lat=18.5311&lon=73.8446')))
+        threads.append(thread)
+    StandIn.calls = 0
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results['burst_same_point'] = dict(summary(burst), provider_calls=StandIn.calls)
+
+    c = client()
+    urls = [f"/api/geocode/reverse?lat={18.45 + i * 0.0005:.4f}&lon=73.8{i % 10}" for i in range(args.points)]
+    for label in ('cold', 'memory'):
+        StandIn.calls = 0
+        results[label] = dict(summary([timed(c, url) for url in urls]), provider_calls=StandIn.calls)
+    geocoder.clear()
+    StandIn.calls = 0
+    results['database'] = dict(summary([timed(c, url) for url in urls]), provider_calls=StandIn.calls)
+
+    StandIn.calls = 0
+    addresses = ['12, Baner Road, Pune', '12 baner road pune', '12,  BANER ROAD, Pune.']
+    results['address_variants'] = dict(summary([timed(c, f"/api/geocode/search?q={a}") for a in addresses]),
+                                       provider_calls=StandIn.calls)
+    server.shutdown()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+Login throughput with password hashing inline vs. in the process pool.
+
+    python bench/login_throughput.py --logins 200 --threads 16 --pool-sizes 0,2,4
+
+Each run posts the login form from --threads concurrent client threads (as
+a threaded gunicorn worker would see it) against a scratch SQLite database,
+and reports logins/second, latency percentiles and how many requests were
+shed with 503 because the hash queue was full. Pool size 0 hashes on the
+request thread, which is the old behaviour.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def run(app, emails, logins, threads):
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+    counter = iter(range(logins))
+
+    def worker():
+        client = app.test_client()
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            started = time.perf_counter()
+            response = client.post('/login', data={'email': emails[i % len(emails)], 'password': 'milk-and-honey'})
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    started = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    wall = time.perf_counter() - started
+    return {
+        'logins': logins,
+        'wall_seconds': round(wall, 3),
+        'logins_per_second': round(logins / wall, 2),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 1),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 1),
+        'mean_ms': round(statistics.mean(latencies) * 1000, 1),
+        'status_codes': statuses,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--logins', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--pool-sizes', default='0,2,4')
+    parser.add_argument('--method', default=None, help='hash method, e.g. pbkdf2:sha256:100000')
+    parser.add_argument('--json', action='store_true', help='print machine-readable results only')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix='sudhamrit-login-')
+    os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(tmpdir, 'login.db')}")
+    if args.method:
+        os.environ['PASSWORD_HASH_METHOD'] = args.method
+
+    from app import create_app
+    from migrations import init_db
+    from models import db,User
+    from passwords import password_hasher
+
+    app = create_app()
+    password_hasher.configure(pool_size=0)
+    with app.app_context():
+        init_db()
+        password = password_hasher.hash('milk-and-honey')
+        db.session.add_all(User(username=f'bench{i}', email=f'bench{i}@example.com', password=password)
+                           for i in range(args.users))
+        db.session.commit()
+    emails = [f'bench{i}@example.com' for i in range(args.users)]
+
+    results = []
+    for pool_size in (int(size) for size in args.pool_sizes.split(',')):
+        password_hasher.configure(pool_size=pool_size)
+        if pool_size:
+            password_hasher.verify(password, 'warm-up')  # start the pool outside the timing
+        result = dict(pool_size=pool_size, threads=args.threads, method=password_hasher.method,
+                      **run(app, emails, args.logins, args.threads))
+        results.append(result)
+        if not args.json:
+            print(f"pool_size={pool_size:<2} {result['logins_per_second']:>8} logins/s  "
+                  f"p50 {result['p50_ms']} ms  p95 {result['p95_ms']} ms  statuses {result['status_codes']}")
+    password_hasher.shutdown()
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Delivery route planning time and quality.
+
+    python bench/route_plan.py --drops 5000 --max-stops 25
+
+Scatters synthetic drops around the depot (a dense core plus a few outlying
+clusters, like a city and its suburbs), then plans them with
+dispatch.plan_routes() and reports wall time and total distance next to the
+nearest-neighbour-only routes, to show what 2-opt buys. No database needed.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DEPOT = (18.5204, 73.8567)  # Pune
+SUBURBS = [(0.09, 0.11), (-0.12, 0.05), (0.05, -0.14), (-0.08, -0.09)]
+
+
+def make_drops(count, rng):
+    from dispatch import Stop
+    drops = []
+    for order_id in range(1, count + 1):
+        if rng.random() < 0.6:
+            lat, lon = DEPOT[0] + rng.gauss(0, 0.04), DEPOT[1] + rng.gauss(0, 0.04)
+        else:
+            dlat, dlon = rng.choice(SUBURBS)
+            lat, lon = DEPOT[0] + dlat + rng.gauss(0, 0.015), DEPOT[1] + dlon + rng.gauss(0, 0.015)
+        drops.append(Stop(order_id=order_id, user_id=order_id, customer=f'bench{order_id}', address='',
+                          latitude=lat, longitude=lon, units=rng.randint(1, 8), total_amount=0.0,
+                          order_date=datetime.utcnow()))
+    return drops
+
+
+def nearest_neighbour_km(drops, max_stops, max_units):
+    import dispatch
+    total = 0.0
+    for group in dispatch.sweep(drops, DEPOT, max_stops, max_units):
+        matrix = dispatch.distance_matrix([DEPOT] + [(stop.latitude, stop.longitude) for stop in group])
+        tour = dispatch.nearest_neighbour(matrix)
+        total += sum(matrix[a][b] for a, b in zip(tour, tour[1:]))
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--drops', type=int, default=5000)
+    parser.add_argument('--max-stops', type=int, default=25)
+    parser.add_argument('--max-units', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=42, help='random seed')
+    args = parser.parse_args()
+
+    import dispatch
+    drops = make_drops(args.drops, random.Random(args.seed))
+
+    timings = []
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        batches = dispatch.plan_routes(drops, DEPOT, args.max_stops, args.max_units)
+        timings.append(time.perf_counter() - started)
+
+    planned_km = sum(batch.distance_km for batch in batches)
+    baseline_km = nearest_neighbour_km(drops, args.max_stops, args.max_units)
+    print(json.dumps({
+        'drops': args.drops,
+        'batches': len(batches),
+        'largest_batch': max(len(batch.stops) for batch in batches),
+        'plan_seconds': {'best': round(min(timings), 3), 'worst': round(max(timings), 3)},
+        'distance_km': {'nearest_neighbour': round(baseline_km, 1), 'with_2opt': round(planned_km, 1),
+                        'saved_pct': round(100 * (1 - planned_km / baseline_km), 1)},
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Product search latency at catalog scale.
+
+    python bench/search_latency.py --products 100000
+
+Seeds a scratch SQLite database with synthetic products, builds the FTS5
+index, then times /api/products/search through the Flask test client for a
+mix of full-word, prefix, multi-word and category-filtered queries.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+CATEGORIES = ['Milk', 'Curd', 'Paneer', 'Ghee', 'Sweets', 'Ice Cream', 'Butter', 'Seasonal']
+ADJECTIVES = ['Fresh', 'Organic', 'Malai', 'Desi', 'Farm', 'Kesar', 'Low Fat', 'Full Cream', 'Masala', 'Homemade']
+NOUNS = ['Milk', 'Curd', 'Paneer', 'Ghee', 'Pedha', 'Shrikhand', 'Khoya', 'Lassi', 'Kulfi', 'Butter', 'Buttermilk']
+DESCRIPTIONS = ['made from fresh cow milk', 'from grass-fed buffaloes', 'traditional bilona churning',
+                'delivered every morning', 'rich and creamy', 'no preservatives added']
+
+QUERIES = [('paneer', None), ('pan', None), ('ke', None), ('malai paneer', None), ('fresh milk', 'Milk'),
+           ('bilona', None), ('kulfi', 'Ice Cream'), ('org mil', None), ('zzz', None)]
+
+
+def seed(app, count):
+    from sqlalchemy import insert
+    from models import db,Product
+    from migrations import init_db
+    import search
+
+    rng = random.Random(42)
+    rows = []
+    for i in range(count):
+        name = f"{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {i}"
+        rows.append({'product_name': name, 'description': f"{name} {rng.choice(DESCRIPTIONS)}",
+                     'category': rng.choice(CATEGORIES), 'price': round(rng.uniform(20, 900), 2),
+                     'stock': rng.randint(0, 500)})
+    with app.app_context():
+        init_db()
+        db.session.execute(insert(Product), rows)
+        db.session.commit()
+        with db.engine.begin() as connection:
+            search.create_index(connection)
+            search.rebuild_index(connection)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--products', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix='sudhamrit-search-')
+    os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(tmpdir, 'search.db')}")
+    from app import create_app
+    app = create_app()
+
+    started = time.perf_counter()
+    seed(app, args.products)
+    print(f"seeded and indexed {args.products} products in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+    client = app.test_client()
+    report = []
+    for query, category in QUERIES:
+        params = {'q': query, 'per_page': 20}
+        if category:
+            params['category'] = category
+        client.get('/api/products/search', query_string=params)
+        timings = []
+        for _ in range(args.repeat):
+            t0 = time.perf_counter()
+            response = client.get('/api/products/search', query_string=params)
+            timings.append((time.perf_counter() - t0) * 1000)
+        body = response.get_json()
+        report.append({'q': query, 'category': category, 'total': body['total'],
+                       'p50_ms': round(statistics.median(timings), 2), 'max_ms': round(max(timings), 2)})
+    print(json.dumps({'products': args.products, 'queries': report}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+"""
+Fill the database with a realistic volume of synthetic shop data.
+
+    python bench/seed.py --users 100000 --products 10000 --order-items 1000000
+
+Uses DATABASE_URL (or a scratch SQLite file when it is unset) and appends to
+whatever is already there. Data is generated from a fixed random seed, so
+two runs with the same arguments produce the same shop:
+
+  * users bench<N>@example.com, all with password 'milk-and-honey'
+  * one admin, bench-admin@example.com, same password
+  * products spread over the shop's categories, with deep stock
+  * orders (with payments) over the last year, ~4 items each
+  * open carts for 5% of users and saved delivery locations for 30%
+
+Rows go in with bulk INSERTs in batches, and the search index, the sales
+rollups, the dashboard stats and the catalog version are rebuilt
+afterwards. The script prints a JSON summary.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime,timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PASSWORD = 'milk-and-honey'
+ADMIN_EMAIL = 'bench-admin@example.com'
+BATCH_SIZE = 10000
+ITEMS_PER_ORDER = 4
+
+CATEGORIES = ['Milk', 'Curd', 'Paneer', 'Ghee', 'Sweets', 'Ice Cream', 'Butter', 'Seasonal']
+ADJECTIVES = ['Fresh', 'Organic', 'Malai', 'Desi', 'Farm', 'Kesar', 'Low Fat', 'Full Cream', 'Masala', 'Homemade']
+NOUNS = ['Milk', 'Curd', 'Paneer', 'Ghee', 'Pedha', 'Shrikhand', 'Khoya', 'Lassi', 'Kulfi', 'Butter', 'Buttermilk']
+DESCRIPTIONS = ['made from fresh cow milk', 'from grass-fed buffaloes', 'traditional bilona churning',
+                'delivered every morning', 'rich and creamy', 'no preservatives added']
+PAYMENT_METHODS = ['UPI', 'Card', 'COD', 'Net Banking']
+AREAS = ['Kothrud', 'Baner', 'Aundh', 'Hadapsar', 'Wakad', 'Viman Nagar', 'Shivaji Nagar', 'Kharadi']
+CENTER = (18.5204, 73.8567)  # Pune
+
+
+def user_email(i):
+    return f'bench{i}@example.com'
+
+
+def _next_id(connection, column):
+    from sqlalchemy import func,select
+    return (connection.execute(select(func.max(column))).scalar() or 0) + 1
+
+
+def _insert(connection, table, rows):
+    for start in range(0, len(rows), BATCH_SIZE):
+        connection.execute(table.insert(), rows[start:start + BATCH_SIZE])
+
+
+def seed(app, users=100000, products=10000, order_items=1000000, random_seed=42, log=None):
+    """Append the synthetic data set; returns {'table': rows_added, ...}."""
+    from models import db,User,Admin,Product,Cart,Payment,Order,OrderItem,DeliveryLocation
+    from passwords import password_hasher
+    from stats import refresh_store_stats
+    from migrations import init_db
+    from catalog import catalog_cache
+    import search
+    import analytics
+    import locations
+
+    log = log or (lambda message: print(message, file=sys.stderr))
+    rng = random.Random(random_seed)
+    now = datetime.utcnow()
+    counts = {}
+
+    with app.app_context():
+        init_db()
+        password = password_hasher.hash(PASSWORD)
+
+        with db.engine.begin() as connection:
+            first_user = _next_id(connection, User.user_id)
+            first_product = _next_id(connection, Product.product_id)
+            first_payment = _next_id(connection, Payment.payment_id)
+            first_order = _next_id(connection, Order.order_id)
+
+            if connection.execute(Admin.__table__.select().where(Admin.admin_email == ADMIN_EMAIL)).first() is None:
+                connection.execute(Admin.__table__.insert(), [
+                    {'admin_name': 'Bench Admin', 'admin_email': ADMIN_EMAIL, 'admin_password': password}])
+
+            started = time.perf_counter()
+            user_rows = [{
+                'user_id': first_user + i,
+                'username': f'bench{first_user + i}',
+                'email': user_email(first_user + i),
+                'password': password,
+                'phone': f'9{rng.randrange(10 ** 9):09d}',
+                'address': f'{rng.randint(1, 400)}, {rng.choice(AREAS)}, Pune',
+                'created_at': now - timedelta(days=rng.uniform(0, 730)),
+            } for i in range(users)]
+            _insert(connection, User.__table__, user_rows)
+            counts['user'] = users
+            log(f"users: {users} in {time.perf_counter() - started:.1f}s")
+
+            started = time.perf_counter()
+            product_rows = []
+            for i in range(products):
+                name = f"{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {first_product + i}"
+                product_rows.append({
+                    'product_id': first_product + i,
+                    'product_name': name,
+                    'description': f"{name} {rng.choice(DESCRIPTIONS)}",
+                    'category': rng.choice(CATEGORIES),
+                    'price': round(rng.uniform(20, 900), 2),
+                    'stock': 10 ** 6,
+                    'created_at': now - timedelta(days=rng.uniform(0, 730)),
+                })
+            _insert(connection, Product.__table__, product_rows)
+            counts['product'] = products
+            log(f"products: {products} in {time.perf_counter() - started:.1f}s")
+
+            user_ids = range(first_user, first_user + users)
+            prices = {row['product_id']: row['price'] for row in product_rows}
+            product_ids = list(prices)
+
+            started = time.perf_counter()
+            orders = order_items // ITEMS_PER_ORDER if users and products else 0
+            payment_rows, order_rows, item_rows = [], [], []
+            for i in range(orders):
+                user_id = rng.choice(user_ids)
+                ordered_at = now - timedelta(days=rng.uniform(0, 365))
+                lines = rng.sample(product_ids, min(ITEMS_PER_ORDER, len(product_ids)))
+                quantities = [rng.randint(1, 3) for _ in lines]
+                total = round(sum(prices[p] * q for p, q in zip(lines, quantities)), 2)
+                payment_rows.append({'payment_id': first_payment + i, 'user_id': user_id, 'amount': total,
+                                     'payment_date': ordered_at, 'payment_method': rng.choice(PAYMENT_METHODS),
+                                     'status': 'Completed'})
+                order_rows.append({'order_id': first_order + i, 'payment_id': first_payment + i,
+                                   'user_id': user_id, 'order_date': ordered_at, 'total_amount': total,
+                                   'status': 'Delivered' if ordered_at < now - timedelta(days=2) else 'Completed'})
+                item_rows.extend({'order_id': first_order + i, 'product_id': p, 'quantity': q,
+                                  'price_per_item': prices[p]} for p, q in zip(lines, quantities))
+                if len(item_rows) >= BATCH_SIZE * 5:
+                    _flush_orders(connection, payment_rows, order_rows, item_rows)
+                    counts['order_item'] = counts.get('order_item', 0) + len(item_rows)
+                    payment_rows, order_rows, item_rows = [], [], []
+            _flush_orders(connection, payment_rows, order_rows, item_rows)
+            counts['order_item'] = counts.get('order_item', 0) + len(item_rows)
+            counts['order'] = counts['payment'] = orders
+            log(f"orders: {orders} with {counts['order_item']} items in {time.perf_counter() - started:.1f}s")
+
+            started = time.perf_counter()
+            cart_rows = []
+            for user_id in rng.sample(user_ids, users // 20) if products else []:
+                for product_id in rng.sample(product_ids, min(rng.randint(1, 5), len(product_ids))):
+                    cart_rows.append({'user_id': user_id, 'product_id': product_id,
+                                      'quantity': rng.randint(1, 4), 'added_at': now - timedelta(hours=rng.uniform(0, 72))})
+            _insert(connection, Cart.__table__, cart_rows)
+            counts['cart'] = len(cart_rows)
+
+            location_rows = [{
+                'user_id': user_id,
+                'address': f'{rng.randint(1, 400)}, {rng.choice(AREAS)}, Pune',
+                'latitude': CENTER[0] + rng.uniform(-0.15, 0.15),
+                'longitude': CENTER[1] + rng.uniform(-0.15, 0.15),
+                'added_at': now - timedelta(days=rng.uniform(0, 365)),
+            } for user_id in rng.sample(user_ids, users * 3 // 10)]
+            for row in location_rows:
+                row['location_key'] = locations.location_key(row['address'], row['latitude'], row['longitude'])
+                row['last_used_at'] = row['added_at']
+            _insert(connection, DeliveryLocation.__table__, location_rows)
+            counts['delivery_location'] = len(location_rows)
+            log(f"carts and locations in {time.perf_counter() - started:.1f}s")
+
+            if search.fts_enabled(connection):
+                search.create_index(connection)
+                search.rebuild_index(connection)
+
+        started = time.perf_counter()
+        analytics.backfill(db.engine, now.date() - timedelta(days=366))
+        log(f"sales rollups in {time.perf_counter() - started:.1f}s")
+
+        refresh_store_stats()
+        catalog_cache.bump()
+    return counts
+
+
+def _flush_orders(connection, payment_rows, order_rows, item_rows):
+    from models import Payment,Order,OrderItem
+    _insert(connection, Payment.__table__, payment_rows)
+    _insert(connection, Order.__table__, order_rows)
+    _insert(connection, OrderItem.__table__, item_rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--products', type=int, default=10000)
+    parser.add_argument('--order-items', type=int, default=1000000)
+    parser.add_argument('--seed', type=int, default=42, help='random seed')
+    args = parser.parse_args()
+
+    if not os.getenv('DATABASE_URL'):
+        tmpdir = tempfile.mkdtemp(prefix='sudhamrit-seed-')
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmpdir, 'seed.db')}"
+    from app import create_app
+    from passwords import password_hasher
+
+    password_hasher.configure(pool_size=0)
+    app = create_app()
+    started = time.perf_counter()
+    counts = seed(app, args.users, args.products, args.order_items, args.seed)
+    password_hasher.shutdown()
+    print(json.dumps({'database_url': os.environ['DATABASE_URL'], 'rows': counts,
+                      'seconds': round(time.perf_counter() - started, 1)}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
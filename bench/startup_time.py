@@ -0,0 +1,103 @@
+"""
+Worker startup time: import-time DB setup vs. the app factory vs. fork.
+
+    python bench/startup_time.py --runs 10
+
+Measures the time from process start (or fork) until a worker has answered
+its first request, for three ways a worker can come up:
+
+  legacy   fresh interpreter, import, create_all() + migrations check, first
+           request; what every worker (and every CLI call) used to pay
+  factory  fresh interpreter, import, create_app(), first request
+  preload  fork from a parent that already built the app (gunicorn --preload),
+           first request in the child
+
+Runs against a scratch SQLite database initialised once up front, and prints
+p50/min/max milliseconds per mode as JSON.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+CHILD = """
+import time, sys
+started = time.perf_counter()
+from app import create_app
+app = create_app()
+if sys.argv[1] == 'legacy':
+    from migrations import init_db
+    with app.app_context():
+        init_db()
+status = app.test_client().get('/products').status_code
+assert status == 200, status
+print(time.perf_counter() - started)
+"""
+
+
+def run_fresh(mode, env):
+    started = time.perf_counter()
+    output = subprocess.run([sys.executable, '-c', CHILD, mode], cwd=ROOT, env=env, check=True,
+                            capture_output=True, text=True).stdout
+    wall = time.perf_counter() - started
+    return wall, float(output.strip().splitlines()[-1])
+
+
+def run_forked(app):
+    read_fd, write_fd = os.pipe()
+    started = time.perf_counter()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        status = app.test_client().get('/products').status_code
+        os.write(write_fd, str(status).encode())
+        os._exit(0)
+    os.close(write_fd)
+    status = int(os.read(read_fd, 16) or 0)
+    os.waitpid(pid, 0)
+    os.close(read_fd)
+    assert status == 200, status
+    return time.perf_counter() - started
+
+
+def summary(values):
+    ms = [v * 1000 for v in values]
+    return {'p50_ms': round(statistics.median(ms), 1), 'min_ms': round(min(ms), 1), 'max_ms': round(max(ms), 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix='sudhamrit-startup-')
+    os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(tmpdir, 'startup.db')}")
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    env = dict(os.environ, PYTHONPATH=ROOT)
+
+    from app import create_app
+    from migrations import init_db
+
+    app = create_app()
+    with app.app_context():
+        init_db()
+    app.test_client().get('/products')  # warm the parent like a preloaded master
+
+    report = {}
+    for mode in ('legacy', 'factory'):
+        results = [run_fresh(mode, env) for _ in range(args.runs)]
+        report[mode] = dict(summary([inner for _, inner in results]),
+                            process_wall=summary([wall for wall, _ in results]))
+    report['preload'] = summary([run_forked(app) for _ in range(args.runs)])
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+"""
+Nightly subscription order generation at scale.
+
+    python bench/subscription_orders.py --subscriptions 50000 --users 35000
+
+Seeds a scratch shop (bench/seed.py), bulk-adds subscriptions with a mix of
+schedules, pauses and cancellations, and leaves a few products short of
+stock. Then it times generate_orders() for tomorrow, runs it again to show
+the second run has nothing left to do, restocks the short products and runs
+it a third time to serve what was left, and checks the results: stock taken
+equals units ordered, every served subscription has exactly one ledger row,
+each customer still has one order for the day whose total and payment match
+its items, and the sales rollups for the day match the order items.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+SCHEDULES = ['daily'] * 6 + ['alternate'] * 2 + ['mon,wed,fri', 'tue,thu,sat', 'sun']
+SHORT_PRODUCTS = 3
+RESTOCK = 100000
+
+
+def add_subscriptions(app, count, rng, day):
+    from sqlalchemy import func,select
+    from models import db,User,Product,Subscription
+    with app.app_context():
+        users = db.session.execute(select(func.min(User.user_id), func.max(User.user_id))).one()
+        products = db.session.execute(select(Product.product_id).order_by(Product.product_id)).scalars().all()
+        rows = []
+        for _ in range(count):
+            start = day - timedelta(days=rng.randint(0, 60))
+            row = {'user_id': rng.randint(*users), 'product_id': rng.choice(products[:40]),
+                   'quantity': rng.choice((1, 1, 1, 2, 2, 3)), 'schedule': rng.choice(SCHEDULES),
+                   'start_date': start, 'end_date': None, 'paused_from': None, 'paused_until': None,
+                   'status': 'Active'}
+            roll = rng.random()
+            if roll < 0.05:
+                row['paused_from'], row['paused_until'] = day - timedelta(days=2), day + timedelta(days=3)
+            elif roll < 0.08:
+                row['status'] = 'Cancelled'
+            elif roll < 0.10:
+                row['end_date'] = day - timedelta(days=1)
+            rows.append(row)
+        for start in range(0, len(rows), 10000):
+            db.session.execute(Subscription.__table__.insert(), rows[start:start + 10000])
+        # A few products can cover only part of tomorrow's demand.
+        db.session.execute(Product.__table__.update().where(Product.product_id.in_(products[:SHORT_PRODUCTS]))
+                           .values(stock=50))
+        db.session.commit()
+
+
+def restock(app):
+    from sqlalchemy import select
+    from models import db,Product
+    with app.app_context():
+        products = db.session.execute(select(Product.product_id).order_by(Product.product_id)
+                                      .limit(SHORT_PRODUCTS)).scalars().all()
+        db.session.execute(Product.__table__.update().where(Product.product_id.in_(products))
+                           .values(stock=Product.stock + RESTOCK))
+        db.session.commit()
+    return RESTOCK * SHORT_PRODUCTS
+
+
+def snapshot(app, day):
+    from sqlalchemy import func,select
+    from models import db,Product,Payment,Order,OrderItem,SalesDaily,Subscription,SubscriptionDelivery
+    with app.app_context():
+        stock = db.session.execute(select(func.sum(Product.stock))).scalar()
+        delivered = select(SubscriptionDelivery.order_id).where(SubscriptionDelivery.delivery_date == day)
+        ordered = db.session.execute(
+            select(func.count(OrderItem.order_item_id), func.coalesce(func.sum(OrderItem.quantity), 0))
+            .where(OrderItem.order_id.in_(delivered))).one()
+        orders = db.session.execute(select(func.count(func.distinct(SubscriptionDelivery.order_id)))
+                                    .where(SubscriptionDelivery.delivery_date == day)).scalar()
+        ledger = db.session.execute(select(func.count()).select_from(SubscriptionDelivery)
+                                    .where(SubscriptionDelivery.delivery_date == day)).scalar()
+        rollup = db.session.execute(select(func.coalesce(func.sum(SalesDaily.units), 0))
+                                    .where(SalesDaily.sales_day == day)).scalar()
+        customers = db.session.execute(
+            select(func.count(func.distinct(Subscription.user_id)))
+            .join(SubscriptionDelivery, SubscriptionDelivery.subscription_id == Subscription.subscription_id)
+            .where(SubscriptionDelivery.delivery_date == day)).scalar()
+        item_totals = (select(OrderItem.order_id,
+                              func.sum(OrderItem.quantity * OrderItem.price_per_item).label('total'))
+                       .where(OrderItem.order_id.in_(delivered)).group_by(OrderItem.order_id).subquery())
+        mismatched = db.session.execute(
+            select(func.count()).select_from(Order)
+            .join(item_totals, item_totals.c.order_id == Order.order_id)
+            .join(Payment, Payment.payment_id == Order.payment_id)
+            .where((func.abs(Order.total_amount - item_totals.c.total) > 0.01)
+                   | (func.abs(Payment.amount - item_totals.c.total) > 0.01))).scalar()
+        return {'stock': stock, 'orders': orders, 'customers': customers, 'items': ordered[0], 'units': ordered[1],
+                'ledger': ledger, 'rollup_units': rollup, 'mismatched_totals': mismatched}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--subscriptions', type=int, default=50000)
+    parser.add_argument('--users', type=int, default=35000)
+    parser.add_argument('--products', type=int, default=200)
+    parser.add_argument('--batch-size', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=42, help='random seed')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix='sudhamrit-subscriptions-')
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    from app import create_app
+    from passwords import password_hasher
+    import analytics
+    import seed
+    import subscriptions
+
+    password_hasher.configure(pool_size=0)
+    app = create_app()
+    seed.seed(app, users=args.users, products=args.products, order_items=20000, random_seed=args.seed,
+              log=lambda message: None)
+    password_hasher.shutdown()
+    day = analytics.today() + timedelta(days=1)
+    add_subscriptions(app, args.subscriptions, random.Random(args.seed), day)
+
+    before = snapshot(app, day)
+    runs = []
+    restocked = 0
+    for run in range(3):
+        if run == 2:
+            restocked = restock(app)
+        with app.app_context():
+            started = time.perf_counter()
+            totals = subscriptions.generate_orders(day, batch_size=args.batch_size)
+            runs.append(dict(totals, seconds=round(time.perf_counter() - started, 2)))
+    after = snapshot(app, day)
+
+    print(json.dumps({
+        'subscriptions': args.subscriptions,
+        'delivery_date': day.isoformat(),
+        'first_run': runs[0],
+        'second_run': runs[1],
+        'after_restock': runs[2],
+        'checks': {
+            'stock_taken_matches_units': before['stock'] + restocked - after['stock'] == after['units'],
+            'one_ledger_row_per_item': after['ledger'] == after['items'],
+            'rollup_matches_items': after['rollup_units'] == after['units'],
+            'one_order_per_customer': after['orders'] == after['customers'],
+            'orders_reported': after['orders'] == runs[0]['orders'] + runs[2]['orders'],
+            'totals_match_items': after['mismatched_totals'] == 0,
+            'second_run_idempotent': runs[1]['orders'] == 0,
+        },
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,378 @@
+"""
+Route-level benchmark suite for the main shop flows.
+
+    python bench/suite.py --requests 200 --workers 8 --output results.json
+    python bench/suite.py --compare results.json
+
+Drives browse, catalog API, search, add-to-cart, update_cart, cart,
+checkout (payment + payment_success), the admin dashboard and the orders
+page. It runs in two modes:
+
+  inprocess  one Flask test client, sequential: per-request cost with no
+             network or scheduling noise
+  http       --workers threads with their own sessions against a threaded
+             server on localhost: throughput and latency under concurrency
+
+Each route gets p50/p95/p99/mean latency, requests per second, the error
+count and the number of SQL statements per request. The report is JSON,
+with the git commit and data-set size so runs can be compared over time.
+--compare prints the p95 and query-count change against an earlier report.
+
+Without DATABASE_URL the suite seeds a scratch SQLite database with
+bench/seed.py (--users/--products/--order-items). With DATABASE_URL it uses
+that database as is, and expects bench/seed.py to have been run against it.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sqlalchemy.engine import make_url
+
+import seed as seeding
+
+QUERY_COUNT_HEADER = 'X-Bench-Queries'
+SEARCH_TERMS = ['paneer', 'pan', 'milk', 'kesar ghee', 'lassi', 'org']
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def count_queries(app):
+    """Count SQL statements per request and return the count in a response header."""
+    from flask import g,has_app_context
+    from sqlalchemy import event
+    from models import db
+
+    with app.app_context():
+        engine = db.engine
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _count(conn, cursor, statement, parameters, context, executemany):
+        if has_app_context():
+            g._bench_queries = g.get('_bench_queries', 0) + 1
+
+    @app.after_request
+    def _report(response):
+        response.headers[QUERY_COUNT_HEADER] = str(g.get('_bench_queries', 0))
+        return response
+
+
+class Shop:
+    """The ids a scenario needs, read once from the seeded database."""
+
+    def __init__(self, app):
+        from sqlalchemy import func
+        from models import db,User,Admin,Product,Order,OrderItem
+
+        with app.app_context():
+            self.user_ids = [row[0] for row in db.session.query(User.user_id)
+                             .filter(User.email.like('bench%@example.com')).order_by(User.user_id).limit(5000)]
+            self.product_ids = [row[0] for row in db.session.query(Product.product_id).filter(Product.stock > 1000)]
+            admin = Admin.query.filter_by(admin_email=seeding.ADMIN_EMAIL).first()
+            self.admin_id = admin.admin_id if admin else None
+            self.size = {
+                'users': db.session.query(func.count(User.user_id)).scalar(),
+                'products': db.session.query(func.count(Product.product_id)).scalar(),
+                'orders': db.session.query(func.count(Order.order_id)).scalar(),
+                'order_items': db.session.query(func.count(OrderItem.order_item_id)).scalar(),
+            }
+        if not self.user_ids or not self.product_ids or not self.admin_id:
+            raise SystemExit("database has no bench data; run bench/seed.py against it first")
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}
+
+    def add(self, route, seconds, status, queries):
+        with self._lock:
+            self.samples.setdefault(route, []).append((seconds, status, queries))
+
+    def counts(self):
+        with self._lock:
+            return {route: len(samples) for route, samples in self.samples.items()}
+
+    def report(self, mode, wall_seconds):
+        rows = []
+        for route, samples in self.samples.items():
+            latencies = [s[0] * 1000 for s in samples]
+            queries = [s[2] for s in samples if s[2] is not None]
+            rows.append({
+                'mode': mode,
+                'route': route,
+                'requests': len(samples),
+                'errors': sum(1 for s in samples if s[1] >= 400),
+                'throughput_rps': round(len(samples) / wall_seconds[route], 1) if wall_seconds.get(route) else None,
+                'p50_ms': round(percentile(latencies, 50), 2),
+                'p95_ms': round(percentile(latencies, 95), 2),
+                'p99_ms': round(percentile(latencies, 99), 2),
+                'mean_ms': round(statistics.mean(latencies), 2),
+                'queries_mean': round(statistics.mean(queries), 1) if queries else None,
+                'queries_max': max(queries) if queries else None,
+            })
+        return rows
+
+
+class TestClientSession:
+    """Scenario driver over app.test_client()."""
+
+    def __init__(self, app, recorder, session_data):
+        self.client = app.test_client()
+        self.recorder = recorder
+        with self.client.session_transaction() as sess:
+            sess.update(session_data)
+
+    def request(self, route, method, path, **kwargs):
+        started = time.perf_counter()
+        response = self.client.open(path, method=method, **kwargs)
+        elapsed = time.perf_counter() - started
+        queries = response.headers.get(QUERY_COUNT_HEADER)
+        self.recorder.add(route, elapsed, response.status_code, int(queries) if queries else None)
+        return response.status_code
+
+
+class HttpSession:
+    """Scenario driver over real HTTP, carrying its own signed session cookie."""
+
+    def __init__(self, base_url, app, recorder, session_data):
+        self.base_url = base_url
+        self.recorder = recorder
+        self.opener = urllib.request.build_opener(_NoRedirect)
+        self.cookie_name = app.config['SESSION_COOKIE_NAME']
+        self.cookie = app.session_interface.get_signing_serializer(app).dumps(dict(session_data))
+
+    def request(self, route, method, path, **kwargs):
+        body, headers, data = None, {}, kwargs.get('data')
+        if kwargs.get('json') is not None:
+            body, headers = json.dumps(kwargs['json']).encode(), {'Content-Type': 'application/json'}
+        elif data is not None:
+            body = urllib.parse.urlencode(data).encode()
+            headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+        headers['Cookie'] = f"{self.cookie_name}={self.cookie}"
+        req = urllib.request.Request(self.base_url + path, data=body, headers=headers, method=method)
+        started = time.perf_counter()
+        try:
+            with self.opener.open(req, timeout=60) as response:
+                response.read()
+                status, response_headers = response.status, response.headers
+        except urllib.error.HTTPError as e:
+            e.read()
+            status, response_headers = e.code, e.headers
+        except OSError:
+            # Connection refused/reset or timeout: count it as a failed request.
+            self.recorder.add(route, time.perf_counter() - started, 599, None)
+            return 599
+        elapsed = time.perf_counter() - started
+        for header in response_headers.get_all('Set-Cookie') or []:
+            name, _, value = header.split(';', 1)[0].partition('=')
+            if name == self.cookie_name:
+                self.cookie = value
+        queries = response_headers.get(QUERY_COUNT_HEADER)
+        self.recorder.add(route, elapsed, status, int(queries) if queries else None)
+        return status
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    # Time the route itself; a 302 is a normal answer, not something to follow.
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+    def http_error_302(self, req, fp, code, msg, headers):
+        return fp
+
+    http_error_301 = http_error_303 = http_error_307 = http_error_302
+
+
+def customer_flow(client, shop, rng):
+    product_id = rng.choice(shop.product_ids)
+    client.request('GET /products', 'GET', '/products')
+    client.request('GET /api/products', 'GET', f'/api/products?limit=50&after={rng.choice(shop.product_ids)}')
+    client.request('GET /api/products/search', 'GET', '/api/products/search?' + urllib.parse.urlencode({'q': rng.choice(SEARCH_TERMS)}))
+    client.request('POST /api/cart/add', 'POST', f'/api/cart/add/{product_id}')
+    client.request('POST /update_cart', 'POST', '/update_cart',
+                   json={'product_id': product_id, 'quantity': rng.randint(1, 3)})
+    client.request('GET /cart', 'GET', '/cart')
+
+
+def checkout_flow(client, shop, rng):
+    for product_id in rng.sample(shop.product_ids, 3):
+        client.request('POST /api/cart/add', 'POST', f'/api/cart/add/{product_id}')
+    client.request('GET /payment', 'GET', '/payment')
+    client.request('POST /payment_success', 'POST', '/payment_success', data={'payment_method': 'UPI'})
+
+
+def admin_flow(client, shop, rng):
+    client.request('GET /admin_dashboard', 'GET', f'/admin_dashboard/{shop.admin_id}')
+    client.request('GET /orders', 'GET', '/orders')
+
+
+FLOWS = [('customer', customer_flow, 'user'), ('checkout', checkout_flow, 'user'), ('admin', admin_flow, 'admin')]
+
+
+def session_for(kind, shop, worker):
+    if kind == 'admin':
+        return {'admin_id': shop.admin_id}
+    return {'user_id': shop.user_ids[worker % len(shop.user_ids)]}
+
+
+def run_inprocess(app, shop, iterations, rng):
+    recorder = Recorder()
+    wall = {}
+    for _, flow, kind in FLOWS:
+        # One untimed pass warms the caches and the connection pool.
+        flow(TestClientSession(app, Recorder(), session_for(kind, shop, 0)), shop, rng)
+        client = TestClientSession(app, recorder, session_for(kind, shop, 0))
+        before = recorder.counts()
+        started = time.perf_counter()
+        for _ in range(iterations):
+            flow(client, shop, rng)
+        _credit_wall(recorder, before, wall, time.perf_counter() - started)
+    return recorder.report('inprocess', wall)
+
+
+def run_http(app, shop, iterations, workers, seed):
+    from werkzeug.serving import make_server
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    recorder = Recorder()
+    wall = {}
+    try:
+        for _, flow, kind in FLOWS:
+            per_worker = max(1, iterations // workers)
+
+            def work(worker):
+                rng = random.Random(seed * 1000 + worker)
+                client = HttpSession(base_url, app, recorder, session_for(kind, shop, worker + 1))
+                for _ in range(per_worker):
+                    flow(client, shop, rng)
+
+            threads = [threading.Thread(target=work, args=(i,)) for i in range(workers)]
+            before = recorder.counts()
+            started = time.perf_counter()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            _credit_wall(recorder, before, wall, time.perf_counter() - started)
+    finally:
+        server.shutdown()
+    return recorder.report('http', wall)
+
+
+def _credit_wall(recorder, before, wall, seconds):
+    # Throughput of a route is its requests over the wall time of every flow
+    # that drove it (add-to-cart runs in both the customer and checkout flows).
+    for route, count in recorder.counts().items():
+        if count > before.get(route, 0):
+            wall[route] = wall.get(route, 0) + seconds
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline_path):
+    with open(baseline_path) as f:
+        baseline = {(row['mode'], row['route']): row for row in json.load(f)['results']}
+    lines = [f"{'mode':<10} {'route':<28} {'p95 ms':>18} {'queries':>14}"]
+    for row in current['results']:
+        old = baseline.get((row['mode'], row['route']))
+        if not old:
+            continue
+        p95 = f"{old['p95_ms']} -> {row['p95_ms']}"
+        queries = f"{old['queries_mean']} -> {row['queries_mean']}"
+        lines.append(f"{row['mode']:<10} {row['route']:<28} {p95:>18} {queries:>14}")
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=100, help='iterations of each flow per mode')
+    parser.add_argument('--workers', type=int, default=8, help='concurrent HTTP clients')
+    parser.add_argument('--mode', choices=['inprocess', 'http', 'both'], default='both')
+    parser.add_argument('--users', type=int, default=5000, help='scratch data set size (no DATABASE_URL)')
+    parser.add_argument('--products', type=int, default=1000)
+    parser.add_argument('--order-items', type=int, default=50000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default='-', help="report path, '-' for stdout")
+    parser.add_argument('--compare', metavar='REPORT', help='print changes against an earlier report')
+    args = parser.parse_args()
+
+    scratch = not os.getenv('DATABASE_URL')
+    if scratch:
+        tmpdir = tempfile.mkdtemp(prefix='sudhamrit-suite-')
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmpdir, 'suite.db')}"
+
+    # Routes print progress; keep stdout for the report.
+    with contextlib.redirect_stdout(sys.stderr):
+        from app import create_app
+        from passwords import password_hasher
+
+        app = create_app()
+        password_hasher.configure(pool_size=0)
+        if scratch:
+            seeding.seed(app, args.users, args.products, args.order_items, args.seed)
+        count_queries(app)
+        shop = Shop(app)
+        rng = random.Random(args.seed)
+
+        results = []
+        if args.mode in ('inprocess', 'both'):
+            results += run_inprocess(app, shop, args.requests, rng)
+        if args.mode in ('http', 'both'):
+            results += run_http(app, shop, args.requests, args.workers, args.seed)
+        password_hasher.shutdown()
+
+    report = {
+        'meta': {
+            'timestamp': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+            'git_commit': git_commit(),
+            'python': platform.python_version(),
+            'database': make_url(os.environ['DATABASE_URL']).get_backend_name(),
+            'data_set': shop.size,
+            'requests_per_flow': args.requests,
+            'workers': args.workers,
+        },
+        'results': sorted(results, key=lambda row: (row['mode'], row['route'])),
+    }
+    text = json.dumps(report, indent=2)
+    if args.output == '-':
+        print(text)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    if args.compare:
+        print(compare(report, args.compare), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Delivery-zone serviceability lookup speed and correctness.
+
+    python bench/zone_lookup.py --points 200000
+
+Builds the grid index for a few radius and polygon zones around Pune, then
+times ZoneIndex.lookup() against testing every zone directly, over random
+points in and around the zones, and checks both give the same answer. No
+database needed.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+CENTER = (18.5204, 73.8567)  # Pune
+
+
+def make_zones():
+    from zones import Zone
+    return [
+        Zone(1, 'Farm', center=(18.5204, 73.8567), radius_km=12.0),
+        Zone(2, 'Hinjewadi depot', center=(18.5912, 73.7389), radius_km=6.0),
+        Zone(3, 'East corridor', polygon=((18.50, 73.90), (18.58, 73.93), (18.60, 74.02), (18.52, 74.05),
+                                          (18.47, 73.98))),
+        Zone(4, 'South notch', polygon=((18.40, 73.80), (18.46, 73.80), (18.43, 73.86), (18.46, 73.92),
+                                        (18.40, 73.92))),
+    ]
+
+
+def brute_force(zones, lat, lon):
+    for zone in zones:
+        if zone.contains(lat, lon):
+            return zone
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--points', type=int, default=200000)
+    parser.add_argument('--seed', type=int, default=42, help='random seed')
+    args = parser.parse_args()
+
+    from zones import ZoneIndex
+    zones = make_zones()
+    started = time.perf_counter()
+    index = ZoneIndex(zones)
+    build_ms = (time.perf_counter() - started) * 1000
+
+    rng = random.Random(args.seed)
+    points = [(CENTER[0] + rng.uniform(-0.25, 0.25), CENTER[1] + rng.uniform(-0.3, 0.3)) for _ in range(args.points)]
+
+    started = time.perf_counter()
+    indexed = [index.lookup(lat, lon) for lat, lon in points]
+    indexed_s = time.perf_counter() - started
+    started = time.perf_counter()
+    direct = [brute_force(zones, lat, lon) for lat, lon in points]
+    direct_s = time.perf_counter() - started
+
+    # Overlapping zones may legitimately answer with different zones; serviceability must agree.
+    mismatches = sum((a is None) != (b is None) for a, b in zip(indexed, direct))
+    full = sum(1 for whole, _ in index.cells.values() if whole)
+    print(json.dumps({
+        'zones': len(zones),
+        'cells': {'full': full, 'edge_only': len(index.cells) - full},
+        'build_ms': round(build_ms, 1),
+        'points': args.points,
+        'serviceable': sum(zone is not None for zone in indexed),
+        'lookup_us': {'indexed': round(indexed_s / args.points * 1e6, 2),
+                      'direct': round(direct_s / args.points * 1e6, 2)},
+        'mismatches': mismatches,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
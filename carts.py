@@ -0,0 +1,144 @@
+"""
+Cart queries shared by the cart, payment and update routes.
+
+Totals are computed in the database with a single SUM over Cart joined to
+Product, instead of loading every line and lazily fetching its product. The
+number of units in the cart is also kept in the session for the navbar badge.
+
+Add-to-cart clicks carry a client-generated request token, remembered on the
+cart line. If the JSON request committed but its response was lost, the page
+falls back to posting the form with the same token, and add_one() sees the
+token already applied instead of adding the unit twice.
+"""
+from flask import session
+from sqlalchemy import func,or_,update
+from sqlalchemy.orm import joinedload
+
+from models import db,Cart,Product
+
+CART_COUNT_KEY = 'cart_count'
+
+
+def cart_lines(user_id):
+    """Cart rows with their products loaded in the same query."""
+    return (Cart.query.options(joinedload(Cart.product))
+            .filter_by(user_id=user_id)
+            .order_by(Cart.cart_id)
+            .all())
+
+
+def cart_total(user_id):
+    total = (db.session.query(func.coalesce(func.sum(Product.price * Cart.quantity), 0))
+             .select_from(Cart)
+             .join(Product, Cart.product_id == Product.product_id)
+             .filter(Cart.user_id == user_id)
+             .scalar())
+    return float(total)
+
+
+def parse_cart_changes(items):
+    """
+    Normalise a batch of {'product_id', 'quantity'} dicts into {product_id: quantity}.
+
+    Later entries for the same product win, matching the order the clicks
+    happened in. Raises ValueError on malformed input.
+    """
+    if not isinstance(items, list) or not items:
+        raise ValueError('items must be a non-empty list')
+    changes = {}
+    for entry in items:
+        if not isinstance(entry, dict):
+            raise ValueError('each item must be an object')
+        try:
+            changes[int(entry.get('product_id'))] = int(entry.get('quantity'))
+        except (TypeError, ValueError):
+            raise ValueError('product_id and quantity must be integers')
+    return changes
+
+
+def apply_cart_changes(user_id, changes):
+    """
+    Set quantities for several lines at once; a quantity <= 0 removes the line.
+
+    Runs in the caller's transaction and returns ({product_id: item_total},
+    [product ids not in the cart]).
+    """
+    lines = (Cart.query.options(joinedload(Cart.product))
+             .filter(Cart.user_id == user_id, Cart.product_id.in_(changes))
+             .all())
+    found = {line.product_id: line for line in lines}
+
+    item_totals = {}
+    for product_id, quantity in changes.items():
+        line = found.get(product_id)
+        if line is None:
+            continue
+        if quantity <= 0:
+            db.session.delete(line)
+            item_totals[product_id] = 0
+        else:
+            line.quantity = quantity
+            item_totals[product_id] = line.product.price * quantity
+    missing = [product_id for product_id in changes if product_id not in found]
+    return item_totals, missing
+
+
+def add_one(user_id, product_id, token=None):
+    """
+    Add one unit of a product in the caller's transaction; returns (line, added).
+
+    added is False when token was already applied to this line (a retried
+    click). The increment is a conditional UPDATE so the check and the add
+    cannot be split by a concurrent retry.
+    """
+    token = (token or '')[:40] or None
+    condition = [Cart.user_id == user_id, Cart.product_id == product_id]
+    if token:
+        condition.append(or_(Cart.request_token.is_(None), Cart.request_token != token))
+    updated = db.session.execute(
+        update(Cart).where(*condition)
+        .values(quantity=Cart.quantity + 1, request_token=token)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    line = (Cart.query.filter_by(user_id=user_id, product_id=product_id)
+            .populate_existing().first())
+    if updated:
+        return line, True
+    if line is not None:
+        return line, False
+    line = Cart(user_id=user_id, product_id=product_id, quantity=1, request_token=token)
+    db.session.add(line)
+    db.session.flush()
+    return line, True
+
+
+def cart_count(user_id):
+    """Total units in the user's cart."""
+    return int(db.session.query(func.coalesce(func.sum(Cart.quantity), 0))
+               .filter(Cart.user_id == user_id)
+               .scalar())
+
+
+def session_cart_count(user_id):
+    """
+    Cart badge count, cached in the session so listing pages don't query Cart.
+
+    Routes that change the cart either adjust the cached value by the known
+    delta or drop it with forget_cart_count() to have it recomputed here.
+    """
+    if CART_COUNT_KEY not in session:
+        session[CART_COUNT_KEY] = cart_count(user_id)
+    return session[CART_COUNT_KEY]
+
+
+def adjust_cart_count(delta):
+    if CART_COUNT_KEY in session:
+        session[CART_COUNT_KEY] = max(0, session[CART_COUNT_KEY] + delta)
+
+
+def set_cart_count(count):
+    session[CART_COUNT_KEY] = count
+
+
+def forget_cart_count():
+    session.pop(CART_COUNT_KEY, None)
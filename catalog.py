@@ -0,0 +1,146 @@
+"""
+Versioned product catalog cache.
+
+The catalog only changes through the admin product routes, so /products can
+serve a snapshot of it until one of those routes bumps the catalog version.
+The version lives in a small file in the instance folder: every gunicorn
+worker checks it with a single read per request, and a bump from any worker
+invalidates all of them without touching the database. Each worker keeps the
+snapshot and the rendered product-grid fragment for the current version only.
+
+/api/products pages through the same snapshot, so its ETag is just the
+catalog version plus the request shape. Stock is the exception: checkout
+decrements it without bumping the version, so page() can overlay live stock
+for the rows on a page.
+"""
+import bisect
+import os
+import threading
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+from models import db,Product
+from versionfile import VersionFile
+
+API_FIELDS = ('product_id', 'product_name', 'description', 'category', 'price', 'stock',
+              'product_image', 'created_at')
+
+
+@dataclass(frozen=True)
+class CatalogProduct:
+    """Read-only copy of a Product row, safe to share between requests."""
+    product_id: int
+    product_name: str
+    description: Optional[str]
+    category: str
+    price: float
+    stock: int
+    product_image: Optional[str]
+    created_at: Optional[datetime]
+
+    @classmethod
+    def from_model(cls, product):
+        return cls(
+            product_id=product.product_id,
+            product_name=product.product_name,
+            description=product.description,
+            category=product.category,
+            price=product.price,
+            stock=product.stock,
+            product_image=product.product_image,
+            created_at=product.created_at,
+        )
+
+
+class CatalogCache:
+    def __init__(self, version_file=None):
+        self._version_file = VersionFile(version_file)
+        self._lock = threading.Lock()
+        self._version = None
+        self._entries = {}
+        self.hits = {'products': 0, 'grid': 0}
+        self.misses = {'products': 0, 'grid': 0}
+
+    def init_app(self, app):
+        self._version_file.configure(app.config.get('CATALOG_VERSION_FILE')
+                                     or os.path.join(app.instance_path, 'catalog.version'))
+        app.extensions['catalog_cache'] = self
+
+    def version(self):
+        return self._version_file.read()
+
+    def bump(self):
+        """Start a new catalog version; call after committing a product change."""
+        token = self._version_file.bump()
+        self.clear()
+        return token
+
+    def clear(self):
+        with self._lock:
+            self._version = None
+            self._entries = {}
+
+    def _get(self, key, build):
+        version = self.version()
+        with self._lock:
+            if self._version == version and key in self._entries:
+                self.hits[key] += 1
+                return self._entries[key]
+        value = build()
+        with self._lock:
+            self.misses[key] += 1
+            if self._version != version:
+                self._version = version
+                self._entries = {}
+            self._entries[key] = value
+        return value
+
+    def products(self):
+        """All products for the current catalog version, oldest first."""
+        return self._get('products', lambda: tuple(
+            CatalogProduct.from_model(p) for p in Product.query.order_by(Product.product_id).all()
+        ))
+
+    def product_grid(self, render):
+        """Rendered grid fragment; render(products) is only called on a miss."""
+        return self._get('grid', lambda: render(self.products()))
+
+    def page(self, after=None, limit=50):
+        """Products with product_id > after, oldest first, plus the cursor of the next page."""
+        products = self.products()
+        start = bisect.bisect_right(products, after, key=lambda p: p.product_id) if after is not None else 0
+        rows = products[start:start + limit]
+        next_cursor = str(rows[-1].product_id) if start + limit < len(products) else None
+        return rows, next_cursor
+
+    def stats(self):
+        with self._lock:
+            return {
+                'version': self._version,
+                'hits': dict(self.hits),
+                'misses': dict(self.misses),
+            }
+
+
+def live_stock(product_ids):
+    """Current stock for the given products in one primary-key lookup."""
+    if not product_ids:
+        return {}
+    return dict(db.session.query(Product.product_id, Product.stock)
+                .filter(Product.product_id.in_(product_ids)).all())
+
+
+def api_dict(product, fields, stock=None):
+    row = {}
+    for field in fields:
+        value = getattr(product, field)
+        if field == 'stock' and stock is not None:
+            value = stock.get(product.product_id, 0)
+        elif field == 'created_at' and value is not None:
+            value = value.isoformat()
+        row[field] = value
+    return row
+
+
+catalog_cache = CatalogCache()
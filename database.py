@@ -0,0 +1,95 @@
+"""
+Database connection settings.
+
+The URL and pool sizing come from the environment so the same code runs on
+the bundled SQLite file and on Postgres:
+
+    DATABASE_URL          default sqlite:///users.db (postgres:// is accepted)
+    DB_POOL_SIZE          default 5       (ignored for SQLite)
+    DB_MAX_OVERFLOW       default 10      (ignored for SQLite)
+    DB_POOL_RECYCLE       default 1800 s  (ignored for SQLite)
+    DB_POOL_TIMEOUT       default 30 s    (ignored for SQLite)
+    SQLITE_BUSY_TIMEOUT   default 5000 ms
+
+SQLite connections are switched to WAL so readers never block the single
+writer, with synchronous=NORMAL (safe under WAL) and a busy timeout so
+concurrent gunicorn writers queue up instead of failing immediately.
+"""
+import os
+import weakref
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+DEFAULT_DATABASE_URL = 'sqlite:///users.db'
+
+
+def database_url():
+    url = os.getenv('DATABASE_URL', DEFAULT_DATABASE_URL)
+    if url.startswith('postgres://'):
+        url = 'postgresql://' + url[len('postgres://'):]
+    return url
+
+
+def engine_options(url):
+    if url.startswith('sqlite'):
+        return {}
+    return {
+        'pool_size': int(os.getenv('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', 10)),
+        'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', 1800)),
+        'pool_timeout': int(os.getenv('DB_POOL_TIMEOUT', 30)),
+        'pool_pre_ping': True,
+    }
+
+
+_engines = weakref.WeakSet()
+_fork_hook_registered = False
+
+
+def _dispose_known_engines():
+    for engine in list(_engines):
+        engine.dispose(close=False)
+
+
+def dispose_engines_after_fork(app, db):
+    """
+    Drop pooled connections inherited from a preloaded parent process.
+
+    Under 'gunicorn --preload' the app (and possibly a connection, e.g. from
+    INIT_DB_ON_START) is created before the workers fork; a socket shared by
+    two processes corrupts both sides, so each child starts with an empty
+    pool. close=False leaves the parent's connections alone.
+
+    The fork hook is registered once per process and disposes every engine
+    of every app built so far; engines are held weakly, so apps that tests
+    and benches throw away are not kept alive by it.
+    """
+    global _fork_hook_registered
+    with app.app_context():
+        _engines.update(db.engines.values())
+    if not _fork_hook_registered:
+        os.register_at_fork(after_in_child=_dispose_known_engines)
+        _fork_hook_registered = True
+
+
+def configure_database(app):
+    """Fill in the SQLAlchemy config; call before db.init_app(app)."""
+    url = database_url()
+    app.config.setdefault('SQLALCHEMY_DATABASE_URI', url)
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config['SQLALCHEMY_DATABASE_URI']))
+
+
+@event.listens_for(Engine, 'connect')
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    if type(dbapi_connection).__module__.split('.')[0] not in ('sqlite3', 'pysqlite2'):
+        return
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.execute(f"PRAGMA busy_timeout={int(os.getenv('SQLITE_BUSY_TIMEOUT', 5000))}")
+        cursor.execute('PRAGMA temp_store=MEMORY')
+        cursor.execute('PRAGMA cache_size=-20000')
+    finally:
+        cursor.close()
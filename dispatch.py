@@ -0,0 +1,248 @@
+"""
+Delivery batching and route planning.
+
+The day's undelivered orders become delivery batches, one per vehicle run
+from the depot and back:
+
+  1. Each order is dropped at the delivery location copied onto it at
+     checkout. Older orders without that copy fall back to the customer's
+     saved location first saved before the order was placed (or their
+     latest, if none was saved yet).
+  2. Drops are swept by bearing around the depot, starting at the widest
+     empty sector, and cut into batches whenever a vehicle's stop or unit
+     capacity would be exceeded. Neighbouring bearings end up in the same
+     van, so batches are compact wedges rather than criss-crossing the city.
+  3. Each batch is ordered with nearest-neighbour from the depot and then
+     improved with 2-opt, over a haversine distance matrix of just that
+     batch (a few dozen points), so planning stays linear in the number of
+     batches.
+
+Plain Python rather than NumPy: matrices are batch-sized, and 5,000 drops
+plan in well under a second on one core (bench/route_plan.py).
+"""
+import time
+from dataclasses import dataclass
+from datetime import datetime,timedelta
+from math import asin,atan2,cos,pi,radians,sin,sqrt
+
+from sqlalchemy import func,select
+
+from analytics import DAY_OFFSET
+from models import db,User,Order,OrderItem,DeliveryLocation
+
+EARTH_RADIUS_KM = 6371.0088
+ID_CHUNK = 500
+
+
+@dataclass(frozen=True)
+class Stop:
+    order_id: int
+    user_id: int
+    customer: str
+    address: str
+    latitude: float
+    longitude: float
+    units: int
+    total_amount: float
+    order_date: datetime
+
+
+@dataclass(frozen=True)
+class Batch:
+    number: int
+    stops: tuple
+    legs_km: tuple  # depot -> stop 1, stop 1 -> stop 2, ..., last stop -> depot
+    distance_km: float
+    units: int
+
+    def as_dict(self):
+        return {
+            'batch': self.number,
+            'units': self.units,
+            'distance_km': round(self.distance_km, 2),
+            'return_km': round(self.legs_km[-1], 2),
+            'stops': [{
+                'sequence': position + 1,
+                'order_id': stop.order_id,
+                'customer': stop.customer,
+                'address': stop.address,
+                'latitude': stop.latitude,
+                'longitude': stop.longitude,
+                'units': stop.units,
+                'total_amount': stop.total_amount,
+                'leg_km': round(leg, 2),
+            } for position, (stop, leg) in enumerate(zip(self.stops, self.legs_km))],
+        }
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(radians, (lat1, lon1, lat2, lon2))
+    a = sin((lat2 - lat1) / 2) ** 2 + cos(lat1) * cos(lat2) * sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * asin(sqrt(min(a, 1.0)))  # rounding can push a just past 1
+
+
+def distance_matrix(points):
+    """Symmetric haversine matrix (lists of km) for [(lat, lon), ...]."""
+    prepared = [(radians(lat), radians(lon), cos(radians(lat))) for lat, lon in points]
+    size = len(points)
+    matrix = [[0.0] * size for _ in range(size)]
+    for i in range(size):
+        lat1, lon1, cos1 = prepared[i]
+        row = matrix[i]
+        for j in range(i + 1, size):
+            lat2, lon2, cos2 = prepared[j]
+            a = sin((lat2 - lat1) / 2) ** 2 + cos1 * cos2 * sin((lon2 - lon1) / 2) ** 2
+            row[j] = matrix[j][i] = 2 * EARTH_RADIUS_KM * asin(sqrt(min(a, 1.0)))
+    return matrix
+
+
+def nearest_neighbour(matrix):
+    """Closed tour over matrix indices, starting and ending at 0 (the depot)."""
+    tour = [0]
+    left = set(range(1, len(matrix)))
+    while left:
+        row = matrix[tour[-1]]
+        closest = min(left, key=row.__getitem__)
+        tour.append(closest)
+        left.remove(closest)
+    tour.append(0)
+    return tour
+
+
+def two_opt(tour, matrix, max_passes=50):
+    """Reverse segments of a closed tour while that shortens it; the depot ends stay put."""
+    last = len(tour) - 1
+    for _ in range(max_passes):
+        improved = False
+        for i in range(1, last - 1):
+            a = tour[i - 1]
+            row_a = matrix[a]
+            b = tour[i]
+            row_b = matrix[b]
+            for j in range(i + 1, last):
+                c, d = tour[j], tour[j + 1]
+                if row_a[c] + row_b[d] - row_a[b] - matrix[c][d] < -1e-9:
+                    tour[i:j + 1] = tour[j:i - 1:-1]
+                    b = tour[i]
+                    row_b = matrix[b]
+                    improved = True
+        if not improved:
+            break
+    return tour
+
+
+def sweep(stops, depot, max_stops, max_units=0):
+    """Split stops into capacity-bounded groups of neighbouring bearings from the depot."""
+    if not stops:
+        return []
+    lat0, lon0 = depot
+    scale = cos(radians(lat0))
+    bearings = sorted(((atan2(stop.latitude - lat0, (stop.longitude - lon0) * scale), stop.order_id, stop)
+                       for stop in stops), key=lambda entry: entry[:2])
+    # Start just after the widest gap between bearings, so no cluster is cut in two at +-pi.
+    widest, start = -1.0, 0
+    for i, (bearing, _, _) in enumerate(bearings):
+        following = bearings[(i + 1) % len(bearings)][0]
+        gap = (following - bearing) % (2 * pi)
+        if gap > widest:
+            widest, start = gap, (i + 1) % len(bearings)
+    ordered = [stop for _, _, stop in bearings[start:] + bearings[:start]]
+
+    groups, current, units = [], [], 0
+    for stop in ordered:
+        if current and (len(current) >= max_stops or (max_units and units + stop.units > max_units)):
+            groups.append(current)
+            current, units = [], 0
+        current.append(stop)
+        units += stop.units
+    groups.append(current)
+    return groups
+
+
+def plan_routes(stops, depot, max_stops=25, max_units=0):
+    """Batch and sequence stops; returns [Batch] in sweep order."""
+    batches = []
+    for number, group in enumerate(sweep(stops, depot, max_stops, max_units), 1):
+        matrix = distance_matrix([depot] + [(stop.latitude, stop.longitude) for stop in group])
+        tour = two_opt(nearest_neighbour(matrix), matrix)
+        legs = tuple(matrix[a][b] for a, b in zip(tour, tour[1:]))
+        batches.append(Batch(number=number, stops=tuple(group[index - 1] for index in tour[1:-1]),
+                             legs_km=legs, distance_km=sum(legs), units=sum(stop.units for stop in group)))
+    return batches
+
+
+def _chunks(values):
+    values = list(values)
+    for start in range(0, len(values), ID_CHUNK):
+        yield values[start:start + ID_CHUNK]
+
+
+def pending_stops(day, lookback_days=7):
+    """
+    Undelivered orders placed in the lookback_days (shop-local) days up to and
+    including day, as (stops, order ids without any saved location).
+
+    The fallback goes by added_at, which saving a location again leaves
+    alone, so re-saving an old address does not pull older orders to it.
+    """
+    utc_end = datetime.combine(day + timedelta(days=1), datetime.min.time()) - DAY_OFFSET
+    utc_start = utc_end - timedelta(days=lookback_days)
+    orders = db.session.execute(
+        select(Order.order_id, Order.user_id, Order.order_date, Order.total_amount, User.username,
+               Order.delivery_address, Order.delivery_latitude, Order.delivery_longitude)
+        .join(User, User.user_id == Order.user_id)
+        .where(Order.order_date >= utc_start, Order.order_date < utc_end, Order.status != 'Delivered')
+        .order_by(Order.order_id)
+    ).all()
+
+    units, locations = {}, {}
+    for ids in _chunks(order.order_id for order in orders):
+        units.update(db.session.execute(
+            select(OrderItem.order_id, func.sum(OrderItem.quantity))
+            .where(OrderItem.order_id.in_(ids)).group_by(OrderItem.order_id)).all())
+    for ids in _chunks({order.user_id for order in orders if order.delivery_latitude is None}):
+        rows = db.session.execute(
+            select(DeliveryLocation.user_id, DeliveryLocation.address, DeliveryLocation.latitude,
+                   DeliveryLocation.longitude, DeliveryLocation.added_at)
+            .where(DeliveryLocation.user_id.in_(ids))
+            .order_by(DeliveryLocation.user_id, DeliveryLocation.added_at))
+        for row in rows:
+            locations.setdefault(row.user_id, []).append(row)
+
+    stops, unlocated = [], []
+    for order in orders:
+        if order.delivery_latitude is not None:
+            address, latitude, longitude = order.delivery_address, order.delivery_latitude, order.delivery_longitude
+        else:
+            saved = locations.get(order.user_id)
+            if not saved:
+                unlocated.append(order.order_id)
+                continue
+            before = [location for location in saved if location.added_at and location.added_at <= order.order_date]
+            location = (before or saved)[-1]
+            address, latitude, longitude = location.address, location.latitude, location.longitude
+        stops.append(Stop(order_id=order.order_id, user_id=order.user_id, customer=order.username,
+                          address=address, latitude=latitude, longitude=longitude,
+                          units=int(units.get(order.order_id) or 0), total_amount=order.total_amount,
+                          order_date=order.order_date))
+    return stops, unlocated
+
+
+def plan_day(day, depot, max_stops=25, max_units=0, lookback_days=7):
+    """The day's delivery plan as a JSON-ready dict."""
+    started = time.perf_counter()
+    stops, unlocated = pending_stops(day, lookback_days)
+    loaded = time.perf_counter()
+    batches = plan_routes(stops, depot, max_stops, max_units)
+    planned = time.perf_counter()
+    return {
+        'date': day.isoformat(),
+        'depot': {'latitude': depot[0], 'longitude': depot[1]},
+        'max_stops': max_stops,
+        'max_units': max_units or None,
+        'stops': len(stops),
+        'distance_km': round(sum(batch.distance_km for batch in batches), 2),
+        'batches': [batch.as_dict() for batch in batches],
+        'unlocated_orders': unlocated,
+        'timing_ms': {'load': round((loaded - started) * 1000, 1), 'plan': round((planned - loaded) * 1000, 1)},
+    }
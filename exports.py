@@ -0,0 +1,141 @@
+"""
+Streaming order export for accounting.
+
+Orders are read in keyset-paginated chunks of (order_date, order_id), each
+chunk as two plain Core queries: the orders joined to their customer and
+payment, then the line items of just those orders. Rows are not ORM
+objects, so nothing accumulates in the session, and only one chunk is in
+memory at a time however long the date range is. Every chunk is its own
+short read, so a long export never pins one database snapshot.
+
+Two formats:
+
+  csv    one row per line item, with the order, customer and payment
+         columns repeated (orders without items get one row)
+  jsonl  one JSON object per order, with its items nested
+
+Orders whose customer row has been deleted are still exported, with empty
+customer columns. In the CSV, text cells that a spreadsheet would read as a
+formula (starting with =, +, -, @, tab or carriage return) get a leading
+apostrophe, since names, addresses and product names are typed by users.
+"""
+import csv
+import io
+import json
+
+from sqlalchemy import and_,or_,select
+
+from models import db,User,Product,Payment,Order,OrderItem
+
+CHUNK_SIZE = 500
+FLUSH_BYTES = 64 * 1024  # hand the server ~64KB writes rather than one per order
+
+ORDER_COLUMNS = ('order_id', 'order_date', 'status', 'total_amount', 'user_id', 'username', 'email', 'phone',
+                 'address', 'payment_id', 'payment_method', 'payment_status', 'payment_date', 'amount_paid')
+ITEM_COLUMNS = ('order_item_id', 'product_id', 'product_name', 'category', 'quantity', 'price_per_item', 'line_total')
+CSV_COLUMNS = ORDER_COLUMNS + ITEM_COLUMNS
+
+
+def _order_query(start, end, status):
+    query = (select(Order.order_id, Order.order_date, Order.status, Order.total_amount,
+                    Order.user_id, User.username, User.email, User.phone, User.address,
+                    Payment.payment_id, Payment.payment_method, Payment.status.label('payment_status'),
+                    Payment.payment_date, Payment.amount.label('amount_paid'))
+             .outerjoin(User, User.user_id == Order.user_id)
+             .outerjoin(Payment, Payment.payment_id == Order.payment_id)
+             .order_by(Order.order_date, Order.order_id))
+    if start is not None:
+        query = query.where(Order.order_date >= start)
+    if end is not None:
+        query = query.where(Order.order_date < end)
+    if status:
+        query = query.where(Order.status == status)
+    return query
+
+
+def iter_orders(start=None, end=None, status=None, chunk_size=CHUNK_SIZE):
+    """Yield (order, items) dict pairs oldest first; start inclusive, end exclusive."""
+    base = _order_query(start, end, status)
+    position = None
+    while True:
+        query = base
+        if position:
+            query = query.where(or_(Order.order_date > position[0],
+                                    and_(Order.order_date == position[0], Order.order_id > position[1])))
+        orders = db.session.execute(query.limit(chunk_size)).mappings().all()
+        if not orders:
+            return
+
+        items = {}
+        rows = db.session.execute(
+            select(OrderItem.order_id, OrderItem.order_item_id, OrderItem.product_id, Product.product_name,
+                   Product.category, OrderItem.quantity, OrderItem.price_per_item)
+            .outerjoin(Product, Product.product_id == OrderItem.product_id)
+            .where(OrderItem.order_id.in_([order['order_id'] for order in orders]))
+            .order_by(OrderItem.order_id, OrderItem.order_item_id)
+        ).mappings()
+        for row in rows:
+            item = {column: row[column] for column in ITEM_COLUMNS if column != 'line_total'}
+            item['line_total'] = round(row['quantity'] * row['price_per_item'], 2)
+            items.setdefault(row['order_id'], []).append(item)
+        # End the read transaction between chunks.
+        db.session.rollback()
+
+        for order in orders:
+            yield dict(order), items.get(order['order_id'], [])
+        if len(orders) < chunk_size:
+            return
+        position = (orders[-1]['order_date'], orders[-1]['order_id'])
+
+
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def _format(value):
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+
+def _cell(value):
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def csv_lines(orders):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def take():
+        data = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return data
+
+    writer.writerow(CSV_COLUMNS)
+    for order, items in orders:
+        head = [_cell(_format(order[column])) for column in ORDER_COLUMNS]
+        for item in items or [{}]:
+            writer.writerow(head + [_cell(item.get(column)) for column in ITEM_COLUMNS])
+        if buffer.tell() >= FLUSH_BYTES:
+            yield take()
+    yield take()
+
+
+def jsonl_lines(orders):
+    lines, size = [], 0
+    for order, items in orders:
+        record = {column: _format(order[column]) for column in ORDER_COLUMNS}
+        record['items'] = items
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        lines.append(line)
+        size += len(line)
+        if size >= FLUSH_BYTES:
+            yield ''.join(lines)
+            lines, size = [], 0
+    yield ''.join(lines)
+
+
+FORMATS = {
+    'csv': (csv_lines, 'text/csv'),
+    'jsonl': (jsonl_lines, 'application/x-ndjson'),
+}
@@ -0,0 +1,292 @@
+"""
+Server-side geocoding with a two-tier cache.
+
+The payment page used to call Nominatim from every browser on every visit.
+It now asks /api/geocode/reverse and /api/geocode/search, which answer from:
+
+  1. a per-process LRU (GEOCODE_LRU_SIZE entries),
+  2. the geocode_cache table, shared by all workers and kept across
+     restarts (GEOCODE_TTL_DAYS, default 90; "not found" answers are kept
+     for GEOCODE_NEGATIVE_TTL_HOURS, default 24),
+  3. the provider, only on a miss in both.
+
+Reverse lookups are keyed by coordinates rounded to GEOCODE_PRECISION
+decimals (4, about 11 m), and the provider is asked about the rounded
+point, so everything in the same spot shares one answer. Forward lookups
+are keyed by the normalised address (case, accents, character width,
+punctuation and spacing folded).
+
+Expired rows are deleted by 'flask prune-geocodes', and opportunistically
+by a worker every GEOCODE_PRUNE_EVERY provider answers (default 500), so the
+table doesn't keep every address ever typed.
+
+Concurrent misses for the same key within a worker are coalesced: one
+request does the lookup and the rest wait for its answer. Provider calls are
+spaced at least GEOCODER_MIN_INTERVAL seconds apart per worker, as the
+public Nominatim usage policy asks.
+
+The provider is pluggable: GEOCODER_URL points NominatimProvider at any
+Nominatim-compatible server (a local stand-in for tests), and
+GEOCODER_PROVIDER can name a 'module:attribute' object (or factory) with
+reverse(lat, lon) and search(query) methods instead.
+"""
+import hashlib
+import importlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime,timedelta
+
+from sqlalchemy import and_,or_,select
+from sqlalchemy.exc import IntegrityError
+
+from models import db,GeocodeCache
+
+logger = logging.getLogger(__name__)
+
+MAX_KEY_LENGTH = 200
+
+
+class GeocoderUnavailable(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class Place:
+    latitude: float
+    longitude: float
+    address: str
+
+
+class NominatimProvider:
+    """Nominatim (or a compatible stand-in) over HTTP, throttled per process."""
+
+    def __init__(self, base_url='https://nominatim.openstreetmap.org', user_agent='sudhamrit-dairy',
+                 timeout=5.0, min_interval=1.0):
+        self.base_url = base_url.rstrip('/')
+        self.user_agent = user_agent
+        self.timeout = timeout
+        self.min_interval = min_interval
+        self._throttle = threading.Lock()
+        self._last_call = 0.0
+
+    def _get(self, path, params):
+        url = f"{self.base_url}/{path}?{urllib.parse.urlencode(dict(params, format='json'))}"
+        request = urllib.request.Request(url, headers={'User-Agent': self.user_agent, 'Accept': 'application/json'})
+        with self._throttle:
+            wait = self._last_call + self.min_interval - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            self._last_call = time.monotonic()
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read().decode('utf-8'))
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            raise GeocoderUnavailable(f"{self.base_url}/{path}: {e}") from e
+
+    def reverse(self, lat, lon):
+        data = self._get('reverse', {'lat': lat, 'lon': lon, 'addressdetails': 0})
+        try:
+            if not data or 'error' in data or not data.get('display_name'):
+                return None
+            return Place(float(data.get('lat', lat)), float(data.get('lon', lon)), str(data['display_name']))
+        except (AttributeError, KeyError, TypeError, ValueError) as e:
+            raise GeocoderUnavailable(f"{self.base_url}/reverse: unexpected reply: {e!r}") from e
+
+    def search(self, query):
+        data = self._get('search', {'q': query, 'limit': 1})
+        try:
+            if not data:
+                return None
+            return Place(float(data[0]['lat']), float(data[0]['lon']), str(data[0].get('display_name') or query))
+        except (AttributeError, IndexError, KeyError, TypeError, ValueError) as e:
+            raise GeocoderUnavailable(f"{self.base_url}/search: unexpected reply: {e!r}") from e
+
+
+def normalise_address(address):
+    text = unicodedata.normalize('NFKD', address.casefold())
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return re.sub(r'[\W_]+', ' ', text).strip()
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class Geocoder:
+    def __init__(self):
+        self.provider = None
+        self.lru_size = 10000
+        self.ttl = timedelta(days=90)
+        self.negative_ttl = timedelta(hours=24)
+        self.precision = 4
+        self.wait_timeout = 10.0
+        self.prune_every = 500
+        self._stored = 0
+        self._lru = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.counts = {'memory': 0, 'database': 0, 'provider': 0, 'coalesced': 0}
+
+    def init_app(self, app):
+        config = app.config
+        config.setdefault('GEOCODER_URL', os.getenv('GEOCODER_URL', 'https://nominatim.openstreetmap.org'))
+        config.setdefault('GEOCODER_USER_AGENT', os.getenv('GEOCODER_USER_AGENT',
+                                                           'sudhamrit-dairy/1.0 (support@sudhamritdairy.com)'))
+        config.setdefault('GEOCODER_PROVIDER', os.getenv('GEOCODER_PROVIDER'))
+        config.setdefault('GEOCODER_TIMEOUT', float(os.getenv('GEOCODER_TIMEOUT', 5)))
+        config.setdefault('GEOCODER_MIN_INTERVAL', float(os.getenv('GEOCODER_MIN_INTERVAL', 1.0)))
+        config.setdefault('GEOCODE_LRU_SIZE', int(os.getenv('GEOCODE_LRU_SIZE', 10000)))
+        config.setdefault('GEOCODE_TTL_DAYS', float(os.getenv('GEOCODE_TTL_DAYS', 90)))
+        config.setdefault('GEOCODE_NEGATIVE_TTL_HOURS', float(os.getenv('GEOCODE_NEGATIVE_TTL_HOURS', 24)))
+        config.setdefault('GEOCODE_PRECISION', int(os.getenv('GEOCODE_PRECISION', 4)))
+        config.setdefault('GEOCODE_PRUNE_EVERY', int(os.getenv('GEOCODE_PRUNE_EVERY', 500)))
+
+        self.lru_size = config['GEOCODE_LRU_SIZE']
+        self.ttl = timedelta(days=config['GEOCODE_TTL_DAYS'])
+        self.negative_ttl = timedelta(hours=config['GEOCODE_NEGATIVE_TTL_HOURS'])
+        self.precision = config['GEOCODE_PRECISION']
+        self.prune_every = config['GEOCODE_PRUNE_EVERY']
+        self.wait_timeout = config['GEOCODER_TIMEOUT'] * 2 + config['GEOCODER_MIN_INTERVAL']
+
+        provider = config['GEOCODER_PROVIDER']
+        if isinstance(provider, str):
+            module, _, attribute = provider.partition(':')
+            provider = getattr(importlib.import_module(module), attribute)
+            if not hasattr(provider, 'reverse') or isinstance(provider, type):
+                provider = provider()
+        self.provider = provider or NominatimProvider(base_url=config['GEOCODER_URL'],
+                                                      user_agent=config['GEOCODER_USER_AGENT'],
+                                                      timeout=config['GEOCODER_TIMEOUT'],
+                                                      min_interval=config['GEOCODER_MIN_INTERVAL'])
+        self.clear()
+        app.extensions['geocoder'] = self
+
+    def clear(self):
+        with self._lock:
+            self._lru.clear()
+
+    def reverse(self, lat, lon):
+        """(Place or None, source) for a point; source says which tier answered."""
+        lat, lon = round(lat, self.precision), round(lon, self.precision)
+        key = f"reverse:{lat:.{self.precision}f},{lon:.{self.precision}f}"
+        return self._lookup(key, lambda: self.provider.reverse(lat, lon))
+
+    def search(self, address):
+        """(Place or None, source) for a free-text address."""
+        normalised = normalise_address(address)
+        if not normalised:
+            return None, 'empty'
+        key = f"search:{normalised}"
+        if len(key) > MAX_KEY_LENGTH:
+            key = f"search:sha1:{hashlib.sha1(normalised.encode()).hexdigest()}"
+        return self._lookup(key, lambda: self.provider.search(address.strip()))
+
+    def _lookup(self, key, fetch):
+        now = datetime.utcnow()
+        with self._lock:
+            entry = self._lru.get(key)
+            if entry is not None and entry[0] > now:
+                self._lru.move_to_end(key)
+                self.counts['memory'] += 1
+                return entry[1], 'memory'
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self._inflight[key] = _Call()
+
+        if not leader:
+            if not call.done.wait(self.wait_timeout):
+                raise GeocoderUnavailable(f"Timed out waiting for the lookup of {key}")
+            if call.error is not None:
+                raise call.error
+            with self._lock:
+                self.counts['coalesced'] += 1
+            return call.result[0], 'coalesced'
+
+        try:
+            call.result = self._load(key, fetch, now)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            call.done.set()
+
+    def _load(self, key, fetch, now):
+        with db.engine.connect() as connection:
+            row = connection.execute(select(GeocodeCache).where(GeocodeCache.cache_key == key)).first()
+        if row is not None:
+            place = Place(row.latitude, row.longitude, row.address) if row.latitude is not None else None
+            expires = row.created_at + (self.ttl if place else self.negative_ttl)
+            if expires > now:
+                self._remember(key, place, expires)
+                with self._lock:
+                    self.counts['database'] += 1
+                return place, 'database'
+
+        place = fetch()
+        logger.debug("Geocoded %s via the provider: %s", key, 'found' if place else 'not found')
+        with self._lock:
+            self.counts['provider'] += 1
+        values = {'latitude': place.latitude if place else None, 'longitude': place.longitude if place else None,
+                  'address': place.address[:500] if place else None, 'created_at': now}
+        try:
+            with db.engine.begin() as connection:
+                updated = connection.execute(GeocodeCache.__table__.update()
+                                             .where(GeocodeCache.cache_key == key).values(values)).rowcount
+                if not updated:
+                    connection.execute(GeocodeCache.__table__.insert().values(cache_key=key, **values))
+        except IntegrityError:
+            pass  # another worker stored the same key first; its answer is as good as ours
+        self._remember(key, place, now + (self.ttl if place else self.negative_ttl))
+        with self._lock:
+            self._stored += 1
+            due = self.prune_every > 0 and self._stored % self.prune_every == 0
+        if due:
+            try:
+                self.prune(now)
+            except Exception:
+                logger.exception("Pruning expired geocodes failed")
+        return place, 'provider'
+
+    def prune(self, now=None):
+        """Delete cached answers past their TTL; returns rows deleted."""
+        now = now or datetime.utcnow()
+        table = GeocodeCache.__table__
+        with db.engine.begin() as connection:
+            deleted = connection.execute(table.delete().where(or_(
+                and_(table.c.latitude.is_not(None), table.c.created_at < now - self.ttl),
+                and_(table.c.latitude.is_(None), table.c.created_at < now - self.negative_ttl),
+            ))).rowcount
+        if deleted:
+            logger.info("Pruned %s expired geocodes", deleted)
+        return deleted
+
+    def _remember(self, key, place, expires):
+        with self._lock:
+            self._lru[key] = (expires, place)
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.lru_size:
+                self._lru.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts, lru_entries=len(self._lru), in_flight=len(self._inflight))
+
+
+geocoder = Geocoder()
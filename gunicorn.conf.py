@@ -0,0 +1,27 @@
+"""
+Gunicorn settings; gunicorn reads this file from the working directory.
+
+    gunicorn app:app                 (or 'app:create_app()')
+
+With preload_app the master imports and configures the app once and the
+workers fork from it already warm, instead of each worker importing
+everything itself. Database connections, the password-hash pool, the log
+listener and the metrics registry are all reset per worker after the fork.
+Set INIT_DB_ON_START=1 to create tables/apply migrations once in the master,
+or run 'flask init-db' as a release step. GUNICORN_PRELOAD=0 turns it off.
+Run 'flask build-assets' as a release step too; workers only load its manifest.
+
+child_exit folds an exited worker's metrics file into the shared totals
+(metrics.retire_workers), so restarts don't pile up files in METRICS_DIR.
+"""
+import os
+
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() in ('1', 'true', 'yes')
+
+
+def child_exit(server, worker):
+    import metrics
+    try:
+        metrics.retire_workers(metrics.metrics_dir(), [worker.pid])
+    except OSError as e:
+        server.log.warning("Could not retire metrics of worker %s: %s", worker.pid, e)
@@ -0,0 +1,166 @@
+"""
+Who is making the request, without a database lookup per request.
+
+Flask-Login's user loader and the admin helpers read User/Admin snapshots
+from a small TTL cache shared by all requests in the worker. The snapshots
+are plain frozen objects, not ORM instances, so they can outlive the request
+session that loaded them. Any flush that updates or deletes a User or Admin
+drops that entry in this worker; other workers see the change once the TTL
+expires (IDENTITY_CACHE_TTL, default 60 seconds).
+
+Routes that need to modify the account (e.g. rehashing a password) still
+load the ORM row themselves.
+"""
+import os
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+from flask import g,session
+from flask_login import LoginManager,UserMixin
+from sqlalchemy import event
+
+from models import db,User,Admin
+
+login_manager = LoginManager()
+login_manager.login_view = 'login'
+login_manager.login_message_category = 'warning'
+
+
+@dataclass(frozen=True)
+class CachedUser(UserMixin):
+    user_id: int
+    username: str
+    email: str
+    phone: Optional[str]
+    address: Optional[str]
+    created_at: Optional[datetime]
+
+    def get_id(self):
+        return str(self.user_id)
+
+    @classmethod
+    def from_model(cls, user):
+        return cls(user_id=user.user_id, username=user.username, email=user.email,
+                   phone=user.phone, address=user.address, created_at=user.created_at)
+
+
+@dataclass(frozen=True)
+class CachedAdmin:
+    admin_id: int
+    admin_name: str
+    admin_email: str
+
+    @classmethod
+    def from_model(cls, admin):
+        return cls(admin_id=admin.admin_id, admin_name=admin.admin_name, admin_email=admin.admin_email)
+
+
+class IdentityCache:
+    def __init__(self, ttl=60.0, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, kind, key, load):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get((kind, key))
+            if entry and entry[0] > now:
+                self.hits += 1
+                return entry[1]
+        value = load()
+        with self._lock:
+            self.misses += 1
+            if value is not None:
+                if len(self._entries) >= self.max_entries:
+                    self._evict(now)
+                self._entries[(kind, key)] = (now + self.ttl, value)
+        return value
+
+    def _evict(self, now):
+        expired = [key for key, (expires, _) in self._entries.items() if expires <= now]
+        for key in expired:
+            del self._entries[key]
+        if len(self._entries) >= self.max_entries:
+            # Still full of live entries: drop the ones closest to expiry.
+            for key, _ in sorted(self._entries.items(), key=lambda item: item[1][0])[:self.max_entries // 10 or 1]:
+                del self._entries[key]
+
+    def invalidate(self, kind, key):
+        with self._lock:
+            self._entries.pop((kind, key), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+identity_cache = IdentityCache()
+
+
+def init_app(app):
+    app.config.setdefault('IDENTITY_CACHE_TTL', float(os.getenv('IDENTITY_CACHE_TTL', 60)))
+    identity_cache.ttl = app.config['IDENTITY_CACHE_TTL']
+    login_manager.init_app(app)
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def load_user(user_id):
+    user_id = _to_int(user_id)
+    if user_id is None:
+        return None
+    return identity_cache.get('user', user_id, lambda: _snapshot(User, user_id, CachedUser))
+
+
+def load_admin(admin_id):
+    admin_id = _to_int(admin_id)
+    if admin_id is None:
+        return None
+    return identity_cache.get('admin', admin_id, lambda: _snapshot(Admin, admin_id, CachedAdmin))
+
+
+def _snapshot(model, key, snapshot_cls):
+    row = db.session.get(model, key)
+    return snapshot_cls.from_model(row) if row else None
+
+
+@login_manager.user_loader
+def _user_loader(user_id):
+    return load_user(user_id)
+
+
+@login_manager.request_loader
+def _legacy_session_loader(request):
+    # Sessions created before Flask-Login was wired in only carry 'user_id'.
+    return load_user(session.get('user_id'))
+
+
+def current_admin():
+    """The logged-in admin for this request, or None."""
+    if '_current_admin' not in g:
+        g._current_admin = load_admin(session.get('admin_id'))
+    return g._current_admin
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _forget_user(mapper, connection, target):
+    identity_cache.invalidate('user', target.user_id)
+
+
+@event.listens_for(Admin, 'after_update')
+@event.listens_for(Admin, 'after_delete')
+def _forget_admin(mapper, connection, target):
+    identity_cache.invalidate('admin', target.admin_id)
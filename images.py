@@ -0,0 +1,194 @@
+"""
+Resized, re-encoded derivatives of product images.
+
+Uploads land in static/images at whatever size the admin picked (the stock
+photos are ~1 MB PNGs shown at 200px). For each source image we write a few
+narrower variants under static/images/derived/, as WebP plus a JPEG (or PNG,
+for images with transparency) fallback, and templates reference them through
+a srcset so browsers download the smallest one that fits.
+
+Derivatives are named after the whole source filename, extension included,
+so paneer.png and paneer.jpg never share variants.
+
+Admin uploads queue their derivatives on a background thread
+(generate_later), so the add/update request returns as soon as the original
+is saved; until the variants exist the templates serve the original file.
+The caller passes on_done to hear when they are written, e.g. to bump the
+catalog version so cached pages pick up the srcset. Replacing an image
+removes the old file's derivatives.
+
+Each worker memoises which variants exist, keyed on the modification times
+of the source file and of the derived/ directory. Writing or deleting a
+derivative in any process changes the directory's mtime, so other workers
+rescan instead of serving URLs for files that are gone.
+
+Pillow is optional: without it uploads are stored as-is and templates keep
+serving the original file.
+"""
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from PIL import Image
+except ImportError:  # pragma: no cover - depends on the deployment
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+DERIVED_DIR = 'derived'
+DERIVATIVE_WIDTHS = (200, 400, 800)
+SOURCE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+WEBP_QUALITY = 80
+JPEG_QUALITY = 82
+
+_known_variants = {}
+_executor = None
+
+
+def _has_alpha(image):
+    return image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+
+
+def fallback_format(image):
+    return 'png' if _has_alpha(image) else 'jpg'
+
+
+def derivative_name(filename, width, ext):
+    """Path of a derivative relative to the images directory, e.g. derived/paneer.png-200w.webp."""
+    return f"{DERIVED_DIR}/{filename}-{width}w.{ext}"
+
+
+def generate_derivatives(image_dir, filename, widths=DERIVATIVE_WIDTHS):
+    """
+    Write the resized variants of image_dir/filename and return their names.
+
+    Widths larger than the source are skipped so we never upscale; an image
+    narrower than every width is already small and gets no derivatives.
+    Returns an empty list when Pillow is unavailable or the file is not an
+    image.
+    """
+    if Image is None:
+        logger.warning("Pillow is not installed; skipping derivatives for %s", filename)
+        return []
+
+    source_path = os.path.join(image_dir, filename)
+    try:
+        with Image.open(source_path) as source:
+            source.load()
+            fallback = fallback_format(source)
+            mode = 'RGBA' if fallback == 'png' else 'RGB'
+            source = source.convert(mode)
+    except (OSError, ValueError) as e:
+        logger.warning("Could not read image %s: %s", source_path, e)
+        return []
+
+    remove_derivatives(image_dir, filename)
+    os.makedirs(os.path.join(image_dir, DERIVED_DIR), exist_ok=True)
+    written = []
+    for width in widths:
+        if width > source.width:
+            continue
+        height = max(1, round(source.height * width / source.width))
+        resized = source.resize((width, height), Image.LANCZOS)
+
+        webp_name = derivative_name(filename, width, 'webp')
+        resized.save(os.path.join(image_dir, webp_name), 'WEBP', quality=WEBP_QUALITY, method=6)
+        written.append(webp_name)
+
+        fallback_name = derivative_name(filename, width, fallback)
+        if fallback == 'png':
+            resized.save(os.path.join(image_dir, fallback_name), 'PNG', optimize=True)
+        else:
+            resized.save(os.path.join(image_dir, fallback_name), 'JPEG',
+                         quality=JPEG_QUALITY, optimize=True, progressive=True)
+        written.append(fallback_name)
+    return written
+
+
+def remove_derivatives(image_dir, filename):
+    """Delete every derivative of filename, whatever format it was written in; returns how many."""
+    removed = 0
+    for width in DERIVATIVE_WIDTHS:
+        for ext in ('webp', 'jpg', 'png'):
+            try:
+                os.remove(os.path.join(image_dir, derivative_name(filename, width, ext)))
+                removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
+
+
+def _generate_logged(image_dir, filename, on_done):
+    try:
+        if generate_derivatives(image_dir, filename) and on_done is not None:
+            on_done()
+    except Exception:
+        logger.exception("Generating derivatives for %s failed", filename)
+
+
+def generate_later(image_dir, filename, on_done=None):
+    """
+    Queue generate_derivatives() on this process's background thread;
+    on_done() is called there once variants have been written.
+    """
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='image-derivatives')
+    # Drop the old variants now, so an overwritten file is not shown through stale ones meanwhile.
+    remove_derivatives(image_dir, filename)
+    return _executor.submit(_generate_logged, image_dir, filename, on_done)
+
+
+def build_all(image_dir, force=False):
+    """Generate derivatives for every source image; returns (built, skipped)."""
+    built = skipped = 0
+    for filename in sorted(os.listdir(image_dir)):
+        path = os.path.join(image_dir, filename)
+        if not os.path.isfile(path) or not filename.lower().endswith(SOURCE_EXTENSIONS):
+            continue
+        variants = image_variants(image_dir, filename)
+        if variants and not force:
+            source_mtime = os.path.getmtime(path)
+            if all(os.path.getmtime(os.path.join(image_dir, name)) >= source_mtime
+                   for names in variants.values() for _, name in names):
+                skipped += 1
+                continue
+        if generate_derivatives(image_dir, filename):
+            built += 1
+    return built, skipped
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def _scan_variants(image_dir, filename):
+    variants = {'webp': [], 'fallback': []}
+    for width in DERIVATIVE_WIDTHS:
+        for ext in ('webp', 'jpg', 'png'):
+            name = derivative_name(filename, width, ext)
+            if os.path.exists(os.path.join(image_dir, name)):
+                variants['webp' if ext == 'webp' else 'fallback'].append((width, name))
+    if not variants['webp'] or not variants['fallback']:
+        return None
+    return variants
+
+
+def image_variants(image_dir, filename):
+    """
+    Return {'webp': [(width, name)...], 'fallback': [...]} for an image whose
+    derivatives exist on disk, or None so callers use the original file.
+    """
+    if not filename:
+        return None
+    key = (image_dir, filename)
+    stamp = (_mtime(os.path.join(image_dir, filename)), _mtime(os.path.join(image_dir, DERIVED_DIR)))
+    known = _known_variants.get(key)
+    if known is not None and known[0] == stamp:
+        return known[1]
+    _known_variants[key] = (stamp, _scan_variants(image_dir, filename))
+    return _known_variants[key][1]
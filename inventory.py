@@ -0,0 +1,112 @@
+"""
+Stock reservation for checkout.
+
+reserve_stock() decrements Product.stock for every cart line with a
+conditional UPDATE (stock = stock - n WHERE stock >= n) inside the caller's
+transaction. The check and the decrement happen in one statement, so two
+checkouts racing for the last unit cannot both succeed, and products are
+always locked in product_id order so concurrent checkouts cannot deadlock
+against each other. If any line cannot be covered the caller rolls back and
+nothing has been taken.
+
+reserve_available() is the bulk variant for the subscription generator: it
+takes whatever part of each product's demand is in stock, and
+release_stock() gives back what the caller could not use.
+"""
+from collections import Counter
+
+from sqlalchemy import insert,select,update
+
+from models import db,Product,OrderItem
+
+
+class OutOfStock(Exception):
+    def __init__(self, product_id, requested, available=None, product_name=None):
+        self.product_id = product_id
+        self.requested = requested
+        self.available = available
+        self.product_name = product_name
+        super().__init__(f"Not enough stock for product {product_id}: requested {requested}, available {available}")
+
+
+def reserve_stock(lines):
+    """
+    Take stock for lines, an iterable of (product_id, quantity) pairs.
+
+    Quantities for the same product are combined first. Raises OutOfStock on
+    the first product that cannot be covered; the caller must roll back.
+    """
+    wanted = Counter()
+    for product_id, quantity in lines:
+        wanted[product_id] += quantity
+
+    for product_id in sorted(wanted):
+        quantity = wanted[product_id]
+        if quantity <= 0:
+            continue
+        result = db.session.execute(
+            update(Product)
+            .where(Product.product_id == product_id, Product.stock >= quantity)
+            .values(stock=Product.stock - quantity)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount != 1:
+            product = db.session.get(Product, product_id, populate_existing=True)
+            raise OutOfStock(product_id, quantity,
+                             available=product.stock if product else 0,
+                             product_name=product.product_name if product else None)
+
+
+def reserve_available(wanted):
+    """
+    Take as much of {product_id: quantity} as is in stock; returns {product_id: granted}.
+
+    For bulk jobs that fill what they can instead of failing as a whole.
+    Products are locked in product_id order, as in reserve_stock().
+    """
+    granted = {}
+    for product_id in sorted(wanted):
+        quantity = wanted[product_id]
+        if quantity <= 0:
+            continue
+        result = db.session.execute(
+            update(Product)
+            .where(Product.product_id == product_id, Product.stock >= quantity)
+            .values(stock=Product.stock - quantity)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount == 1:
+            granted[product_id] = quantity
+            continue
+        available = db.session.execute(select(Product.stock).where(Product.product_id == product_id)).scalar() or 0
+        if available > 0 and db.session.execute(
+            update(Product)
+            .where(Product.product_id == product_id, Product.stock >= available)
+            .values(stock=Product.stock - available)
+            .execution_options(synchronize_session=False)
+        ).rowcount == 1:
+            granted[product_id] = available
+    return granted
+
+
+def release_stock(quantities):
+    """Give back {product_id: quantity} taken earlier in the same transaction."""
+    for product_id in sorted(quantities):
+        if quantities[product_id] > 0:
+            db.session.execute(
+                update(Product)
+                .where(Product.product_id == product_id)
+                .values(stock=Product.stock + quantities[product_id])
+                .execution_options(synchronize_session=False)
+            )
+
+
+def insert_order_items(order_id, lines):
+    """Bulk-insert order items from (product_id, quantity, price_per_item) tuples."""
+    rows = [
+        {'order_id': order_id, 'product_id': product_id, 'quantity': quantity, 'price_per_item': price}
+        for product_id, quantity, price in lines
+    ]
+    if rows:
+        db.session.execute(insert(OrderItem), rows)
+    return len(rows)
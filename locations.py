@@ -0,0 +1,165 @@
+"""
+Saved delivery locations, deduplicated and bounded per user.
+
+Each DeliveryLocation carries a location_key: a hash of the normalised
+address plus the coordinates rounded to 4 decimals (about 11 m), unique per
+user. Saving a location the user already has updates that row (latest
+spelling, exact coordinates, last_used_at = now) instead of adding another,
+and a user keeps at most LOCATIONS_PER_USER rows, least recently used
+dropped first. added_at stays the time the location was first saved, so it
+never moves under orders already placed against it; checkout also copies
+the ship-to address and coordinates onto the order.
+
+Rows saved before location_key existed have it NULL, which the unique index
+ignores. 'flask compact-locations' keys them in batches of users, folding
+duplicates into the most recently used row and applying the per-user cap;
+it is safe to re-run, e.g. after lowering the cap.
+"""
+import hashlib
+import os
+from datetime import datetime
+
+from sqlalchemy import and_,func,select
+
+from geocoding import normalise_address
+from models import db,DeliveryLocation
+
+LOCATIONS_PER_USER = int(os.getenv('LOCATIONS_PER_USER', 10))
+ID_CHUNK = 500
+
+
+def location_key(address, latitude, longitude):
+    raw = f"{float(latitude):.4f},{float(longitude):.4f}|{normalise_address(address or '')}"
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def _dialect_insert(bind):
+    name = bind.get_bind().dialect.name
+    if name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+        return insert
+    if name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+        return insert
+    return None
+
+
+def save_location(user_id, address, latitude, longitude, limit=None):
+    """Upsert the user's location and trim to the cap, in the caller's transaction."""
+    table = DeliveryLocation.__table__
+    now = datetime.utcnow()
+    values = {'user_id': user_id, 'address': address, 'latitude': latitude, 'longitude': longitude,
+              'added_at': now, 'last_used_at': now, 'location_key': location_key(address, latitude, longitude)}
+    insert = _dialect_insert(db.session)
+    if insert is not None:
+        statement = insert(table).values(values)
+        db.session.execute(statement.on_conflict_do_update(
+            index_elements=['user_id', 'location_key'],
+            set_={column: statement.excluded[column]
+                  for column in ('address', 'latitude', 'longitude', 'last_used_at')}))
+    else:
+        match = and_(table.c.user_id == user_id, table.c.location_key == values['location_key'])
+        if not db.session.execute(table.update().where(match).values(
+                address=address, latitude=latitude, longitude=longitude, last_used_at=now)).rowcount:
+            db.session.execute(table.insert().values(values))
+    return trim(user_id, limit)
+
+
+def _recency(table):
+    return func.coalesce(table.c.last_used_at, table.c.added_at)
+
+
+def latest(user_id):
+    """The user's most recently saved location, which their next order ships to; None if they have none."""
+    return (DeliveryLocation.query.filter_by(user_id=user_id)
+            .order_by(_recency(DeliveryLocation.__table__).desc(), DeliveryLocation.location_id.desc()).first())
+
+
+def latest_for_users(user_ids):
+    """latest() for many users at once, as {user_id: DeliveryLocation}; users without one are left out."""
+    found = {}
+    for start in range(0, len(user_ids), ID_CHUNK):
+        rows = (DeliveryLocation.query.filter(DeliveryLocation.user_id.in_(user_ids[start:start + ID_CHUNK]))
+                .order_by(DeliveryLocation.user_id, _recency(DeliveryLocation.__table__).desc(),
+                          DeliveryLocation.location_id.desc()))
+        for row in rows:
+            found.setdefault(row.user_id, row)
+    return found
+
+
+def trim(user_id, limit=None):
+    """Delete all but the user's `limit` most recently used locations; returns rows deleted."""
+    limit = limit or LOCATIONS_PER_USER
+    keep = (select(DeliveryLocation.location_id).where(DeliveryLocation.user_id == user_id)
+            .order_by(_recency(DeliveryLocation.__table__).desc(), DeliveryLocation.location_id.desc()).limit(limit))
+    return db.session.execute(DeliveryLocation.__table__.delete().where(
+        DeliveryLocation.user_id == user_id, DeliveryLocation.location_id.not_in(keep.scalar_subquery()))).rowcount
+
+
+def _compact_users(connection, user_ids, limit):
+    table = DeliveryLocation.__table__
+    rows = connection.execute(
+        select(table.c.location_id, table.c.user_id, table.c.address, table.c.latitude, table.c.longitude,
+               table.c.added_at, table.c.location_key)
+        .where(table.c.user_id.in_(user_ids))
+        .order_by(table.c.user_id, _recency(table).desc(), table.c.location_id.desc())).all()
+
+    survivors, first_seen, doomed, capped = {}, {}, [], 0
+    for row in rows:
+        key = location_key(row.address, row.latitude, row.longitude)
+        user = survivors.setdefault(row.user_id, {})
+        if key in user:
+            doomed.append(row.location_id)  # an older copy of a newer row
+            kept = user[key].location_id
+            if row.added_at and (first_seen[kept] is None or row.added_at < first_seen[kept]):
+                first_seen[kept] = row.added_at
+        elif len(user) >= limit:
+            doomed.append(row.location_id)
+            capped += 1
+        else:
+            user[key] = row
+            first_seen[row.location_id] = row.added_at
+
+    # Delete first, so setting keys on the survivors can't collide with a copy.
+    for start in range(0, len(doomed), ID_CHUNK):
+        connection.execute(table.delete().where(table.c.location_id.in_(doomed[start:start + ID_CHUNK])))
+    keyed = 0
+    for user in survivors.values():
+        for key, row in user.items():
+            # The survivor keeps the earliest added_at of the copies it absorbed.
+            changes = {}
+            if row.location_key != key:
+                changes['location_key'] = key
+                keyed += 1
+            if first_seen[row.location_id] != row.added_at:
+                changes['added_at'] = first_seen[row.location_id]
+            if changes:
+                connection.execute(table.update().where(table.c.location_id == row.location_id).values(**changes))
+    return {'scanned': len(rows), 'merged': len(doomed) - capped, 'capped': capped, 'keyed': keyed}
+
+
+def compact(engine, batch_size=1000, limit=None, progress=None):
+    """Key, deduplicate and cap every user's locations, one transaction per batch of users."""
+    limit = limit or LOCATIONS_PER_USER
+    totals = {'users': 0, 'scanned': 0, 'merged': 0, 'capped': 0, 'keyed': 0}
+    last_user = 0
+    while True:
+        with engine.begin() as connection:
+            user_ids = connection.execute(
+                select(DeliveryLocation.user_id).where(DeliveryLocation.user_id > last_user)
+                .group_by(DeliveryLocation.user_id).order_by(DeliveryLocation.user_id).limit(batch_size)).scalars().all()
+            if not user_ids:
+                return totals
+            counts = _compact_users(connection, user_ids, limit)
+        last_user = user_ids[-1]
+        totals['users'] += len(user_ids)
+        for name, count in counts.items():
+            totals[name] += count
+        if progress:
+            progress(totals)
+
+
+def unkeyed_count(connection):
+    """Rows saved before location_key existed, still waiting for compaction."""
+    return connection.execute(select(func.count()).select_from(DeliveryLocation)
+                              .where(DeliveryLocation.location_key.is_(None))).scalar()
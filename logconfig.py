@@ -0,0 +1,206 @@
+"""
+Structured, non-blocking application logging.
+
+Every log record is handed to a bounded in-memory queue by the thread that
+logs it; a single listener thread per process formats it and writes it to
+stderr. Request threads therefore never wait on stream I/O, and whole lines
+are written by one thread, so they don't interleave. If the queue is full
+(the listener can't keep up), the record is dropped and counted instead of
+blocking the request; the count is logged with the next record written.
+
+Records are tagged with the request id (the incoming X-Request-ID header or
+a fresh one, echoed back on the response), the logged-in user or admin, and
+anything a route binds for the rest of the request with bind(), e.g. the
+order id during checkout.
+
+    LOG_LEVEL       default INFO (DEBUG shows the step-by-step checkout trace)
+    LOG_FORMAT      json (default, one object per line) or text
+    LOG_QUEUE_SIZE  default 10000 records
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import uuid
+from datetime import datetime,timezone
+
+from flask import g,has_request_context,request,session
+
+CONTEXT_FIELDS = ('request_id', 'user_id', 'admin_id', 'order_id')
+REQUEST_ID_HEADER = 'X-Request-ID'
+
+
+def bind(**fields):
+    """Attach fields (e.g. order_id=...) to every later log line of this request."""
+    if has_request_context():
+        g.setdefault('_log_context', {}).update(fields)
+
+
+class ContextFilter(logging.Filter):
+    """Copies the request context onto the record in the logging thread."""
+
+    def filter(self, record):
+        if has_request_context():
+            context = g.get('_log_context', {})
+            record.request_id = context.get('request_id')
+            record.user_id = context.get('user_id', session.get('user_id'))
+            record.admin_id = context.get('admin_id', session.get('admin_id'))
+            record.order_id = context.get('order_id')
+            record.path = request.path
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS + ('path',):
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    def format(self, record):
+        line = super().format(record)
+        context = ' '.join(f"{field}={getattr(record, field)}" for field in CONTEXT_FIELDS
+                           if getattr(record, field, None) is not None)
+        return f"{line} [{context}]" if context else line
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def prepare(self, record):
+        # Render the message and traceback here, where the args and exception
+        # are still live, but keep them apart so the formatter can use both.
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def take_dropped(self):
+        with self._lock:
+            dropped, self.dropped = self.dropped, 0
+        return dropped
+
+
+class _Listener(logging.handlers.QueueListener):
+    def __init__(self, log_queue, handler, source):
+        super().__init__(log_queue, handler, respect_handler_level=True)
+        self.source = source
+
+    def handle(self, record):
+        dropped = self.source.take_dropped()
+        if dropped:
+            super().handle(logging.makeLogRecord({
+                'name': __name__, 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                'msg': f"Log queue was full; dropped {dropped} records",
+            }))
+        super().handle(record)
+
+
+_state = {}
+_shutdown_registered = False
+
+
+def configure_logging(level=None, fmt=None, queue_size=None):
+    """Route the root logger through the queue; safe to call more than once."""
+    level = (level or os.getenv('LOG_LEVEL', 'INFO')).upper()
+    fmt = (fmt or os.getenv('LOG_FORMAT', 'json')).lower()
+    queue_size = queue_size or int(os.getenv('LOG_QUEUE_SIZE', 10000))
+
+    stream = logging.StreamHandler(sys.stderr)
+    stream.setFormatter(TextFormatter() if fmt == 'text' else JsonFormatter())
+
+    handler = NonBlockingQueueHandler(queue.Queue(maxsize=queue_size))
+    handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    for old in list(root.handlers):
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    _stop_listener()
+    _state.update(handler=handler, stream=stream)
+    _start_listener()
+
+
+def _start_listener():
+    listener = _Listener(_state['handler'].queue, _state['stream'], _state['handler'])
+    listener.start()
+    _state['listener'] = listener
+
+
+def _stop_listener():
+    listener = _state.pop('listener', None)
+    if listener is not None:
+        listener.stop()
+
+
+def _after_fork():
+    # The listener thread doesn't survive fork (gunicorn --preload); give each
+    # worker its own, with a fresh queue so nothing is stuck behind a stale lock.
+    if 'handler' in _state:
+        _state['handler'].queue = queue.Queue(maxsize=_state['handler'].queue.maxsize)
+        _state['handler'].dropped = 0
+        _state['handler']._lock = threading.Lock()
+        _start_listener()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def shutdown():
+    """Flush queued records; registered with atexit by the first init_app."""
+    _stop_listener()
+
+
+def _start_request():
+    request_id = request.headers.get(REQUEST_ID_HEADER, '')[:64] or uuid.uuid4().hex
+    bind(request_id=request_id)
+
+
+def _finish_request(response):
+    request_id = g.get('_log_context', {}).get('request_id')
+    if request_id:
+        response.headers[REQUEST_ID_HEADER] = request_id
+    return response
+
+
+def init_app(app):
+    global _shutdown_registered
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    # Once per process, however many apps tests and benches build.
+    if not _shutdown_registered:
+        atexit.register(shutdown)
+        _shutdown_registered = True
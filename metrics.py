@@ -0,0 +1,414 @@
+"""
+Per-request instrumentation and a Prometheus /metrics endpoint.
+
+For every request this records the number of SQL statements, the time spent
+in them, the time spent rendering templates and the total latency. The
+figures go back to the client in a Server-Timing header (visible in the
+browser's network panel) and into per-endpoint counters and a latency
+histogram.
+
+Gunicorn runs several worker processes, each with its own counters. Every
+worker writes its totals to its own file in METRICS_DIR (at most once per
+METRICS_FLUSH_INTERVAL seconds, atomically), and /metrics sums all the
+files, so whichever worker answers the scrape reports the whole service.
+When a worker exits, gunicorn's child_exit hook (gunicorn.conf.py) folds its
+file into retired.json and deletes it, along with files of any other pid
+that is no longer running, so counters never go backwards and the number of
+files stays bounded across restarts.
+
+/metrics exposes route and SQL timings, so it is not public: it answers a
+request carrying the METRICS_TOKEN bearer token, or an admin session, and
+nothing else by default. METRICS_ALLOW_LOCAL=1 also lets in requests from
+localhost without a token. Only turn it on when no reverse proxy on the
+same host forwards public traffic: behind one that doesn't add
+X-Forwarded-For (nginx's plain proxy_pass doesn't), every request looks
+local.
+
+Statements slower than SLOW_QUERY_MS are logged. A request that runs the
+same SELECT at least N_PLUS_ONE_THRESHOLD times (typically a lazy load
+inside a loop) is logged as a likely N+1 and counted.
+
+Settings (app.config, defaulting to the environment):
+
+    METRICS_DIR             default <instance>/metrics
+    METRICS_FLUSH_INTERVAL  default 1.0 s
+    METRICS_TOKEN           if set, scrapers send "Authorization: Bearer <token>"
+    METRICS_ALLOW_LOCAL     default off; allow tokenless scrapes from localhost
+    SLOW_QUERY_MS           default 100
+    N_PLUS_ONE_THRESHOLD    default 5
+"""
+import hmac
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import Counter
+
+from flask import Response,before_render_template,g,has_request_context,request,template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from identity import current_admin
+
+logger = logging.getLogger(__name__)
+
+PREFIX = 'sudhamrit_'
+RETIRED_FILE = 'retired.json'
+LOCAL_ADDRESSES = ('127.0.0.1', '::1')
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRICS = {
+    'http_requests_total': ('counter', 'Requests handled, by endpoint, method and status.'),
+    'http_request_duration_seconds': ('histogram', 'Request latency by endpoint.'),
+    'db_queries_total': ('counter', 'SQL statements executed, by endpoint.'),
+    'db_query_seconds_total': ('counter', 'Time spent in SQL statements, by endpoint.'),
+    'template_render_seconds_total': ('counter', 'Time spent rendering templates, by endpoint.'),
+    'slow_queries_total': ('counter', 'SQL statements slower than SLOW_QUERY_MS, by endpoint.'),
+    'n_plus_one_total': ('counter', 'Requests that repeated one SELECT N_PLUS_ONE_THRESHOLD+ times.'),
+}
+
+
+class MetricsRegistry:
+    """This process's counters and histograms, keyed by (name, labels)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._file = None
+        self._last_flush = 0.0
+        self.counters = {}
+        self.histograms = {}
+
+    def _check_fork(self):
+        # A worker forked from a preloaded master starts with a copy of the
+        # master's registry; it must not report it (or its file) as its own.
+        if self._pid != os.getpid():
+            self._reset()
+
+    def inc(self, name, labels, value=1.0):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._check_fork()
+            self.counters[key] = self.counters.get(key, 0.0) + value
+
+    def observe(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._check_fork()
+            buckets = self.histograms.get(key)
+            if buckets is None:
+                buckets = self.histograms[key] = [0] * len(LATENCY_BUCKETS) + [0.0, 0]
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if value <= bound:
+                    buckets[i] += 1
+            buckets[-2] += value
+            buckets[-1] += 1
+
+    def snapshot(self):
+        with self._lock:
+            self._check_fork()
+            return {
+                'counters': [[name, list(labels), value] for (name, labels), value in self.counters.items()],
+                'histograms': [[name, list(labels), list(values)] for (name, labels), values in self.histograms.items()],
+            }
+
+    def flush(self, directory, interval=0.0):
+        """Write this process's totals to its file if the last write is older than interval."""
+        now = time.monotonic()
+        with self._lock:
+            self._check_fork()
+            if now - self._last_flush < interval:
+                return
+            self._last_flush = now
+            if self._file is None:
+                self._file = os.path.join(directory, f"{self._pid}-{uuid.uuid4().hex[:8]}.json")
+        data = self.snapshot()
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self._file}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self._file)
+
+
+registry = MetricsRegistry()
+_settings = {'slow_query_ms': 100.0, 'n_plus_one_threshold': 5}
+
+
+def collect(directory, names=None):
+    """Sum the files of every worker in directory (or just names) into one snapshot."""
+    counters, histograms = {}, {}
+    if names is None:
+        try:
+            names = [name for name in os.listdir(directory) if name.endswith('.json')]
+        except FileNotFoundError:
+            names = []
+    for name in names:
+        try:
+            with open(os.path.join(directory, name)) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for metric, labels, value in data['counters']:
+            key = (metric, tuple(tuple(pair) for pair in labels))
+            counters[key] = counters.get(key, 0.0) + value
+        for metric, labels, values in data['histograms']:
+            key = (metric, tuple(tuple(pair) for pair in labels))
+            total = histograms.setdefault(key, [0] * len(values))
+            for i, value in enumerate(values):
+                total[i] += value
+    return counters, histograms
+
+
+def _file_pid(name):
+    pid = name.split('-', 1)[0]
+    return int(pid) if name.endswith('.json') and pid.isdigit() else None
+
+
+def _pid_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def metrics_dir():
+    """The configured METRICS_DIR, or its default in a process that never built the app."""
+    return (_settings.get('dir') or os.getenv('METRICS_DIR')
+            or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'metrics'))
+
+
+def retire_workers(directory, pids=()):
+    """
+    Fold the files of exited workers into RETIRED_FILE and delete them.
+
+    Covers the given pids plus any file whose pid is no longer running.
+    Call from one process only (gunicorn's master); returns files folded.
+    """
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return 0
+    pids = set(pids)
+    dead = [name for name in names if _file_pid(name) is not None
+            and (_file_pid(name) in pids or not _pid_running(_file_pid(name)))]
+    if not dead:
+        return 0
+
+    retired = os.path.join(directory, RETIRED_FILE)
+    counters, histograms = collect(directory, [RETIRED_FILE] + dead)
+    data = {
+        'counters': [[name, list(labels), value] for (name, labels), value in counters.items()],
+        'histograms': [[name, list(labels), values] for (name, labels), values in histograms.items()],
+    }
+    tmp_path = f"{retired}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, retired)
+    for name in dead:
+        try:
+            os.remove(os.path.join(directory, name))
+        except FileNotFoundError:
+            pass
+    return len(dead)
+
+
+def _label_text(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + '}'
+
+
+def render_prometheus(counters, histograms):
+    """Prometheus text exposition format (version 0.0.4)."""
+    lines = []
+    for metric, (kind, help_text) in METRICS.items():
+        name = PREFIX + metric
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        if kind == 'histogram':
+            for (key_metric, labels), values in sorted(histograms.items()):
+                if key_metric != metric:
+                    continue
+                # observe() counts a value in every bucket it fits, so buckets are already cumulative.
+                for bound, count in zip(LATENCY_BUCKETS, values):
+                    lines.append(f"{name}_bucket{_label_text(labels, [('le', repr(bound))])} {count}")
+                lines.append(f"{name}_bucket{_label_text(labels, [('le', '+Inf')])} {values[-1]}")
+                lines.append(f"{name}_sum{_label_text(labels)} {values[-2]}")
+                lines.append(f"{name}_count{_label_text(labels)} {values[-1]}")
+        else:
+            for (key_metric, labels), value in sorted(counters.items()):
+                if key_metric == metric:
+                    lines.append(f"{name}{_label_text(labels)} {value}")
+    return '\n'.join(lines) + '\n'
+
+
+class RequestMetrics:
+    __slots__ = ('started', 'queries', 'sql_seconds', 'template_seconds', 'template_depth',
+                 'template_started', 'selects', 'slow_queries', 'recorded')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.template_seconds = 0.0
+        self.template_depth = 0
+        self.template_started = 0.0
+        self.selects = Counter()
+        self.slow_queries = 0
+        self.recorded = False
+
+
+def _current():
+    return g.get('_request_metrics') if has_request_context() else None
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('_metrics_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('_metrics_started')
+    if not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    current = _current()
+    slow = elapsed * 1000 >= _settings['slow_query_ms']
+    if slow:
+        logger.warning("Slow query (%.1f ms) on %s: %s", elapsed * 1000,
+                       request.endpoint if has_request_context() else '-', ' '.join(statement.split())[:500])
+    if current is None:
+        return
+    current.queries += 1
+    current.sql_seconds += elapsed
+    current.slow_queries += slow
+    if statement.lstrip()[:6].upper() == 'SELECT':
+        current.selects[statement] += 1
+
+
+def _before_render(sender, template, context, **extra):
+    current = _current()
+    if current is None:
+        return
+    if current.template_depth == 0:
+        current.template_started = time.perf_counter()
+    current.template_depth += 1
+
+
+def _after_render(sender, template, context, **extra):
+    current = _current()
+    if current is None or current.template_depth == 0:
+        return
+    current.template_depth -= 1
+    if current.template_depth == 0:
+        current.template_seconds += time.perf_counter() - current.template_started
+
+
+def _start_request():
+    g._request_metrics = RequestMetrics()
+
+
+def _record(current, status):
+    elapsed = time.perf_counter() - current.started
+    if current.recorded:
+        return elapsed
+    current.recorded = True
+    endpoint = request.endpoint or 'unmatched'
+    labels = {'endpoint': endpoint}
+
+    registry.inc('http_requests_total', {'endpoint': endpoint, 'method': request.method, 'status': str(status)})
+    registry.observe('http_request_duration_seconds', labels, elapsed)
+    registry.inc('db_queries_total', labels, current.queries)
+    registry.inc('db_query_seconds_total', labels, current.sql_seconds)
+    registry.inc('template_render_seconds_total', labels, current.template_seconds)
+    if current.slow_queries:
+        registry.inc('slow_queries_total', labels, current.slow_queries)
+
+    repeated = [(count, statement) for statement, count in current.selects.items()
+                if count >= _settings['n_plus_one_threshold']]
+    if repeated:
+        registry.inc('n_plus_one_total', labels)
+        for count, statement in sorted(repeated, reverse=True):
+            logger.warning("Possible N+1 on %s: same SELECT ran %d times: %s", endpoint, count,
+                           ' '.join(statement.split())[:300])
+
+    try:
+        registry.flush(_settings['dir'], _settings['flush_interval'])
+    except OSError as e:
+        logger.error(f"Could not write metrics: {e}")
+    return elapsed
+
+
+def _finish_request(response):
+    current = _current()
+    if current is None:
+        return response
+    elapsed = _record(current, response.status_code)
+    response.headers.add('Server-Timing', ', '.join([
+        f'db;dur={current.sql_seconds * 1000:.1f};desc="{current.queries} queries"',
+        f'tpl;dur={current.template_seconds * 1000:.1f}',
+        f'total;dur={elapsed * 1000:.1f}',
+    ]))
+    return response
+
+
+def _teardown_request(exc):
+    # after_request is skipped when a view raises; still count the request.
+    current = _current()
+    if current is not None and exc is not None:
+        _record(current, 500)
+
+
+def _scrape_allowed():
+    token = _settings.get('token')
+    if token and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return True
+    if (_settings.get('allow_local') and request.remote_addr in LOCAL_ADDRESSES
+            and 'X-Forwarded-For' not in request.headers):
+        return True
+    return current_admin() is not None
+
+
+def metrics_view():
+    if not _scrape_allowed():
+        return Response('unauthorized\n', status=401, mimetype='text/plain')
+    registry.flush(_settings['dir'])
+    counters, histograms = collect(_settings['dir'])
+    return Response(render_prometheus(counters, histograms), mimetype='text/plain; version=0.0.4')
+
+
+def init_app(app):
+    app.config.setdefault('METRICS_DIR', os.getenv('METRICS_DIR') or os.path.join(app.instance_path, 'metrics'))
+    app.config.setdefault('METRICS_FLUSH_INTERVAL', float(os.getenv('METRICS_FLUSH_INTERVAL', 1.0)))
+    app.config.setdefault('METRICS_TOKEN', os.getenv('METRICS_TOKEN'))
+    app.config.setdefault('METRICS_ALLOW_LOCAL',
+                          os.getenv('METRICS_ALLOW_LOCAL', '').lower() in ('1', 'true', 'yes'))
+    app.config.setdefault('SLOW_QUERY_MS', float(os.getenv('SLOW_QUERY_MS', 100)))
+    app.config.setdefault('N_PLUS_ONE_THRESHOLD', int(os.getenv('N_PLUS_ONE_THRESHOLD', 5)))
+    _settings.update(
+        dir=app.config['METRICS_DIR'],
+        flush_interval=app.config['METRICS_FLUSH_INTERVAL'],
+        token=app.config['METRICS_TOKEN'],
+        allow_local=app.config['METRICS_ALLOW_LOCAL'],
+        slow_query_ms=app.config['SLOW_QUERY_MS'],
+        n_plus_one_threshold=app.config['N_PLUS_ONE_THRESHOLD'],
+    )
+
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.teardown_request(_teardown_request)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_after_render, app)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
+    app.extensions['metrics'] = registry
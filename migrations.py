@@ -0,0 +1,239 @@
+"""
+Schema migrations.
+
+db.create_all() only creates missing tables; it never touches tables that
+already exist. Changes to existing tables go here as ordered, named steps.
+Each step runs once, in its own transaction, and is recorded in the
+schema_migrations table. Run them with 'flask migrate', or create the
+tables and migrate in one go with 'flask init-db'.
+
+A migration is a function taking a SQLAlchemy Connection. Append new ones to
+MIGRATIONS; never reorder or rename applied ones. Each one spells out its
+own SQL (and any tables it creates) as of when it was written, rather than
+calling into models or app modules, so later edits there can't change what
+an old migration does. Indexes on a table this database doesn't have yet
+are skipped: create_all() builds that table with its indexes later.
+"""
+import logging
+import os
+from collections import defaultdict
+from datetime import datetime,timedelta
+
+from sqlalchemy import Column,Date,DateTime,Float,Index,Integer,MetaData,String,Table,inspect,select,text
+
+from models import db
+
+logger = logging.getLogger(__name__)
+
+_metadata = MetaData()
+schema_migrations = Table(
+    'schema_migrations', _metadata,
+    Column('migration_id', String(100), primary_key=True),
+    Column('applied_at', DateTime, nullable=False),
+)
+
+
+def _columns(connection, table_name):
+    return {column['name'] for column in inspect(connection).get_columns(table_name)}
+
+
+def _create_indexes(connection, indexes):
+    """indexes: (name, table, columns, unique) tuples; created if missing."""
+    tables = set(inspect(connection).get_table_names())
+    for name, table_name, columns, unique in indexes:
+        if table_name not in tables:
+            logger.info("Table %s does not exist yet; skipping index %s", table_name, name)
+            continue
+        connection.execute(text(f'CREATE {"UNIQUE " if unique else ""}INDEX IF NOT EXISTS {name} '
+                                f'ON "{table_name}" ({", ".join(columns)})'))
+
+
+def merge_duplicate_cart_lines(connection):
+    """Fold repeated (user_id, product_id) cart rows into the oldest one."""
+    duplicates = connection.execute(text(
+        "SELECT user_id, product_id, MIN(cart_id), SUM(quantity) FROM cart "
+        "GROUP BY user_id, product_id HAVING COUNT(*) > 1"
+    )).all()
+    for user_id, product_id, keep_id, quantity in duplicates:
+        connection.execute(text("UPDATE cart SET quantity = :quantity WHERE cart_id = :keep_id"),
+                           {'quantity': quantity, 'keep_id': keep_id})
+        connection.execute(text("DELETE FROM cart WHERE user_id = :user_id AND product_id = :product_id "
+                                "AND cart_id != :keep_id"),
+                           {'user_id': user_id, 'product_id': product_id, 'keep_id': keep_id})
+    return len(duplicates)
+
+
+def m0001_hot_path_indexes(connection):
+    merged = merge_duplicate_cart_lines(connection)
+    if merged:
+        logger.info("Merged %s duplicate cart lines before adding the unique index", merged)
+    _create_indexes(connection, [
+        ('ux_cart_user_product', 'cart', ('user_id', 'product_id'), True),
+        ('ix_cart_product_id', 'cart', ('product_id',), False),
+        ('ix_payment_user_id', 'payment', ('user_id',), False),
+        ('ix_order_user_date', 'order', ('user_id', 'order_date'), False),
+        ('ix_order_date_id', 'order', ('order_date', 'order_id'), False),
+        ('ix_order_item_order_id', 'order_item', ('order_id',), False),
+        ('ix_order_item_product_id', 'order_item', ('product_id',), False),
+        ('ix_product_category', 'product', ('category',), False),
+        ('ix_delivery_location_user_added', 'delivery_location', ('user_id', 'added_at'), False),
+        ('ix_email_outbox_due', 'email_outbox', ('status', 'next_attempt_at'), False),
+    ])
+
+
+def m0002_product_search_index(connection):
+    if connection.dialect.name != 'sqlite':
+        return
+    connection.execute(text(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS product_fts USING fts5("
+        "product_name, description, "
+        "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+    ))
+    connection.execute(text("DELETE FROM product_fts"))
+    connection.execute(text(
+        "INSERT INTO product_fts (rowid, product_name, description) "
+        "SELECT product_id, product_name, COALESCE(description, '') FROM product"
+    ))
+    indexed = connection.execute(text("SELECT COUNT(*) FROM product_fts")).scalar()
+    logger.info("Indexed %s products for search", indexed)
+
+
+def m0003_sales_rollups(connection):
+    metadata = MetaData()
+    sales_daily = Table(
+        'sales_daily', metadata,
+        Column('sales_day', Date, primary_key=True),
+        Column('product_id', Integer, primary_key=True),
+        Column('category', String(100), nullable=False),
+        Column('units', Integer, nullable=False, default=0),
+        Column('revenue', Float, nullable=False, default=0),
+        Index('ix_sales_daily_product_day', 'product_id', 'sales_day'),
+    )
+    sales_monthly = Table(
+        'sales_monthly', metadata,
+        Column('month', Date, primary_key=True),
+        Column('product_id', Integer, primary_key=True),
+        Column('category', String(100), nullable=False),
+        Column('units', Integer, nullable=False, default=0),
+        Column('revenue', Float, nullable=False, default=0),
+        Index('ix_sales_monthly_product_month', 'product_id', 'month'),
+    )
+    sales_category_daily = Table(
+        'sales_category_daily', metadata,
+        Column('sales_day', Date, primary_key=True),
+        Column('category', String(100), primary_key=True),
+        Column('units', Integer, nullable=False, default=0),
+        Column('revenue', Float, nullable=False, default=0),
+        Column('orders', Integer, nullable=False, default=0),
+    )
+    metadata.create_all(connection, checkfirst=True)
+    for table in (sales_daily, sales_monthly, sales_category_daily):
+        connection.execute(table.delete())
+
+    # Backfill from every order item; days are shop-local, SALES_DAY_OFFSET_MINUTES ahead of UTC.
+    offset = timedelta(minutes=int(os.getenv('SALES_DAY_OFFSET_MINUTES', 330)))
+    daily = defaultdict(lambda: [0, 0.0])
+    monthly = defaultdict(lambda: [0, 0.0])
+    by_category = defaultdict(lambda: [0, 0.0, set()])
+    rows = connection.execute(text(
+        'SELECT o.order_date, o.order_id, i.product_id, COALESCE(p.category, \'Uncategorised\'), '
+        'i.quantity, i.price_per_item FROM "order" o JOIN order_item i ON i.order_id = o.order_id '
+        'LEFT JOIN product p ON p.product_id = i.product_id WHERE o.order_date IS NOT NULL'
+    ).columns(order_date=DateTime))
+    read = 0
+    for order_date, order_id, product_id, category, quantity, price in rows:
+        day = (order_date + offset).date()
+        revenue = quantity * price
+        for bucket in (daily[(day, product_id, category)], monthly[(day.replace(day=1), product_id, category)],
+                       by_category[(day, category)]):
+            bucket[0] += quantity
+            bucket[1] += revenue
+        by_category[(day, category)][2].add(order_id)
+        read += 1
+    for table, values in (
+            (sales_daily, [{'sales_day': d, 'product_id': p, 'category': c, 'units': u, 'revenue': round(r, 2)}
+                           for (d, p, c), (u, r) in daily.items()]),
+            (sales_monthly, [{'month': m, 'product_id': p, 'category': c, 'units': u, 'revenue': round(r, 2)}
+                             for (m, p, c), (u, r) in monthly.items()]),
+            (sales_category_daily, [{'sales_day': d, 'category': c, 'units': u, 'revenue': round(r, 2),
+                                     'orders': len(o)} for (d, c), (u, r, o) in by_category.items()])):
+        if values:
+            connection.execute(table.insert(), values)
+    logger.info("Backfilled sales rollups from %s order items", read)
+
+
+def m0004_delivery_location_key(connection):
+    if 'location_key' not in _columns(connection, 'delivery_location'):
+        connection.execute(text("ALTER TABLE delivery_location ADD COLUMN location_key VARCHAR(40)"))
+    # Existing rows keep a NULL key, which the unique index doesn't compare.
+    _create_indexes(connection, [
+        ('ux_delivery_location_user_key', 'delivery_location', ('user_id', 'location_key'), True),
+    ])
+    unkeyed = connection.execute(text("SELECT COUNT(*) FROM delivery_location WHERE location_key IS NULL")).scalar()
+    if unkeyed:
+        logger.info("%s saved locations predate location_key; run 'flask compact-locations' to fold duplicates",
+                    unkeyed)
+
+
+def m0005_cart_request_token(connection):
+    if 'request_token' not in _columns(connection, 'cart'):
+        connection.execute(text("ALTER TABLE cart ADD COLUMN request_token VARCHAR(40)"))
+
+
+def m0006_delivery_location_snapshot(connection):
+    if 'last_used_at' not in _columns(connection, 'delivery_location'):
+        connection.execute(text("ALTER TABLE delivery_location ADD COLUMN last_used_at TIMESTAMP"))
+        connection.execute(text("UPDATE delivery_location SET last_used_at = added_at"))
+    _create_indexes(connection, [
+        ('ix_delivery_location_user_used', 'delivery_location', ('user_id', 'last_used_at'), False),
+    ])
+    # Orders placed before this keep NULLs; dispatch falls back to the saved locations for them.
+    columns = _columns(connection, 'order')
+    for name, type_ in (('delivery_address', 'VARCHAR(200)'), ('delivery_latitude', 'FLOAT'),
+                        ('delivery_longitude', 'FLOAT')):
+        if name not in columns:
+            connection.execute(text(f'ALTER TABLE "order" ADD COLUMN {name} {type_}'))
+
+
+MIGRATIONS = [
+    ('0001_hot_path_indexes', m0001_hot_path_indexes),
+    ('0002_product_search_index', m0002_product_search_index),
+    ('0003_sales_rollups', m0003_sales_rollups),
+    ('0004_delivery_location_key', m0004_delivery_location_key),
+    ('0005_cart_request_token', m0005_cart_request_token),
+    ('0006_delivery_location_snapshot', m0006_delivery_location_snapshot),
+]
+
+
+def applied_migrations(connection):
+    schema_migrations.create(connection, checkfirst=True)
+    return {row[0] for row in connection.execute(select(schema_migrations.c.migration_id))}
+
+
+def pending_migrations():
+    with db.engine.begin() as connection:
+        applied = applied_migrations(connection)
+    return [name for name, _ in MIGRATIONS if name not in applied]
+
+
+def init_db():
+    """Create missing tables, then apply pending migrations; returns the migrations applied."""
+    db.create_all()
+    return upgrade()
+
+
+def upgrade():
+    """Apply every pending migration in order; returns the names applied."""
+    with db.engine.begin() as connection:
+        applied = applied_migrations(connection)
+
+    ran = []
+    for name, migrate in MIGRATIONS:
+        if name in applied:
+            continue
+        with db.engine.begin() as connection:
+            migrate(connection)
+            connection.execute(schema_migrations.insert().values(migration_id=name, applied_at=datetime.utcnow()))
+        logger.info("Applied migration %s", name)
+        ran.append(name)
+    return ran
@@ -23,7 +23,7 @@ class Product(db.Model):
     product_id=db.Column(db.Integer,primary_key=True)
     product_name=db.Column(db.String(120),nullable=False)
     description=db.Column(db.String(500))
-    category=db.Column(db.String(100),nullable=False)
+    category=db.Column(db.String(100),nullable=False,index=True)
     price=db.Column(db.Float,nullable=False)
     stock=db.Column(db.Integer,default=0)
     created_at=db.Column(db.DateTime,default=datetime.utcnow)
@@ -37,9 +37,15 @@ class Cart(db.Model):
     product_id=db.Column(db.Integer,db.ForeignKey('product.product_id'),nullable=False)
     quantity=db.Column(db.Integer,default=1)
     added_at=db.Column(db.DateTime,default=datetime.utcnow)
+    request_token=db.Column(db.String(40))  # last add-to-cart click applied, see carts.add_one()
     user=db.relationship('User',backref=db.backref('carts',lazy=True))
     product=db.relationship('Product',backref=db.backref('carts',lazy=True))
 
+    __table_args__=(
+        db.Index('ux_cart_user_product','user_id','product_id',unique=True),
+        db.Index('ix_cart_product_id','product_id'),
+    )
+
 class Payment(db.Model):
     payment_id=db.Column(db.Integer,primary_key=True)
     user_id=db.Column(db.Integer,db.ForeignKey('user.user_id'),nullable=False)
@@ -49,6 +55,10 @@ class Payment(db.Model):
     status=db.Column(db.String(50),default='Pending')
     user=db.relationship('User',backref=db.backref('payments',lazy=True))
 
+    __table_args__=(
+        db.Index('ix_payment_user_id','user_id'),
+    )
+
 
 class Order(db.Model):
     order_id = db.Column(db.Integer,primary_key=True)
@@ -57,12 +67,21 @@ class Order(db.Model):
     order_date = db.Column(db.DateTime,default=datetime.utcnow)
     total_amount = db.Column(db.Float,nullable=False)
     status = db.Column(db.String(50),default='Completed')
+    # Where it ships: the customer's delivery location when the order was placed
+    delivery_address = db.Column(db.String(200))
+    delivery_latitude = db.Column(db.Float)
+    delivery_longitude = db.Column(db.Float)
 
 
     payment=db.relationship('Payment',backref=db.backref('order',uselist=False))
     user=db.relationship('User',backref=db.backref('orders',lazy=True))
     order_items=db.relationship('OrderItem',backref=db.backref('order',lazy=True))
 
+    __table_args__=(
+        db.Index('ix_order_user_date','user_id','order_date'),
+        db.Index('ix_order_date_id','order_date','order_id'),
+    )
+
 
 
 class OrderItem(db.Model):
@@ -74,13 +93,123 @@ class OrderItem(db.Model):
 
     product = db.relationship('Product',backref=db.backref('order_items',lazy=True))
 
+    __table_args__=(
+        db.Index('ix_order_item_order_id','order_id'),
+        db.Index('ix_order_item_product_id','product_id'),
+    )
+
 class DeliveryLocation(db.Model):
     location_id = db.Column(db.Integer,primary_key=True)
     user_id = db.Column(db.Integer,db.ForeignKey('user.user_id'),nullable=False)
     address = db.Column(db.String(200),nullable=False)
     latitude = db.Column(db.Float,nullable=False)
     longitude = db.Column(db.Float,nullable=False)
-    added_at = db.Column(db.DateTime,default=datetime.utcnow)
+    added_at = db.Column(db.DateTime,default=datetime.utcnow)  # first saved; never moves
+    last_used_at = db.Column(db.DateTime,default=datetime.utcnow)  # last saved again
+    location_key = db.Column(db.String(40))  # see locations.location_key()
 
     user = db.relationship('User',backref=db.backref('delivery_locations',lazy=True))
-    
\ No newline at end of file
+
+    __table_args__=(
+        db.Index('ix_delivery_location_user_added','user_id','added_at'),
+        db.Index('ux_delivery_location_user_key','user_id','location_key',unique=True),
+        db.Index('ix_delivery_location_user_used','user_id','last_used_at'),
+    )
+    
+class StoreStats(db.Model):
+    stats_id = db.Column(db.Integer,primary_key=True)
+    total_products = db.Column(db.Integer,nullable=False,default=0)
+    total_customers = db.Column(db.Integer,nullable=False,default=0)
+    total_orders = db.Column(db.Integer,nullable=False,default=0)
+    total_revenue = db.Column(db.Float,nullable=False,default=0)
+    updated_at = db.Column(db.DateTime,default=datetime.utcnow,onupdate=datetime.utcnow)
+
+class EmailOutbox(db.Model):
+    outbox_id = db.Column(db.Integer,primary_key=True)
+    recipient = db.Column(db.String(120),nullable=False)
+    subject = db.Column(db.String(200),nullable=False)
+    body = db.Column(db.Text,nullable=False)
+    status = db.Column(db.String(20),nullable=False,default='Pending')
+    attempts = db.Column(db.Integer,nullable=False,default=0)
+    next_attempt_at = db.Column(db.DateTime,nullable=False,default=datetime.utcnow)
+    last_error = db.Column(db.String(500))
+    created_at = db.Column(db.DateTime,default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+    order_id = db.Column(db.Integer,db.ForeignKey('order.order_id'))
+
+    __table_args__=(
+        db.Index('ix_email_outbox_due','status','next_attempt_at'),
+    )
+
+class SalesDaily(db.Model):
+    sales_day = db.Column(db.Date,primary_key=True)
+    product_id = db.Column(db.Integer,primary_key=True)
+    category = db.Column(db.String(100),nullable=False)
+    units = db.Column(db.Integer,nullable=False,default=0)
+    revenue = db.Column(db.Float,nullable=False,default=0)
+
+    __table_args__=(
+        db.Index('ix_sales_daily_product_day','product_id','sales_day'),
+    )
+
+class SalesMonthly(db.Model):
+    month = db.Column(db.Date,primary_key=True)
+    product_id = db.Column(db.Integer,primary_key=True)
+    category = db.Column(db.String(100),nullable=False)
+    units = db.Column(db.Integer,nullable=False,default=0)
+    revenue = db.Column(db.Float,nullable=False,default=0)
+
+    __table_args__=(
+        db.Index('ix_sales_monthly_product_month','product_id','month'),
+    )
+
+class SalesCategoryDaily(db.Model):
+    sales_day = db.Column(db.Date,primary_key=True)
+    category = db.Column(db.String(100),primary_key=True)
+    units = db.Column(db.Integer,nullable=False,default=0)
+    revenue = db.Column(db.Float,nullable=False,default=0)
+    orders = db.Column(db.Integer,nullable=False,default=0)
+
+class DeliveryZone(db.Model):
+    zone_id = db.Column(db.Integer,primary_key=True)
+    name = db.Column(db.String(100),nullable=False)
+    center_latitude = db.Column(db.Float)
+    center_longitude = db.Column(db.Float)
+    radius_km = db.Column(db.Float)
+    polygon = db.Column(db.Text)  # JSON [[lat, lon], ...] for polygon zones
+    active = db.Column(db.Boolean,nullable=False,default=True)
+    created_at = db.Column(db.DateTime,default=datetime.utcnow)
+
+class GeocodeCache(db.Model):
+    cache_key = db.Column(db.String(200),primary_key=True)
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    address = db.Column(db.String(500))  # all three NULL: the provider found nothing
+    created_at = db.Column(db.DateTime,nullable=False,default=datetime.utcnow)
+
+class Subscription(db.Model):
+    subscription_id = db.Column(db.Integer,primary_key=True)
+    user_id = db.Column(db.Integer,db.ForeignKey('user.user_id'),nullable=False)
+    product_id = db.Column(db.Integer,db.ForeignKey('product.product_id'),nullable=False)
+    quantity = db.Column(db.Integer,nullable=False,default=1)
+    schedule = db.Column(db.String(30),nullable=False,default='daily')  # daily, alternate or e.g. mon,wed,fri
+    start_date = db.Column(db.Date,nullable=False)
+    end_date = db.Column(db.Date)
+    paused_from = db.Column(db.Date)
+    paused_until = db.Column(db.Date)  # inclusive; NULL with paused_from set means paused until resumed
+    status = db.Column(db.String(20),nullable=False,default='Active')
+    created_at = db.Column(db.DateTime,default=datetime.utcnow)
+
+    user = db.relationship('User',backref=db.backref('subscriptions',lazy=True))
+    product = db.relationship('Product')
+
+    __table_args__=(
+        db.Index('ix_subscription_user_id','user_id'),
+        db.Index('ix_subscription_status_start','status','start_date'),
+    )
+
+class SubscriptionDelivery(db.Model):
+    subscription_id = db.Column(db.Integer,db.ForeignKey('subscription.subscription_id'),primary_key=True)
+    delivery_date = db.Column(db.Date,primary_key=True)
+    order_id = db.Column(db.Integer,db.ForeignKey('order.order_id'),nullable=False)
+    created_at = db.Column(db.DateTime,default=datetime.utcnow)
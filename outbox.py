@@ -0,0 +1,128 @@
+"""
+Transactional email outbox.
+
+Routes never talk to SMTP. They call enqueue_email() before committing, so
+the message is stored in the same transaction as the order it describes,
+and a separate worker ('flask send-emails') drains the EmailOutbox table in
+batches over a single SMTP connection.
+
+A row is claimed by pushing its next_attempt_at forward by a lease with a
+conditional UPDATE, so several workers can run without sending twice, and a
+worker that dies mid-batch only delays its rows until the lease expires.
+Failed sends are retried with exponential backoff up to MAX_ATTEMPTS.
+"""
+import logging
+import time
+from datetime import datetime,timedelta
+
+from flask_mail import Message
+
+from models import db,EmailOutbox
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 50
+MAX_ATTEMPTS = 6
+LEASE_SECONDS = 300
+BACKOFF_BASE_SECONDS = 30
+BACKOFF_MAX_SECONDS = 3600
+
+
+def enqueue_email(recipient, subject, body, order_id=None):
+    """Add a message to the outbox in the caller's transaction."""
+    message = EmailOutbox(recipient=recipient, subject=subject, body=body, order_id=order_id)
+    db.session.add(message)
+    return message
+
+
+def backoff_delay(attempts):
+    return timedelta(seconds=min(BACKOFF_BASE_SECONDS * 2 ** (attempts - 1), BACKOFF_MAX_SECONDS))
+
+
+def claim_batch(batch_size=BATCH_SIZE, now=None):
+    """Lease up to batch_size due messages to this worker and return them."""
+    now = now or datetime.utcnow()
+    candidates = (db.session.query(EmailOutbox.outbox_id, EmailOutbox.next_attempt_at)
+                  .filter(EmailOutbox.status == 'Pending', EmailOutbox.next_attempt_at <= now)
+                  .order_by(EmailOutbox.next_attempt_at, EmailOutbox.outbox_id)
+                  .limit(batch_size)
+                  .all())
+    lease_until = now + timedelta(seconds=LEASE_SECONDS)
+    claimed = []
+    for outbox_id, next_attempt_at in candidates:
+        updated = (EmailOutbox.query
+                   .filter_by(outbox_id=outbox_id, status='Pending', next_attempt_at=next_attempt_at)
+                   .update({EmailOutbox.next_attempt_at: lease_until}, synchronize_session=False))
+        if updated:
+            claimed.append(outbox_id)
+    db.session.commit()
+    if not claimed:
+        return []
+    return EmailOutbox.query.filter(EmailOutbox.outbox_id.in_(claimed)).order_by(EmailOutbox.outbox_id).all()
+
+
+def _record_failure(message, error, now):
+    message.attempts += 1
+    message.last_error = str(error)[:500]
+    if message.attempts >= MAX_ATTEMPTS:
+        message.status = 'Failed'
+        logger.error("Giving up on email %s to %s after %s attempts: %s",
+                     message.outbox_id, message.recipient, message.attempts, error)
+    else:
+        message.next_attempt_at = now + backoff_delay(message.attempts)
+        logger.warning("Email %s to %s failed (attempt %s), retrying at %s: %s",
+                       message.outbox_id, message.recipient, message.attempts, message.next_attempt_at, error)
+
+
+def drain_outbox(mail, sender=None, batch_size=BATCH_SIZE):
+    """
+    Send one batch of due messages over a single SMTP connection.
+
+    Returns (sent, failed). If the connection cannot be opened at all, every
+    claimed message is counted as a failed attempt.
+    """
+    messages = claim_batch(batch_size)
+    if not messages:
+        return 0, 0
+
+    sent = failed = 0
+    now = datetime.utcnow()
+    handled = set()
+    try:
+        with mail.connect() as connection:
+            for message in messages:
+                handled.add(message.outbox_id)
+                try:
+                    connection.send(Message(subject=message.subject, recipients=[message.recipient],
+                                            body=message.body, sender=sender))
+                except Exception as e:
+                    _record_failure(message, e, now)
+                    failed += 1
+                else:
+                    message.attempts += 1
+                    message.status = 'Sent'
+                    message.sent_at = datetime.utcnow()
+                    message.last_error = None
+                    sent += 1
+    except Exception as e:
+        for message in messages:
+            if message.outbox_id not in handled:
+                _record_failure(message, e, now)
+                failed += 1
+    db.session.commit()
+    return sent, failed
+
+
+def run_worker(mail, sender=None, batch_size=BATCH_SIZE, poll_interval=5.0, once=False):
+    """Drain the outbox until it is empty (once=True) or forever."""
+    total_sent = total_failed = 0
+    while True:
+        sent, failed = drain_outbox(mail, sender=sender, batch_size=batch_size)
+        total_sent += sent
+        total_failed += failed
+        if sent or failed:
+            logger.info("Outbox batch: %s sent, %s failed", sent, failed)
+            continue
+        if once:
+            return total_sent, total_failed
+        time.sleep(poll_interval)
@@ -0,0 +1,150 @@
+"""
+Password hashing off the request thread.
+
+pbkdf2/scrypt are deliberately slow, so a burst of logins can keep every
+worker busy on CPU. Hashes are computed in a small process pool shared by
+the threads of a worker. The number of hashes waiting or running is capped,
+and once the cap is reached new requests get HasherBusy immediately. Routes
+turn that into a "try again" response instead of queueing without bound.
+A slot is held until the hash actually finishes in the pool, even when the
+request gave up waiting for it, so the cap bounds the CPU work in flight.
+
+The request thread still waits for its result, so the pool only lets a
+worker overlap hashing with other requests under threaded (gthread) or
+gevent workers; with gunicorn's default sync worker each process handles
+one request at a time and hashing there just moves to another process.
+
+    PASSWORD_HASH_METHOD     werkzeug method string, default pbkdf2:sha256
+    PASSWORD_SALT_LENGTH     default 16
+    PASSWORD_POOL_SIZE       worker processes, default 2; 0 hashes inline
+    PASSWORD_QUEUE_LIMIT     max hashes in flight per worker, default 32
+    PASSWORD_TIMEOUT         seconds to wait for a result, default 10
+
+Hashes made with an older method or cost are replaced on the next
+successful login (see needs_rehash).
+"""
+import atexit
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor,TimeoutError as FutureTimeout
+
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS,check_password_hash,generate_password_hash
+
+
+class HasherBusy(Exception):
+    """Raised when too many hashes are queued or a result takes too long."""
+
+
+def normalize_method(method):
+    """Spell out werkzeug's implicit defaults so methods compare reliably."""
+    parts = method.split(':')
+    if parts[0] == 'pbkdf2':
+        if len(parts) == 1:
+            parts.append('sha256')
+        if len(parts) == 2:
+            parts.append(str(DEFAULT_PBKDF2_ITERATIONS))
+    elif parts[0] == 'scrypt' and len(parts) == 1:
+        parts += ['32768', '8', '1']
+    return ':'.join(parts)
+
+
+def _hash(password, method, salt_length):
+    return generate_password_hash(password, method=method, salt_length=salt_length)
+
+
+def _verify(pwhash, password):
+    return check_password_hash(pwhash, password)
+
+
+class PasswordHasher:
+    def __init__(self, app=None):
+        self.method = 'pbkdf2:sha256'
+        self.salt_length = 16
+        self.pool_size = 2
+        self.queue_limit = 32
+        self.timeout = 10.0
+        self._pool = None
+        self._pool_pid = None
+        self._lock = threading.Lock()
+        self._slots = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PASSWORD_HASH_METHOD', os.getenv('PASSWORD_HASH_METHOD', 'pbkdf2:sha256'))
+        app.config.setdefault('PASSWORD_SALT_LENGTH', int(os.getenv('PASSWORD_SALT_LENGTH', 16)))
+        app.config.setdefault('PASSWORD_POOL_SIZE', int(os.getenv('PASSWORD_POOL_SIZE', 2)))
+        app.config.setdefault('PASSWORD_QUEUE_LIMIT', int(os.getenv('PASSWORD_QUEUE_LIMIT', 32)))
+        app.config.setdefault('PASSWORD_TIMEOUT', float(os.getenv('PASSWORD_TIMEOUT', 10)))
+        self.configure(method=app.config['PASSWORD_HASH_METHOD'],
+                       salt_length=app.config['PASSWORD_SALT_LENGTH'],
+                       pool_size=app.config['PASSWORD_POOL_SIZE'],
+                       queue_limit=app.config['PASSWORD_QUEUE_LIMIT'],
+                       timeout=app.config['PASSWORD_TIMEOUT'])
+        app.extensions['password_hasher'] = self
+
+    def configure(self, method=None, salt_length=None, pool_size=None, queue_limit=None, timeout=None):
+        self.shutdown()
+        if method is not None:
+            self.method = normalize_method(method)
+        if salt_length is not None:
+            self.salt_length = salt_length
+        if pool_size is not None:
+            self.pool_size = pool_size
+        if queue_limit is not None:
+            self.queue_limit = queue_limit
+        if timeout is not None:
+            self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(self.queue_limit)
+
+    def _executor(self):
+        # Created lazily and per process, so gunicorn workers forked from a
+        # preloaded parent each start their own pool.
+        with self._lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = ProcessPoolExecutor(max_workers=self.pool_size)
+                self._pool_pid = os.getpid()
+            return self._pool
+
+    def _run(self, fn, *args):
+        slots = self._slots
+        if not slots.acquire(blocking=False):
+            raise HasherBusy()
+        if self.pool_size <= 0:
+            try:
+                return fn(*args)
+            finally:
+                slots.release()
+        try:
+            future = self._executor().submit(fn, *args)
+        except BaseException:
+            slots.release()
+            raise
+        # Released when the pool is done with it, not when this thread stops waiting.
+        future.add_done_callback(lambda _: slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            raise HasherBusy()
+
+    def hash(self, password):
+        return self._run(_hash, password, self.method, self.salt_length)
+
+    def verify(self, pwhash, password):
+        if not pwhash or password is None:
+            return False
+        return self._run(_verify, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        return pwhash.split('$', 1)[0] != self.method
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None and self._pool_pid == os.getpid():
+                self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+            self._pool_pid = None
+
+
+password_hasher = PasswordHasher()
+atexit.register(password_hasher.shutdown)
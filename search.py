@@ -0,0 +1,215 @@
+"""
+Product search backed by an SQLite FTS5 index.
+
+product_fts holds product_name and description for every product, keyed by
+rowid = product_id. The admin product routes update it in the same
+transaction as the product row (index_product / unindex_product), and
+'flask reindex-search' rebuilds it from scratch.
+
+Queries are tokenised here and every token is matched as a prefix, so
+"pan" finds "Paneer" and "mal pan" finds "Malai Paneer". Small match sets
+are ranked with bm25 (name weighted above description). Scoring every hit
+of a broad query like "milk" costs tens of milliseconds at 100k products,
+so large match sets are returned as two tiers instead: name matches first,
+then description-only matches, each in product_id order. FTS5 can page
+through those straight from the index. Per-category facet counts for the
+whole match set are cached per catalog version.
+
+Joins against product are written as CROSS JOIN so SQLite always drives
+them from the FTS match; left to itself the planner may scan a category
+index and probe the FTS table once per product.
+
+On databases without FTS5 (e.g. Postgres) search falls back to
+case-insensitive LIKE on the same columns.
+"""
+import re
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import func,or_,text
+
+from catalog import catalog_cache
+from models import db,Product
+
+FTS_TABLE = 'product_fts'
+MAX_PER_PAGE = 50
+NAME_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+BM25_MAX_MATCHES = 2000
+FACET_CACHE_SIZE = 512
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+RESULT_COLUMNS = ('product_id', 'product_name', 'description', 'category', 'price', 'stock', 'product_image')
+
+
+def fts_enabled(connection=None):
+    bind = connection if connection is not None else db.engine
+    return bind.dialect.name == 'sqlite'
+
+
+def create_index(connection):
+    connection.execute(text(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+        "product_name, description, "
+        "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+    ))
+
+
+def rebuild_index(connection):
+    """Refill the index from the product table; returns the number of rows indexed."""
+    connection.execute(text(f"DELETE FROM {FTS_TABLE}"))
+    connection.execute(text(
+        f"INSERT INTO {FTS_TABLE} (rowid, product_name, description) "
+        "SELECT product_id, product_name, COALESCE(description, '') FROM product"
+    ))
+    return connection.execute(text(f"SELECT COUNT(*) FROM {FTS_TABLE}")).scalar()
+
+
+def index_product(product):
+    """Add or refresh one product in the index, inside the current transaction."""
+    if not fts_enabled():
+        return
+    params = {'product_id': product.product_id}
+    db.session.execute(text(f"DELETE FROM {FTS_TABLE} WHERE rowid = :product_id"), params)
+    db.session.execute(text(
+        f"INSERT INTO {FTS_TABLE} (rowid, product_name, description) "
+        "VALUES (:product_id, :product_name, :description)"
+    ), dict(params, product_name=product.product_name, description=product.description or ''))
+
+
+def unindex_product(product_id):
+    if not fts_enabled():
+        return
+    db.session.execute(text(f"DELETE FROM {FTS_TABLE} WHERE rowid = :product_id"), {'product_id': product_id})
+
+
+def tokenize(query):
+    return _TOKEN_RE.findall((query or '').lower())
+
+
+def fts_query(tokens):
+    """Every token as a quoted prefix term, ANDed together."""
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def _row_dict(row):
+    return {column: getattr(row, column) for column in RESULT_COLUMNS}
+
+
+def search_products(query, category=None, page=1, per_page=20):
+    """
+    Return {'results', 'total', 'page', 'per_page', 'facets'}.
+
+    An empty query lists the catalog (optionally filtered by category) so the
+    same endpoint serves browsing. Facet counts ignore the category filter so
+    clients can show how many hits each other category has.
+    """
+    page = max(1, int(page))
+    per_page = max(1, min(int(per_page), MAX_PER_PAGE))
+    offset = (page - 1) * per_page
+    tokens = tokenize(query)
+
+    if not tokens:
+        return _browse(category, page, per_page, offset)
+    if fts_enabled():
+        return _search_fts(tokens, category, page, per_page, offset)
+    return _search_like(tokens, category, page, per_page, offset)
+
+
+_facet_cache = OrderedDict()
+_facet_lock = threading.Lock()
+
+
+def _facets(match):
+    key = (catalog_cache.version(), match)
+    with _facet_lock:
+        if key in _facet_cache:
+            _facet_cache.move_to_end(key)
+            return _facet_cache[key]
+    rows = db.session.execute(text(
+        f"SELECT p.category, COUNT(*) FROM {FTS_TABLE} CROSS JOIN product p ON p.product_id = {FTS_TABLE}.rowid "
+        f"WHERE {FTS_TABLE} MATCH :match GROUP BY p.category ORDER BY COUNT(*) DESC"
+    ), {'match': match}).all()
+    facets = {row[0]: row[1] for row in rows}
+    with _facet_lock:
+        _facet_cache[key] = facets
+        while len(_facet_cache) > FACET_CACHE_SIZE:
+            _facet_cache.popitem(last=False)
+    return facets
+
+
+def _match_ids(match, category, limit, offset, order):
+    category_filter = "AND p.category = :category" if category else ""
+    return [row[0] for row in db.session.execute(text(
+        f"SELECT {FTS_TABLE}.rowid FROM {FTS_TABLE} CROSS JOIN product p ON p.product_id = {FTS_TABLE}.rowid "
+        f"WHERE {FTS_TABLE} MATCH :match {category_filter} ORDER BY {order} LIMIT :limit OFFSET :offset"
+    ), {'match': match, 'category': category, 'limit': limit, 'offset': offset})]
+
+
+def _count_matches(match, category):
+    if not category:
+        return db.session.execute(text(f"SELECT COUNT(*) FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :match"),
+                                  {'match': match}).scalar()
+    return db.session.execute(text(
+        f"SELECT COUNT(*) FROM {FTS_TABLE} CROSS JOIN product p ON p.product_id = {FTS_TABLE}.rowid "
+        f"WHERE {FTS_TABLE} MATCH :match AND p.category = :category"
+    ), {'match': match, 'category': category}).scalar()
+
+
+def _search_fts(tokens, category, page, per_page, offset):
+    match = fts_query(tokens)
+    facets = _facets(match)
+    total = facets.get(category, 0) if category else sum(facets.values())
+
+    if total <= BM25_MAX_MATCHES:
+        ids = _match_ids(match, category, per_page, offset,
+                         f"bm25({FTS_TABLE}, {NAME_WEIGHT}, {DESCRIPTION_WEIGHT}), {FTS_TABLE}.rowid")
+    else:
+        name_match = f"{{product_name}} : ({match})"
+        name_total = _count_matches(name_match, category)
+        ids = []
+        if offset < name_total:
+            ids = _match_ids(name_match, category, per_page, offset, f"{FTS_TABLE}.rowid")
+        if len(ids) < per_page:
+            ids += _match_ids(f"({match}) NOT {name_match}", category, per_page - len(ids),
+                              max(0, offset - name_total), f"{FTS_TABLE}.rowid")
+
+    products = {row.product_id: row for row in Product.query.filter(Product.product_id.in_(ids))} if ids else {}
+    results = [_row_dict(products[product_id]) for product_id in ids if product_id in products]
+    return _page(results, total, page, per_page, facets)
+
+
+def _search_like(tokens, category, page, per_page, offset):
+    conditions = [or_(Product.product_name.ilike(f'%{token}%'), Product.description.ilike(f'%{token}%'))
+                  for token in tokens]
+    facets = dict(db.session.query(Product.category, func.count(Product.product_id))
+                  .filter(*conditions).group_by(Product.category).all())
+    total = facets.get(category, 0) if category else sum(facets.values())
+    query = Product.query.filter(*conditions)
+    if category:
+        query = query.filter(Product.category == category)
+    rows = query.order_by(Product.product_name, Product.product_id).offset(offset).limit(per_page).all()
+    return _page([_row_dict(row) for row in rows], total, page, per_page, facets)
+
+
+def _browse(category, page, per_page, offset):
+    facets = dict(db.session.query(Product.category, func.count(Product.product_id))
+                  .group_by(Product.category).all())
+    total = facets.get(category, 0) if category else sum(facets.values())
+    query = Product.query
+    if category:
+        query = query.filter(Product.category == category)
+    rows = query.order_by(Product.product_id).offset(offset).limit(per_page).all()
+    return _page([_row_dict(row) for row in rows], total, page, per_page, facets)
+
+
+def _page(results, total, page, per_page, facets):
+    return {
+        'results': results,
+        'total': total,
+        'page': page,
+        'per_page': per_page,
+        'pages': (total + per_page - 1) // per_page,
+        'facets': facets,
+    }
@@ -0,0 +1,61 @@
+"""
+Headline numbers for the admin dashboard.
+
+StoreStats is a single-row rollup kept current by the routes that change
+it (register, add/delete product, checkout), so the dashboard reads one row
+instead of counting whole tables. The row is seeded from COUNT/SUM queries
+the first time it is needed, and can be rebuilt the same way at any time.
+"""
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from models import db,User,Product,Order,StoreStats
+
+STATS_ID = 1
+
+
+def compute_store_stats():
+    """Recompute every counter with aggregate queries in the database."""
+    orders, revenue = db.session.query(
+        func.count(Order.order_id),
+        func.coalesce(func.sum(Order.total_amount), 0),
+    ).one()
+    return {
+        'total_products': db.session.query(func.count(Product.product_id)).scalar(),
+        'total_customers': db.session.query(func.count(User.user_id)).scalar(),
+        'total_orders': orders,
+        'total_revenue': float(revenue),
+    }
+
+
+def refresh_store_stats():
+    """Rebuild the rollup row from the source tables and commit it."""
+    stats = db.session.get(StoreStats, STATS_ID) or StoreStats(stats_id=STATS_ID)
+    for key, value in compute_store_stats().items():
+        setattr(stats, key, value)
+    db.session.add(stats)
+    db.session.commit()
+    return stats
+
+
+def get_store_stats():
+    stats = db.session.get(StoreStats, STATS_ID)
+    if stats is None:
+        try:
+            stats = refresh_store_stats()
+        except IntegrityError:
+            # Another request seeded the row first; use theirs.
+            db.session.rollback()
+            stats = db.session.get(StoreStats, STATS_ID)
+    return stats
+
+
+def bump_store_stats(**deltas):
+    """
+    Add deltas to the rollup inside the caller's transaction.
+
+    Uses a relative UPDATE (col = col + delta) so concurrent writers never
+    lose increments. If the row has not been seeded yet there is nothing to
+    update; the first read will compute it, including this change.
+    """
+    values = {getattr(StoreStats, key): getattr(StoreStats, key) + delta for key, delta in deltas.items()}
+    db.session.query(StoreStats).filter_by(stats_id=STATS_ID).update(values, synchronize_session=False)
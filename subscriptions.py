@@ -0,0 +1,308 @@
+"""
+Recurring delivery subscriptions and the nightly order generator.
+
+A Subscription asks for `quantity` of one product on a schedule:
+
+    daily         every day from start_date
+    alternate     every other day, counting from start_date
+    mon,wed,fri   the listed weekdays (any of mon..sun)
+
+between start_date and end_date (inclusive, open-ended when NULL), except
+while paused: paused_from..paused_until inclusive, or from paused_from
+onwards while paused_until is NULL. Days are shop-local, as in analytics.
+
+'flask generate-subscription-orders' (run nightly, for tomorrow by default)
+turns the day's due subscriptions into ordinary Payment/Order/OrderItem
+rows, one order per customer per day, so dispatch, the analytics rollups
+and the dashboard see them like any checkout. It works through the
+customers in batches, one transaction per batch, with set-based SQL only:
+
+  1. select the batch's due subscriptions with their product's price,
+  2. reserve the stock for the whole batch, one conditional UPDATE per
+     product (inventory.reserve_available), serving subscriptions in
+     subscription_id order and giving back what they can't use,
+  3. append to the customer's order for the day if an earlier run made
+     one, raising its total and payment amount in place; otherwise
+     bulk-insert a payment and an order (ids come back with RETURNING),
+     shipping to the customer's latest saved location,
+  4. insert the order items and one SubscriptionDelivery row per
+     subscription served,
+  5. add the batch to the sales rollups and the dashboard stats.
+
+SubscriptionDelivery (subscription_id, delivery_date) is the idempotency
+ledger: a subscription that already has its row for the day is not due, so
+re-running the generator for a day only picks up what is left, e.g.
+subscriptions that were out of stock last time or added since, and adds
+them to the order the customer already has for that day (found through
+SubscriptionDelivery.order_id), so a re-run after a restock still leaves
+one order per customer per day. A concurrent run for the same day collides
+on the ledger's primary key and its batch rolls back whole, stock included.
+
+Orders are dated at the start of the delivery day. Pausing or cancelling
+after the day's orders were generated does not withdraw them. Like
+checkout, taking stock here doesn't bump the catalog version: the cached
+catalog overlays live stock (see catalog.py).
+"""
+import logging
+from collections import defaultdict
+from datetime import date,datetime,timedelta
+
+from sqlalchemy import and_,bindparam,exists,func,insert,not_,or_,select
+from sqlalchemy.exc import IntegrityError
+
+import analytics
+import locations
+from analytics import DAY_OFFSET
+from inventory import reserve_available,release_stock
+from models import db,Product,Payment,Order,OrderItem,Subscription,SubscriptionDelivery
+from stats import bump_store_stats
+
+logger = logging.getLogger(__name__)
+
+WEEKDAYS = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+PAYMENT_METHOD = 'Subscription'
+MAX_QUANTITY = 100
+
+
+def parse_schedule(text):
+    """Normalised schedule string, or ValueError."""
+    text = (text or '').strip().lower().replace(' ', '')
+    if text in ('daily', 'alternate'):
+        return text
+    days = [day for day in text.split(',') if day]
+    if not days or any(day not in WEEKDAYS for day in days):
+        raise ValueError("schedule must be 'daily', 'alternate' or weekdays like 'mon,wed,fri'")
+    return ','.join(day for day in WEEKDAYS if day in days)
+
+
+def on_schedule(schedule, start_date, day):
+    if schedule == 'daily':
+        return True
+    if schedule == 'alternate':
+        return (day - start_date).days % 2 == 0
+    return WEEKDAYS[day.weekday()] in schedule.split(',')
+
+
+def is_paused(subscription, day):
+    return (subscription.paused_from is not None and subscription.paused_from <= day
+            and (subscription.paused_until is None or day <= subscription.paused_until))
+
+
+def due_on(subscription, day):
+    """Whether the subscription wants a delivery on this shop-local day."""
+    return (subscription.status == 'Active' and subscription.start_date <= day
+            and (subscription.end_date is None or day <= subscription.end_date)
+            and not is_paused(subscription, day) and on_schedule(subscription.schedule, subscription.start_date, day))
+
+
+def _candidates(day):
+    """Active, in-range, unpaused subscriptions without a delivery for day; the schedule is checked in Python."""
+    return and_(
+        Subscription.status == 'Active',
+        Subscription.start_date <= day,
+        or_(Subscription.end_date.is_(None), Subscription.end_date >= day),
+        not_(and_(Subscription.paused_from.is_not(None), Subscription.paused_from <= day,
+                  or_(Subscription.paused_until.is_(None), Subscription.paused_until >= day))),
+        ~exists().where(SubscriptionDelivery.subscription_id == Subscription.subscription_id,
+                        SubscriptionDelivery.delivery_date == day),
+    )
+
+
+def _allocate(due, granted):
+    """Serve due subscriptions in subscription_id order from granted stock; returns (served, unused stock)."""
+    left = dict(granted)
+    served = []
+    for row in sorted(due, key=lambda row: row.subscription_id):
+        if left.get(row.product_id, 0) >= row.quantity:
+            left[row.product_id] -= row.quantity
+            served.append(row)
+    return served, left
+
+
+def _generate_batch(day, user_ids, order_date):
+    rows = db.session.execute(
+        select(Subscription.subscription_id, Subscription.user_id, Subscription.product_id, Subscription.quantity,
+               Subscription.schedule, Subscription.start_date, Product.price, Product.category)
+        .join(Product, Product.product_id == Subscription.product_id)
+        .where(Subscription.user_id.in_(user_ids), _candidates(day))
+    ).all()
+    due = [row for row in rows if on_schedule(row.schedule, row.start_date, day)]
+    counts = {'due': len(due), 'orders': 0, 'topped_up': 0, 'items': 0, 'out_of_stock': 0, 'revenue': 0.0}
+    if not due:
+        return counts
+
+    wanted = defaultdict(int)
+    for row in due:
+        wanted[row.product_id] += row.quantity
+    served, unused = _allocate(due, reserve_available(wanted))
+    release_stock(unused)
+    counts['out_of_stock'] = len(due) - len(served)
+    if not served:
+        return counts
+
+    by_user = defaultdict(list)
+    for row in served:
+        by_user[row.user_id].append(row)
+    totals = {user_id: round(sum(row.quantity * row.price for row in by_user[user_id]), 2) for user_id in by_user}
+    now = datetime.utcnow()
+
+    # Customers served earlier in the day (before a restock) get the rest on that same order.
+    existing = dict(db.session.execute(
+        select(Subscription.user_id, func.min(SubscriptionDelivery.order_id))
+        .join(Subscription, Subscription.subscription_id == SubscriptionDelivery.subscription_id)
+        .where(SubscriptionDelivery.delivery_date == day, Subscription.user_id.in_(list(by_user)))
+        .group_by(Subscription.user_id)).all())
+    counted = set()
+    if existing:
+        order_table, payment_table = Order.__table__, Payment.__table__
+        db.session.execute(
+            order_table.update().where(order_table.c.order_id == bindparam('b_order_id'))
+            .values(total_amount=order_table.c.total_amount + bindparam('b_amount')),
+            [{'b_order_id': order_id, 'b_amount': totals[user_id]} for user_id, order_id in existing.items()])
+        db.session.execute(
+            payment_table.update().where(payment_table.c.payment_id == select(order_table.c.payment_id).where(
+                order_table.c.order_id == bindparam('b_order_id')).scalar_subquery())
+            .values(amount=payment_table.c.amount + bindparam('b_amount')),
+            [{'b_order_id': order_id, 'b_amount': totals[user_id]} for user_id, order_id in existing.items()])
+        counted = set(db.session.execute(
+            select(OrderItem.order_id, func.coalesce(Product.category, 'Uncategorised'))
+            .outerjoin(Product, Product.product_id == OrderItem.product_id)
+            .where(OrderItem.order_id.in_(list(existing.values())))).all())
+
+    users = sorted(user_id for user_id in by_user if user_id not in existing)
+    ship_to = locations.latest_for_users(users)
+    payment_ids = db.session.scalars(
+        insert(Payment).returning(Payment.payment_id, sort_by_parameter_order=True),
+        [{'user_id': user_id, 'amount': totals[user_id], 'payment_date': now, 'payment_method': PAYMENT_METHOD,
+          'status': 'Pending'} for user_id in users]).all() if users else []
+    order_ids = db.session.scalars(
+        insert(Order).returning(Order.order_id, sort_by_parameter_order=True),
+        [{'payment_id': payment_id, 'user_id': user_id, 'order_date': order_date, 'total_amount': totals[user_id],
+          'status': 'Completed',
+          'delivery_address': ship_to[user_id].address if user_id in ship_to else None,
+          'delivery_latitude': ship_to[user_id].latitude if user_id in ship_to else None,
+          'delivery_longitude': ship_to[user_id].longitude if user_id in ship_to else None}
+         for payment_id, user_id in zip(payment_ids, users)]).all() if users else []
+
+    order_for = {**existing, **dict(zip(users, order_ids))}
+    items, ledger, sales = [], [], []
+    for user_id in sorted(by_user):
+        order_id = order_for[user_id]
+        for row in by_user[user_id]:
+            items.append({'order_id': order_id, 'product_id': row.product_id, 'quantity': row.quantity,
+                          'price_per_item': row.price})
+            ledger.append({'subscription_id': row.subscription_id, 'delivery_date': day, 'order_id': order_id,
+                           'created_at': now})
+            # An appended item doesn't count its order again in a category the order already had.
+            sales.append((order_date, None if (order_id, row.category) in counted else order_id, row.product_id,
+                          row.category, row.quantity, row.price))
+    db.session.execute(insert(OrderItem), items)
+    db.session.execute(insert(SubscriptionDelivery), ledger)
+    analytics.record_lines(db.session, sales)
+    revenue = sum(totals.values())
+    bump_store_stats(total_orders=len(order_ids), total_revenue=revenue)
+
+    counts.update(orders=len(order_ids), topped_up=len(existing), items=len(items), revenue=revenue)
+    return counts
+
+
+def generate_orders(day, batch_size=2000, progress=None):
+    """
+    Create day's orders for every due subscription, batch_size customers per
+    transaction. Safe to re-run; returns totals for this run.
+    """
+    order_date = datetime.combine(day, datetime.min.time()) - DAY_OFFSET
+    totals = {'date': day.isoformat(), 'customers': 0, 'due': 0, 'orders': 0, 'topped_up': 0, 'items': 0,
+              'out_of_stock': 0, 'revenue': 0.0, 'conflicts': 0}
+    last_user = 0
+    while True:
+        user_ids = db.session.execute(
+            select(Subscription.user_id).where(Subscription.user_id > last_user, _candidates(day))
+            .group_by(Subscription.user_id).order_by(Subscription.user_id).limit(batch_size)).scalars().all()
+        if not user_ids:
+            db.session.rollback()
+            break
+        last_user = user_ids[-1]
+        try:
+            counts = _generate_batch(day, user_ids, order_date)
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            logger.warning("Subscription orders for %s, customers %s-%s, were written by another run; skipped",
+                           day, user_ids[0], user_ids[-1])
+            totals['conflicts'] += 1
+            continue
+        totals['customers'] += len(user_ids)
+        for name in ('due', 'orders', 'topped_up', 'items', 'out_of_stock', 'revenue'):
+            totals[name] += counts[name]
+        if progress:
+            progress(totals)
+    totals['revenue'] = round(totals['revenue'], 2)
+    if totals['out_of_stock']:
+        logger.warning("%s subscriptions due on %s were out of stock; re-run to retry them",
+                       totals['out_of_stock'], day)
+    return totals
+
+
+# -- API helpers ----------------------------------------------------------------
+
+def subscription_dict(subscription):
+    product = subscription.product
+    return {
+        'subscription_id': subscription.subscription_id,
+        'product_id': subscription.product_id,
+        'product_name': product.product_name if product else None,
+        'quantity': subscription.quantity,
+        'schedule': subscription.schedule,
+        'start_date': subscription.start_date.isoformat(),
+        'end_date': subscription.end_date.isoformat() if subscription.end_date else None,
+        'paused_from': subscription.paused_from.isoformat() if subscription.paused_from else None,
+        'paused_until': subscription.paused_until.isoformat() if subscription.paused_until else None,
+        'status': subscription.status,
+    }
+
+
+def _quantity(value):
+    if isinstance(value, bool) or int(value) != value or not 1 <= int(value) <= MAX_QUANTITY:
+        raise ValueError(f"quantity must be a whole number from 1 to {MAX_QUANTITY}")
+    return int(value)
+
+
+def _date(value):
+    return date.fromisoformat(value) if value else None
+
+
+def apply_changes(subscription, payload):
+    """
+    Set quantity, schedule, start/end dates, pause dates and status from a
+    JSON payload; raises ValueError (KeyError/TypeError for malformed input).
+    """
+    if 'quantity' in payload:
+        subscription.quantity = _quantity(payload['quantity'])
+    if 'schedule' in payload:
+        subscription.schedule = parse_schedule(payload['schedule'])
+    for field in ('start_date', 'end_date', 'paused_from', 'paused_until'):
+        if field in payload:
+            setattr(subscription, field, _date(payload[field]))
+    if 'status' in payload:
+        if payload['status'] not in ('Active', 'Cancelled'):
+            raise ValueError("status must be 'Active' or 'Cancelled'")
+        subscription.status = payload['status']
+    if subscription.start_date is None:
+        raise ValueError('start_date is required')
+    if subscription.end_date and subscription.end_date < subscription.start_date:
+        raise ValueError('end_date is before start_date')
+    if subscription.paused_until and not subscription.paused_from:
+        raise ValueError('paused_until needs paused_from')
+    if subscription.paused_until and subscription.paused_until < subscription.paused_from:
+        raise ValueError('paused_until is before paused_from')
+    return subscription
+
+
+def subscription_from_payload(user_id, payload):
+    """A new Subscription from {product_id, quantity, schedule, start_date, ...}; starts tomorrow by default."""
+    subscription = Subscription(user_id=user_id, product_id=int(payload['product_id']), quantity=1,
+                                schedule='daily', status='Active',
+                                start_date=_date(payload.get('start_date')) or analytics.today() + timedelta(days=1))
+    return apply_changes(subscription, {key: value for key, value in payload.items()
+                                        if key not in ('product_id', 'status', 'start_date')})
@@ -0,0 +1,65 @@
+"""
+Concurrent checkouts for the last units of one product: nothing is oversold
+and no checkout hangs. A reduced bench/checkout_contention.py.
+
+    python -m pytest -q tests
+"""
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import func  # noqa: E402
+
+from app import create_app  # noqa: E402
+from migrations import init_db  # noqa: E402
+from models import db,User,Product,Cart,Order,OrderItem  # noqa: E402
+
+BUYERS = 50
+STOCK = 10
+PRICE = 60.0
+
+
+def make_shop(tmp_path):
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'contention.db'}"})
+    with app.app_context():
+        init_db()
+        hot = Product(product_name='Fresh Cow Milk', category='Milk', price=PRICE, stock=STOCK)
+        users = [User(username=f'buyer{i}', email=f'buyer{i}@example.com', password='x') for i in range(BUYERS)]
+        db.session.add(hot)
+        db.session.add_all(users)
+        db.session.flush()
+        db.session.add_all(Cart(user_id=user.user_id, product_id=hot.product_id, quantity=1) for user in users)
+        db.session.commit()
+        return app, hot.product_id, [user.user_id for user in users]
+
+
+def test_last_units_are_sold_exactly_once(tmp_path):
+    app, product_id, user_ids = make_shop(tmp_path)
+    start_line = threading.Barrier(len(user_ids))
+    statuses = {}
+
+    def checkout(user_id):
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['user_id'] = user_id
+            session['payment_amount'] = PRICE
+        start_line.wait()
+        statuses[user_id] = client.post('/payment_success', data={'payment_method': 'UPI'}).status_code
+
+    threads = [threading.Thread(target=checkout, args=(user_id,), daemon=True) for user_id in user_ids]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=60)
+
+    assert not [thread for thread in threads if thread.is_alive()], 'checkouts hung'
+    assert len(statuses) == BUYERS
+    assert all(status < 500 for status in statuses.values())
+    with app.app_context():
+        assert db.session.get(Product, product_id).stock == 0
+        assert db.session.query(func.count(Order.order_id)).scalar() == STOCK
+        assert db.session.query(func.sum(OrderItem.quantity)).scalar() == STOCK
+        # Everyone who didn't get an order still has the product in their cart.
+        assert db.session.query(func.count(Cart.cart_id)).scalar() == BUYERS - STOCK
@@ -0,0 +1,108 @@
+"""
+The email outbox worker against a real SMTP server (aiosmtpd).
+
+    python -m pytest -q tests
+"""
+import os
+import socket
+import sys
+from datetime import datetime,timedelta
+
+import pytest
+
+aiosmtpd = pytest.importorskip('aiosmtpd.controller')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import outbox  # noqa: E402
+from app import create_app,mail  # noqa: E402
+from migrations import init_db  # noqa: E402
+from models import db,EmailOutbox  # noqa: E402
+
+
+class Inbox:
+    def __init__(self):
+        self.envelopes = []
+
+    async def handle_DATA(self, server, session, envelope):
+        self.envelopes.append(envelope)
+        return '250 Message accepted for delivery'
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def make_app(tmp_path, port):
+    return create_app({
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'outbox.db'}",
+        'MAIL_SERVER': '127.0.0.1',
+        'MAIL_PORT': port,
+        'MAIL_USE_TLS': False,
+        'MAIL_USERNAME': None,
+        'MAIL_PASSWORD': None,
+        'MAIL_SUPPRESS_SEND': False,
+        'MAIL_DEFAULT_SENDER': 'shop@example.com',
+    })
+
+
+@pytest.fixture
+def smtp_server():
+    inbox = Inbox()
+    controller = aiosmtpd.Controller(inbox, hostname='127.0.0.1', port=free_port())
+    controller.start()
+    try:
+        yield controller, inbox
+    finally:
+        controller.stop()
+
+
+def queue(app, recipient='customer@example.com'):
+    with app.app_context():
+        init_db()
+        message = outbox.enqueue_email(recipient, 'Order Confirmation', 'Thank you for your order.')
+        db.session.commit()
+        return message.outbox_id
+
+
+def test_worker_delivers_and_marks_sent(tmp_path, smtp_server):
+    controller, inbox = smtp_server
+    app = make_app(tmp_path, controller.port)
+    outbox_id = queue(app)
+
+    with app.app_context():
+        sent, failed = outbox.run_worker(mail, sender='shop@example.com', once=True)
+        row = db.session.get(EmailOutbox, outbox_id)
+        assert (sent, failed) == (1, 0)
+        assert row.status == 'Sent'
+        assert row.attempts == 1
+        assert row.sent_at is not None
+        assert row.last_error is None
+
+    assert len(inbox.envelopes) == 1
+    envelope = inbox.envelopes[0]
+    assert envelope.rcpt_tos == ['customer@example.com']
+    assert b'Subject: Order Confirmation' in envelope.content
+
+
+def test_refused_connection_backs_off(tmp_path):
+    app = make_app(tmp_path, free_port())  # nothing listens there
+    outbox_id = queue(app)
+
+    with app.app_context():
+        before = datetime.utcnow()
+        sent, failed = outbox.run_worker(mail, sender='shop@example.com', once=True)
+        row = db.session.get(EmailOutbox, outbox_id)
+        assert (sent, failed) == (0, 1)
+        assert row.status == 'Pending'
+        assert row.attempts == 1
+        assert row.last_error
+        # Rescheduled by the first backoff step, not left on the claim lease.
+        delay = row.next_attempt_at - before
+        assert outbox.backoff_delay(1) <= delay < outbox.backoff_delay(1) + timedelta(seconds=5)
+
+        # Not due yet, so another pass leaves it alone.
+        assert outbox.run_worker(mail, sender='shop@example.com', once=True) == (0, 0)
+        assert db.session.get(EmailOutbox, outbox_id).attempts == 1
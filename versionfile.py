@@ -0,0 +1,38 @@
+"""
+Cross-process version counters for per-worker caches.
+
+A VersionFile is a small file in the instance folder holding an opaque
+token. Caches compare it with the token they were built for, one file read
+per request, and writers replace it atomically after committing a change,
+so every gunicorn worker drops its copy on its next read without touching
+the database. The catalog and the delivery zone index both use one.
+"""
+import os
+import time
+import uuid
+
+
+class VersionFile:
+    def __init__(self, path=None):
+        self.path = path
+
+    def configure(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+
+    def read(self):
+        """The current token, or '0' before the first bump."""
+        try:
+            with open(self.path) as f:
+                return f.read().strip() or '0'
+        except FileNotFoundError:
+            return '0'
+
+    def bump(self):
+        """Write a new token and return it."""
+        token = f"{time.time_ns()}-{uuid.uuid4().hex[:8]}"
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(token)
+        os.replace(tmp_path, self.path)
+        return token
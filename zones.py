@@ -0,0 +1,288 @@
+"""
+Delivery zones and serviceability lookups.
+
+A zone is either a radius around a point (the farm, a depot) or a polygon
+of (lat, lon) vertices. Active zones are compiled into a grid index: the
+map is cut into cells of DELIVERY_ZONE_CELL_DEG degrees (0.01, about 1 km)
+and each cell a zone reaches records whether the zone covers it entirely
+or only partly. A lookup is one dict probe for the point's cell; only
+points in a partly covered cell, along a zone's edge, need the exact
+distance or point-in-polygon test.
+
+The index is per process and versioned like the catalog cache: a small
+file in the instance folder (versionfile.VersionFile) holds the zone version, and adding or removing
+a zone bumps it, so every worker rebuilds its index on the next lookup.
+
+With no active zones nothing is enforced, so a shop that hasn't drawn its
+zones yet keeps taking orders from anywhere.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from math import cos,floor,isfinite,pi,radians
+from typing import Optional
+
+from sqlalchemy import select
+
+from dispatch import EARTH_RADIUS_KM,haversine_km
+from models import db,DeliveryLocation,DeliveryZone
+from versionfile import VersionFile
+
+logger = logging.getLogger(__name__)
+
+KM_PER_DEGREE = 111.195
+MAX_RADIUS_KM = pi * EARTH_RADIUS_KM  # half way round the globe already covers all of it
+CELL_DEG = float(os.getenv('DELIVERY_ZONE_CELL_DEG', 0.01))
+MAX_CELLS_PER_ZONE = 250000  # larger zones are tested directly on every lookup instead
+
+
+def _segment_hits_box(p, q, south, west, north, east):
+    """Does segment p-q ((lat, lon) each) touch the box? Liang-Barsky clipping."""
+    t0, t1 = 0.0, 1.0
+    dlat, dlon = q[0] - p[0], q[1] - p[1]
+    for step, low, high, start in ((dlat, south, north, p[0]), (dlon, west, east, p[1])):
+        if step == 0:
+            if start < low or start > high:
+                return False
+            continue
+        a, b = (low - start) / step, (high - start) / step
+        if a > b:
+            a, b = b, a
+        t0, t1 = max(t0, a), min(t1, b)
+        if t0 > t1:
+            return False
+    return True
+
+
+@dataclass(frozen=True)
+class Zone:
+    zone_id: int
+    name: str
+    center: Optional[tuple] = None
+    radius_km: Optional[float] = None
+    polygon: Optional[tuple] = None
+
+    @classmethod
+    def from_model(cls, zone):
+        if zone.polygon:
+            return cls(zone.zone_id, zone.name, polygon=tuple(tuple(map(float, v)) for v in json.loads(zone.polygon)))
+        return cls(zone.zone_id, zone.name, center=(zone.center_latitude, zone.center_longitude),
+                   radius_km=zone.radius_km)
+
+    def contains(self, lat, lon):
+        if self.polygon is None:
+            return haversine_km(self.center[0], self.center[1], lat, lon) <= self.radius_km
+        inside = False
+        vertices = self.polygon
+        j = len(vertices) - 1
+        for i in range(len(vertices)):
+            (lat_i, lon_i), (lat_j, lon_j) = vertices[i], vertices[j]
+            if (lat_i > lat) != (lat_j > lat) and lon < (lon_j - lon_i) * (lat - lat_i) / (lat_j - lat_i) + lon_i:
+                inside = not inside
+            j = i
+        return inside
+
+    def bounds(self):
+        """(south, west, north, east) in degrees."""
+        if self.polygon is None:
+            lat, lon = self.center
+            dlat = self.radius_km / KM_PER_DEGREE
+            dlon = dlat / max(cos(radians(lat)), 0.01)
+            return lat - dlat, lon - dlon, lat + dlat, lon + dlon
+        lats = [v[0] for v in self.polygon]
+        lons = [v[1] for v in self.polygon]
+        return min(lats), min(lons), max(lats), max(lons)
+
+    def coverage(self, south, west, north, east):
+        """'full', 'partial' or None for how much of the box the zone covers."""
+        corners = ((south, west), (south, east), (north, west), (north, east))
+        if self.polygon is None:
+            lat, lon = self.center
+            nearest = haversine_km(lat, lon, min(max(lat, south), north), min(max(lon, west), east))
+            if nearest > self.radius_km:
+                return None
+            farthest = max(haversine_km(lat, lon, c_lat, c_lon) for c_lat, c_lon in corners)
+            return 'full' if farthest <= self.radius_km else 'partial'
+        vertices = self.polygon
+        crossed = any(_segment_hits_box(vertices[i - 1], vertices[i], south, west, north, east)
+                      for i in range(len(vertices)))
+        if crossed:
+            return 'partial'
+        # No edge reaches the box, so it is either wholly inside or wholly outside.
+        return 'full' if self.contains(*corners[0]) else None
+
+    def as_dict(self):
+        if self.polygon is None:
+            return {'zone_id': self.zone_id, 'name': self.name, 'latitude': self.center[0],
+                    'longitude': self.center[1], 'radius_km': self.radius_km}
+        return {'zone_id': self.zone_id, 'name': self.name, 'polygon': [list(v) for v in self.polygon]}
+
+
+class ZoneIndex:
+    def __init__(self, zones, cell_deg=CELL_DEG):
+        self.zones = tuple(sorted(zones, key=lambda zone: zone.zone_id))
+        self.cell_deg = cell_deg
+        self.cells = {}
+        self.unindexed = []
+        for zone in self.zones:
+            south, west, north, east = zone.bounds()
+            if not all(map(isfinite, (south, west, north, east))):
+                # Saved before zone_from_payload checked for this; one bad row must not break every lookup.
+                logger.warning("Zone %s has non-finite bounds; ignoring it", zone.name)
+                continue
+            rows = range(floor(south / cell_deg), floor(north / cell_deg) + 1)
+            columns = range(floor(west / cell_deg), floor(east / cell_deg) + 1)
+            if len(rows) * len(columns) > MAX_CELLS_PER_ZONE:
+                logger.warning("Zone %s spans %s grid cells; checking it without the index",
+                               zone.name, len(rows) * len(columns))
+                self.unindexed.append(zone)
+                continue
+            for row in rows:
+                for column in columns:
+                    kind = zone.coverage(row * cell_deg, column * cell_deg,
+                                         (row + 1) * cell_deg, (column + 1) * cell_deg)
+                    if kind:
+                        full, partial = self.cells.setdefault((row, column), ([], []))
+                        (full if kind == 'full' else partial).append(zone)
+        self.cells = {key: (tuple(full), tuple(partial)) for key, (full, partial) in self.cells.items()}
+
+    @property
+    def enforced(self):
+        return bool(self.zones)
+
+    def lookup(self, lat, lon):
+        """A zone serving the point (whole-cell zones first, then by id), or None."""
+        entry = self.cells.get((floor(lat / self.cell_deg), floor(lon / self.cell_deg)))
+        if entry:
+            full, partial = entry
+            if full:
+                return full[0]
+            for zone in partial:
+                if zone.contains(lat, lon):
+                    return zone
+        for zone in self.unindexed:
+            if zone.contains(lat, lon):
+                return zone
+        return None
+
+
+class ZoneCache:
+    def __init__(self, version_file=None):
+        self._version_file = VersionFile(version_file)
+        self._lock = threading.Lock()
+        self._version = None
+        self._index = None
+
+    def init_app(self, app):
+        self._version_file.configure(app.config.get('ZONES_VERSION_FILE')
+                                     or os.path.join(app.instance_path, 'zones.version'))
+        app.extensions['zone_cache'] = self
+
+    def version(self):
+        return self._version_file.read()
+
+    def bump(self):
+        """Start a new zone version; call after committing a zone change."""
+        token = self._version_file.bump()
+        with self._lock:
+            self._version = self._index = None
+        return token
+
+    def index(self):
+        version = self.version()
+        with self._lock:
+            if self._version == version:
+                return self._index
+        started = time.perf_counter()
+        index = ZoneIndex(Zone.from_model(zone) for zone in DeliveryZone.query.filter_by(active=True).all())
+        logger.info("Built delivery zone index: %s zones, %s cells in %.1f ms", len(index.zones),
+                    len(index.cells), (time.perf_counter() - started) * 1000)
+        with self._lock:
+            self._version, self._index = version, index
+        return index
+
+
+zone_cache = ZoneCache()
+
+
+def valid_point(lat, lon):
+    return isfinite(lat) and isfinite(lon) and -90 <= lat <= 90 and -180 <= lon <= 180
+
+
+def parse_point(lat, lon):
+    """(lat, lon) as floats from request values; ValueError unless finite and on the globe."""
+    try:
+        lat, lon = float(lat), float(lon)
+    except (TypeError, ValueError):
+        raise ValueError('coordinates must be numbers')
+    if not valid_point(lat, lon):
+        raise ValueError('coordinates must be finite, with latitude within ±90 and longitude within ±180')
+    return lat, lon
+
+
+def check(lat, lon):
+    """
+    (serviceable, zone) for a point; always serviceable while no zones are
+    defined. Callers validate with parse_point() first; an invalid point is
+    never serviceable.
+    """
+    if not valid_point(lat, lon):
+        return False, None
+    index = zone_cache.index()
+    if not index.enforced:
+        return True, None
+    zone = index.lookup(lat, lon)
+    return zone is not None, zone
+
+
+def zone_from_payload(data):
+    """A new DeliveryZone from {'name', 'latitude', 'longitude', 'radius_km'} or {'name', 'polygon'}."""
+    name = (data.get('name') or '').strip()
+    if not name:
+        raise ValueError('name is required')
+    if data.get('polygon') is not None:
+        vertices = [(float(lat), float(lon)) for lat, lon in data['polygon']]
+        if len(vertices) < 3:
+            raise ValueError('a polygon needs at least 3 vertices')
+        if not all(valid_point(lat, lon) for lat, lon in vertices):
+            raise ValueError('polygon vertices must be valid coordinates')
+        return DeliveryZone(name=name, polygon=json.dumps(vertices))
+    lat, lon, radius = float(data['latitude']), float(data['longitude']), float(data['radius_km'])
+    if not valid_point(lat, lon) or not (isfinite(radius) and 0 < radius <= MAX_RADIUS_KM):
+        raise ValueError(f'latitude/longitude must be valid and radius_km between 0 and {MAX_RADIUS_KM:.0f}')
+    return DeliveryZone(name=name, center_latitude=lat, center_longitude=lon, radius_km=radius)
+
+
+def classify_locations(batch_size=5000, unserviceable_limit=1000):
+    """Run every DeliveryLocation through the index in one keyset-paginated pass."""
+    index = zone_cache.index()
+    by_zone, unserviceable, total, outside = {}, [], 0, 0
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            select(DeliveryLocation.location_id, DeliveryLocation.latitude, DeliveryLocation.longitude)
+            .where(DeliveryLocation.location_id > last_id)
+            .order_by(DeliveryLocation.location_id).limit(batch_size)).all()
+        if not rows:
+            break
+        for location_id, lat, lon in rows:
+            zone = index.lookup(lat, lon) if index.enforced else None
+            if zone is not None:
+                by_zone[zone.name] = by_zone.get(zone.name, 0) + 1
+            elif index.enforced:
+                outside += 1
+                if len(unserviceable) < unserviceable_limit:
+                    unserviceable.append(location_id)
+        total += len(rows)
+        last_id = rows[-1].location_id
+    return {
+        'enforced': index.enforced,
+        'locations': total,
+        'serviceable': total - outside,
+        'unserviceable': outside,
+        'by_zone': by_zone,
+        'unserviceable_location_ids': unserviceable,
+    }